@@ -1,7 +1,18 @@
 from .constants import *
-from .manager import ProcessManager
-from .process import Process
-from .units import Size
 
 VERSION = "0.0.4"
-   
\ No newline at end of file
+
+_LAZY = {
+    "ProcessManager": ".manager",
+    "Process": ".process",
+    "Size": ".units",
+}
+
+
+def __getattr__(name):
+    # The server-side modules pull in psutil, subprocess and asyncio, which
+    # the command line client doesn't need, so they're only imported on use
+    if name in _LAZY:
+        import importlib
+        return getattr(importlib.import_module(_LAZY[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
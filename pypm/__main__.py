@@ -1,15 +1,15 @@
-import argparse
+import json
 import os
+import shlex
 import socket
-import struct
 import sys
 
-import termtables as tt
-from colorama import Fore, Style
-
 from . import constants as const
-from .process import Process
-from .units import Size
+from .client import (OUTPUT_FORMATS, color, isdata, print_msg,
+                     process_cpu_command, process_health_command,
+                     process_mem_command, process_pid_command,
+                     process_uptime_command, send_command,
+                     set_output_format, stream_command, write_records)
 
 DEBUG = os.environ.get("PYPMDEBUG")
 if DEBUG is None: DEBUG = False
@@ -26,7 +26,18 @@ commands = [
     "status",
     "list",
     "start",
-    "monit"
+    "monit",
+    "bench",
+    "selfstats",
+    "profile",
+    "logs",
+    "run",
+    "jobs",
+    "sched",
+    "alert",
+    "metrics",
+    "export",
+    "import"
 ]
 commands.sort()
 
@@ -39,15 +50,8 @@ Positional arguments:
 For additional help use python -m pypm CMD --help
 """
 
-def color(text, color):
-    """Adds color to given text."""
-    return f"{color}{text}{Style.RESET_ALL}"
-
-def isdata(bytearr):
-    """Returns True if the given data is an encoded string or binary data"""
-    return bytearr[0] == const.DATA_CODE[0]
-
 def get_start_parser():
+    import argparse
     parser = argparse.ArgumentParser(prog="python -m pypm init")
     parser.add_argument("--port", 
                         type=int, 
@@ -61,9 +65,23 @@ def get_start_parser():
                         type=int, 
                         default=30, 
                         help="Logging frequency (per minute)")
+    parser.add_argument("--memmetric",
+                        type=str,
+                        default="rss",
+                        choices=const.MEMORY_METRICS,
+                        help="Default memory metric")
+    parser.add_argument("--maxjobs",
+                        type=int,
+                        default=4,
+                        help="Maximum number of jobs running at once")
+    parser.add_argument("--async",
+                        dest="use_async",
+                        action="store_true",
+                        help="Run everything on a single asyncio loop (scales to many processes on one thread)")
     return parser
 
 def get_cmd_parser(cmd):
+    import argparse
     parser = argparse.ArgumentParser(prog="python -m pypm", 
                                      usage=f"usage: python -m pypm {cmd} \
 [-h] [--port PORT] [--host HOST] [ARGS [ARGS ...]]")
@@ -79,18 +97,166 @@ def get_cmd_parser(cmd):
                         type=str, 
                         default="localhost", 
                         help="Host")
+    parser.add_argument("--output",
+                        type=str,
+                        default="text",
+                        choices=OUTPUT_FORMATS,
+                        help="Output format")
+    if cmd in ("add", "run"):
+        parser.add_argument("--tree",
+                            action="store_true",
+                            help="Account for the usage of all descendants")
+        parser.add_argument("--mem-metric",
+                            type=str,
+                            choices=const.MEMORY_METRICS,
+                            help="Memory metric (defaults to the one pypm was started with)")
+        parser.add_argument("--liveness",
+                            type=str,
+                            help="Liveness probe (tcp:[HOST:]PORT, http://URL or exec:COMMAND), restarts the process when failing")
+        parser.add_argument("--readiness",
+                            type=str,
+                            help="Readiness probe (tcp:[HOST:]PORT, http://URL or exec:COMMAND)")
+        parser.add_argument("--probe-period",
+                            type=float,
+                            help="Seconds between probe checks")
+        parser.add_argument("--probe-timeout",
+                            type=float,
+                            help="Seconds before a probe check fails")
+        parser.add_argument("--probe-threshold",
+                            type=int,
+                            help="Consecutive failed checks before a probe is failing")
+        parser.add_argument("--depends-on",
+                            type=str,
+                            help="Comma-separated processes that must be ready before this one starts")
+        parser.add_argument("--output-policy",
+                            type=str,
+                            choices=("drop-oldest", "sample", "block"),
+                            help="What to do with output once its buffer is full")
+        parser.add_argument("--output-buffer",
+                            type=int,
+                            help="Bytes of output held between reads (default 1MB)")
+        parser.add_argument("--env",
+                            type=str,
+                            action="append",
+                            metavar="KEY=VALUE",
+                            help="Environment variable for the process (can be repeated)")
+        parser.add_argument("--cwd",
+                            type=str,
+                            help="Working directory of the process (defaults to the current one)")
+        parser.add_argument("--overlap",
+                            type=str,
+                            choices=("skip", "queue"),
+                            help="What to do when a job is due while it is still running (default skip)")
+        parser.add_argument("--watch",
+                            type=str,
+                            metavar="PATHS",
+                            help="Comma-separated files or directories whose changes restart the process")
+        parser.add_argument("--ignore",
+                            type=str,
+                            metavar="GLOBS",
+                            help="Comma-separated patterns of watched paths to ignore")
+        parser.add_argument("--stop-signal",
+                            type=str,
+                            help="Signal asking the process to stop (default TERM)")
+        parser.add_argument("--grace",
+                            type=float,
+                            help="Seconds the process has to stop before it is killed (default 10)")
+    if cmd in ("add", "run", "sched"):
+        parser.add_argument("--cpus",
+                            type=str,
+                            help="CPUs the process may run on (e.g. 0-3,6 or all)")
+        parser.add_argument("--nice",
+                            type=str,
+                            help="Niceness, from -20 (highest priority) to 19")
+        parser.add_argument("--ionice",
+                            type=str,
+                            help="I/O priority: idle, best-effort[:0-7], realtime[:0-7] or none")
+    if cmd == "add":
+        parser.add_argument("--cron",
+                            type=str,
+                            help="Run as a job on this schedule (e.g. \"*/5 * * * *\" or @hourly)")
+    elif cmd == "alert":
+        parser.add_argument("--action",
+                            type=str,
+                            help="What to do when the alert fires: log (the default), restart, webhook:URL or exec:COMMAND")
+    elif cmd == "metrics":
+        parser.add_argument("--metric",
+                            type=str,
+                            default="cpu",
+                            choices=tuple(const.METRIC_FILES),
+                            help="Logged metric")
+        parser.add_argument("--since",
+                            type=str,
+                            help="Start of the history (e.g. 6h, a UNIX timestamp or an ISO date, default 1h)")
+        parser.add_argument("--until",
+                            type=str,
+                            help="End of the history (default now)")
+        parser.add_argument("--step",
+                            type=str,
+                            help="Width of each point (e.g. 30s or 1m, default about 500 points)")
+        parser.add_argument("--agg",
+                            type=str,
+                            default="avg",
+                            help="Comma-separated aggregates of each point: avg, min, max, sum, count, last or pNN")
+    elif cmd == "status":
+        parser.add_argument("--sched",
+                            action="store_true",
+                            help="Also read the context switches and CPU migrations of every process (json and ndjson output)")
+    elif cmd == "logs":
+        parser.add_argument("--grep",
+                            type=str,
+                            help="Regular expression the lines must match")
+        parser.add_argument("--level",
+                            type=str,
+                            choices=("debug", "info", "warning", "error", "critical"),
+                            help="Minimum level of the lines")
+        parser.add_argument("--since",
+                            type=str,
+                            help="Only lines since then (e.g. 10m, 2h, a UNIX timestamp or an ISO date)")
+        parser.add_argument("--stream",
+                            type=str,
+                            choices=("stdout", "stderr"),
+                            help="Only lines of this stream")
+        parser.add_argument("--limit",
+                            type=int,
+                            help="Only the last LIMIT lines")
+        parser.add_argument("--merge",
+                            action="store_true",
+                            help="Interleave the output of several processes in time order")
     return parser
 
-def print_msg(text):
-    """Prints the given text, coloring it based on the first word"""
-    if text.startswith("Error:"):
-        print(color(text, Fore.RED))
-    elif text.startswith("Warning:"):
-        print(color(text, Fore.YELLOW))
-    else:
-        print(text)
+def get_log_filters(args):
+    """Collects the log filters given on the command line"""
+    filters = {}
+    for option in ("grep", "level", "since", "stream", "limit", "merge"):
+        value = getattr(args, option, None)
+        if value is not None and value is not False:
+            filters[option] = value
+    return filters
+
+def get_metrics_options(args):
+    """Collects the metrics query given on the command line"""
+    options = {}
+    for option in ("metric", "since", "until", "step", "agg"):
+        value = getattr(args, option, None)
+        if value is not None:
+            options[option] = value
+    return options
+
+def get_alert_options(args):
+    """Collects the alert options given on the command line"""
+    return {"action": args.action} if args.action is not None else {}
 
-def process_command(cmd, args, host, port):
+def get_process_options(args):
+    """Collects the process options given on the command line"""
+    options = {}
+    for option in const.PROCESS_OPTIONS + ("cwd",):
+        value = getattr(args, option, None)
+        if value is not None and value is not False:
+            options[option] = value
+    return options
+
+def process_command(cmd, args, host, port, options=None):
     """Processes a given command
 
     Args:
@@ -98,6 +264,8 @@ def process_command(cmd, args, host, port):
         args (list): List of command arguments
         host (str): Remote host to connect to
         port (int): Network port
+        options (dict, optional): Process options (for the add command) or
+        log filters (for the logs command). Defaults to None.
     """
     try:
         if cmd == "stop":
@@ -111,7 +279,7 @@ def process_command(cmd, args, host, port):
                 return
             if len(args) > 4:
                 print_msg("Error: Too many arguments")
-            process_add_command(args, host, port)
+            process_add_command(args, host, port, options)
         elif cmd == "start":
             if len(args) > 1:
                 print_msg("Error: Invalid number of arguments")
@@ -136,7 +304,7 @@ def process_command(cmd, args, host, port):
             if len(args) > 1:
                 print_msg("Error: Invalid number of arguments")
                 return
-            process_status_command(args, host, port)     
+            process_status_command(args, host, port, options)
         elif cmd == "list":
             if len(args) != 0:
                 print_msg("Error: Invalid number of arguments")
@@ -147,6 +315,50 @@ def process_command(cmd, args, host, port):
                 print_msg("Error: Invalid number of arguments")
                 return
             process_monit_command(args, host, port)
+        elif cmd == "logs":
+            if len(args) == 0 or (len(args) > 1 and not options.get("merge")):
+                print_msg("Error: Invalid number of arguments (use --merge for several processes)")
+                return
+            process_logs_command(args, host, port, options)
+        elif cmd == "selfstats":
+            if len(args) != 0:
+                print_msg("Error: Invalid number of arguments")
+                return
+            process_selfstats_command(args, host, port)
+        elif cmd == "profile":
+            if len(args) > 2:
+                print_msg("Error: Invalid number of arguments (use profile [SECONDS] [sample|cprofile])")
+                return
+            process_profile_command(args, host, port)
+        elif cmd == "run":
+            if len(args) not in (1, 2):
+                print_msg("Error: Invalid number of arguments (use run NAME [COMMAND])")
+                return
+            process_run_command(args, host, port, options)
+        elif cmd == "sched":
+            if len(args) != 1:
+                print_msg("Error: Invalid number of arguments")
+                return
+            process_sched_command(args, host, port, options)
+        elif cmd == "alert":
+            usage = "use alert add NAME PROCESS CONDITION, alert rem NAME or alert list"
+            if len(args) == 0 or args[0] not in ("add", "rem", "list"):
+                print_msg(f"Error: Invalid arguments ({usage})")
+                return
+            if len(args) != {"add": 4, "rem": 2, "list": 1}[args[0]]:
+                print_msg(f"Error: Invalid number of arguments ({usage})")
+                return
+            process_alert_command(args, host, port, options)
+        elif cmd == "metrics":
+            if len(args) != 1:
+                print_msg("Error: Invalid number of arguments")
+                return
+            process_metrics_command(args, host, port, options)
+        elif cmd == "jobs":
+            if len(args) != 0:
+                print_msg("Error: Invalid number of arguments")
+                return
+            process_jobs_command(args, host, port)
             
     except ConnectionRefusedError:
         print_msg("Error: pypm is not running")
@@ -166,8 +378,13 @@ def process_monit_command(args, host, port):
             app.add_process(name, proc)
     app.start()
         
-def process_status_command(args, host, port):
+def process_status_command(args, host, port, options=None):
     """Prints the status table for a given process/list of processes"""
+    from . import client
+    if client.output_format != "text":
+        extra = ["sched=True"] if (options or {}).get("sched") else []
+        process_status_records(args + extra, host, port)
+        return
     mem = process_mem_command(args, host, port)
     if mem is None:
         return
@@ -183,16 +400,19 @@ def process_status_command(args, host, port):
     uptime = process_uptime_command(args, host, port)
     if uptime is None:
         return
+    health = process_health_command(args, host, port)
+    if health is None:
+        return
         
     lines = []
     for name in mem:
         memory = mem[name]
         if name in pid:
-            active = f"{Fore.GREEN}active{Style.RESET_ALL}"
+            active = color("active", "GREEN")
             p = pid[name]
             if p == -1:
                 p = "N/A"
-                active = f"{Fore.RED}stopped{Style.RESET_ALL}"
+                active = color("stopped", "RED")
         else:
             p = "N/A"
             active = "N/A"
@@ -204,22 +424,46 @@ def process_status_command(args, host, port):
             up = uptime[name]
         else:
             up = "N/A"
+        if name in health:
+            h = format_health(*health[name])
+        else:
+            h = "N/A"
         
-        lines.append([name, p, memory, c, up, active])
+        lines.append([name, p, memory, c, up, active, h])
         
-    header = ["Name", "PID", "Mem.", "CPU", "Uptime", "Status"]
+    header = ["Name", "PID", "Mem.", "CPU", "Uptime", "Status", "Health"]
+    import termtables as tt
     table = tt.to_string(
         lines,
-        header=list(map(lambda c: color(c, Fore.CYAN), header)),
+        header=list(map(lambda c: color(c, "CYAN"), header)),
     )
     print(table)
         
+def process_status_records(args, host, port):
+    """Prints the status of a given process/list of processes as JSON. The
+    server already sends one JSON record per line, which are passed on as 
+    they arrive."""
+    lines = stream_command(const.CMD_STATUS, args, host, port)
+    first = next(lines, b"")
+    if first[:1] != const.DATA_CODE:
+        print_msg((first[1:] + b"".join(lines)).decode())
+        return
+    def records():
+        if len(first) > 1:
+            yield first[1:]
+        yield from lines
+    write_records(records())
+        
 def process_list_command(args, host, port):
     """List all managed processes"""
+    from . import client
     resp = send_command(const.CMD_LIST, args, host, port)
     if isdata(resp):
         strings = resp[1:].decode("utf-8").split("\x00\x00")
-        if strings == ['']:
+        if client.output_format != "text":
+            processes = (l.split("\x00") for l in strings if l)
+            write_records(json.dumps({"name": n, "command": c}).encode() for n, c in processes)
+        elif strings == ['']:
             print_msg("Warning: There are no processes being managed")
         else:
             names, procs = zip(*map(lambda l: l.split("\x00"), strings))
@@ -228,107 +472,252 @@ def process_list_command(args, host, port):
     else:
         print_msg(resp[1:].decode())    
         
-def process_mem_command(args, host, port):
-    """Get the memory usage of a specific process/list of processes"""
-    resp = send_command(const.CMD_GET_MEMORY, args, host, port)
-    if isdata(resp):
-        values = {}
-        i = 0
-        while i+1 < len(resp) and b"\x00" in resp[1+i:]:
-            end = resp[1+i:].index(b"\x00")+1
-            name = resp[1+i:i+end].decode()
-            value = Size(struct.unpack("d", resp[1+i+end:i+end+9])[0])
-            values[name] = value
-            i += end+8
-        return values
-    else:
-        print_msg(resp[1:].decode())
-        return None
+def format_health(liveness, readiness):
+    """Summarizes the status of the probes of a process"""
+    if liveness == "N/A" and readiness == "N/A":
+        return "N/A"
+    if liveness == "failing":
+        return color("unhealthy", "RED")
+    if readiness == "failing":
+        return color("not ready", "YELLOW")
+    if "unknown" in (liveness, readiness):
+        return "unknown"
+    return color("healthy", "GREEN")
     
-def process_cpu_command(args, host, port):
-    """Get the cpu usage of a specific process/list of processes"""
-    resp = send_command(const.CMD_GET_CPU, args, host, port)
-    if isdata(resp):
-        values = {}
-        i = 0
-        while i+1 < len(resp) and b"\x00" in resp[1+i:]:
-            end = resp[1+i:].index(b"\x00")+1
-            name = resp[1+i:i+end].decode()
-            value = struct.unpack("d", resp[1+i+end:i+end+9])[0]
-            values[name] = value
-            i += end+8
-        return values
-    else:
+def process_logs_command(args, host, port, filters=None):
+    """Prints the lines of a process' output that match the given filters,
+    which are applied by the server"""
+    from . import client
+    from .logs import parse_since
+    extra = []
+    for option, value in (filters or {}).items():
+        if option == "since":
+            try:
+                value = parse_since(value)
+            except ValueError as e:
+                print_msg(f"Error: {e}")
+                return
+        extra.append(shlex.quote(f"{option}={value}"))
+    lines = stream_command(const.CMD_LOGS, args + extra, host, port)
+    first = next(lines, b"")
+    if first[:1] != const.DATA_CODE:
+        print_msg((first[1:] + b"".join(lines)).decode())
+        return
+    def records():
+        if len(first) > 1:
+            yield first[1:]
+        yield from lines
+    if client.output_format != "text":
+        write_records(records())
+        return
+    import datetime
+    colors = {"warning": "YELLOW", "error": "RED", "critical": "RED"}
+    for line in records():
+        record = json.loads(line)
+        stamp = datetime.datetime.fromtimestamp(record["time"]).strftime("%H:%M:%S")
+        if "name" in record:
+            text = f"{stamp} {record['name']} {record['stream']} {record['text']}"
+        else:
+            text = f"{stamp} {record['stream']} {record['text']}"
+        print(color(text, colors[record["level"]]) if record["level"] in colors else text)
+        
+def process_selfstats_command(args, host, port):
+    """Prints the daemon's own counters and timings"""
+    from . import client
+    resp = send_command(const.CMD_SELFSTATS, args, host, port)
+    if not isdata(resp):
         print_msg(resp[1:].decode())
-        return None
+        return
+    if client.output_format != "text":
+        print(resp[1:].decode())
+        return
+    from .units import Size
+    stats = json.loads(resp[1:])
+    print_msg(f"Uptime: {stats['uptime']:.0f}s, RSS: {Size(stats['rss'])}, "
+              f"CPU time: {stats['cpu_time']:.2f}s, threads: {stats['threads']}")
+    print_msg(f"Processes: {stats['active']} active out of {stats['processes']}, "
+              f"subscribers: {stats['subscribers']}")
+    lines = []
+    for name, timer in stats["timers"].items():
+        lines.append([name, timer["count"]] + [
+            f"{timer[key]*1000:.3f}ms" for key in ("mean", "p95", "p99", "max", "total")
+        ])
+    if lines:
+        header = ["Timer", "Count", "Mean", "p95", "p99", "Max", "Total"]
+        import termtables as tt
+        print(tt.to_string(lines, header=[color(c, "CYAN") for c in header]))
+    for name, value in stats["counters"].items():
+        print_msg(f"* {name}: {value}")
+        
+def process_profile_command(args, host, port):
+    """Profiles the daemon for a while"""
+    resp = send_command(const.CMD_PROFILE, args, host, port)
+    print_msg(resp[1:].decode())
+        
+def process_run_command(args, host, port, options=None):
+    """Runs a job now. Given a command, it first adds a job that only runs
+    when asked to."""
+    if len(args) == 2:
+        options = dict(options or {}, job=True)
+        resp = add_process(args, host, port, options)
+        if resp is None:
+            return
+        if resp.startswith("Error"):
+            print_msg(resp)
+            return
+    resp = send_command(const.CMD_RUN, args[:1], host, port)
+    print_msg(resp[1:].decode())
     
-def process_pid_command(args, host, port):
-    """Get the PID of a specific process/list of processes"""
-    resp = send_command(const.CMD_GET_PID, args, host, port)
-    if isdata(resp):
-        values = {}
-        i = 0
-        while i+1 < len(resp) and b"\x00" in resp[1+i:]:
-            end = resp[1+i:].index(b"\x00")+1
-            name = resp[1+i:i+end].decode()
-            value = struct.unpack("i", resp[1+i+end:i+end+5])[0]
-            values[name] = value
-            i += end+4
-        return values
-    else:
-        print_msg(resp[1:].decode())
-        return None
+def process_sched_command(args, host, port, options=None):
+    """Shows or changes the scheduling settings of a running process"""
+    extra = [shlex.quote(f"{option}={value}") for option, value in (options or {}).items()]
+    resp = send_command(const.CMD_SCHED, args + extra, host, port)
+    print_msg(resp[1:].decode())
     
-def process_uptime_command(args, host, port):
-    """Get the uptime of a specific process/list of processes"""
-    resp = send_command(const.CMD_GET_UPTIME, args, host, port)
-    if isdata(resp):
-        values = {}
-        i = 0
-        while i+1 < len(resp) and b"\x00" in resp[1+i:]:
-            end = resp[1+i:].index(b"\x00")+1
-            name = resp[1+i:i+end].decode()
-            i += end
-            end = resp[1+i:].index(b"\x00")+1
-            value = resp[1+i:i+end].decode()
-            values[name] = value
-            i += end
-        return values
+def process_alert_command(args, host, port, options=None):
+    """Adds, removes or lists alert rules"""
+    from . import client
+    if args[0] == "add":
+        extra = [shlex.quote(f"{option}={value}") for option, value in (options or {}).items()]
+        resp = send_command(const.CMD_ADD_ALERT, args[1:] + extra, host, port)
+    elif args[0] == "rem":
+        resp = send_command(const.CMD_REMOVE_ALERT, args[1:], host, port)
     else:
-        print_msg(resp[1:].decode())
-        return None
+        resp = send_command(const.CMD_ALERTS, [], host, port)
+        if isdata(resp):
+            rules = json.loads(resp[1:])
+            if client.output_format != "text":
+                write_records(json.dumps(rule).encode() for rule in rules)
+            elif len(rules) == 0:
+                print_msg("Warning: There are no alerts")
+            else:
+                lines = []
+                for rule in rules:
+                    firing = color(", ".join(rule["firing"]), "RED") if rule["firing"] else color("ok", "GREEN")
+                    lines.append([rule["name"], rule["process"], rule["condition"], rule["action"], firing])
+                header = ["Name", "Process", "Condition", "Action", "Firing"]
+                import termtables as tt
+                print(tt.to_string(lines, header=[color(c, "CYAN") for c in header]))
+            return
+    print_msg(resp[1:].decode())
     
-def process_stdout_command(args, host, port):
-    """Gets the last 100 lines of output from the process"""
-    resp = send_command(const.CMD_GET_STDOUT, args, host, port)
-    if isdata(resp):
-        return resp[1:].decode().split("\n")
-    else:
+def process_metrics_command(args, host, port, options=None):
+    """Prints the logged history of a metric of a process, aggregated by the
+    server into points of --step seconds"""
+    from . import client
+    from .logs import parse_since
+    extra = []
+    for option, value in (options or {}).items():
+        if option in ("since", "until"):
+            try:
+                value = parse_since(value)
+            except ValueError as e:
+                print_msg(f"Error: {e}")
+                return
+        extra.append(shlex.quote(f"{option}={value}"))
+    resp = send_command(const.CMD_METRICS, args + extra, host, port)
+    if not isdata(resp):
         print_msg(resp[1:].decode())
-        
-def process_stderr_command(args, host, port):
-    """Gets the last 100 lines of output from the process"""
-    resp = send_command(const.CMD_GET_STDERR, args, host, port)
-    if isdata(resp):
-        return resp[1:].decode().split("\n")
-    else:
+        return
+    if client.output_format != "text":
+        print(resp[1:].decode())
+        return
+    result = json.loads(resp[1:])
+    if len(result["time"]) == 0:
+        print_msg("Warning: Nothing was logged in that time range")
+        return
+    import datetime
+    from .units import Size
+    def fmt(aggregate, value):
+        if aggregate == "count":
+            return str(int(value))
+        if result["metric"] == "mem":
+            return str(Size(value))
+        if result["metric"] == "cpu":
+            return f"{value:.1f}%"
+        return f"{value:g}"
+    aggregates = list(result["values"])
+    for i, timestamp in enumerate(result["time"]):
+        stamp = datetime.datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+        values = "  ".join(f"{a}={fmt(a, result['values'][a][i])}" for a in aggregates)
+        print(f"{stamp}  {values}")
+    
+def process_jobs_command(args, host, port):
+    """Prints the schedule and last run of every job"""
+    from . import client
+    resp = send_command(const.CMD_JOBS, args, host, port)
+    if not isdata(resp):
         print_msg(resp[1:].decode())
+        return
+    jobs = json.loads(resp[1:])
+    if client.output_format != "text":
+        write_records(json.dumps(job).encode() for job in jobs)
+        return
+    if len(jobs) == 0:
+        print_msg("Warning: There are no jobs")
+        return
+    import datetime
+    def when(timestamp):
+        if timestamp is None:
+            return "N/A"
+        return datetime.datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M")
+    lines = []
+    for job in jobs:
+        if job["running"]:
+            status = color("running", "GREEN")
+        elif job["queued"]:
+            status = color("queued", "YELLOW")
+        elif job["last_exit"] not in (None, 0):
+            status = color("failed", "RED")
+        else:
+            status = "idle"
+        duration = f"{job['last_duration']:.2f}s" if job["last_duration"] is not None else "N/A"
+        last_exit = job["last_exit"] if job["last_exit"] is not None else "N/A"
+        lines.append([job["name"], job["cron"] or "on demand", when(job["next_run"]), 
+                      job["runs"], job["skipped"], last_exit, duration, status])
+    header = ["Name", "Schedule", "Next run", "Runs", "Skipped", "Last exit", "Duration", "Status"]
+    import termtables as tt
+    print(tt.to_string(lines, header=[color(c, "CYAN") for c in header]))
         
 def process_stop_command(args, host, port):
     """Closes the pypm server running on the given host"""
     resp = send_command(const.CMD_STOP, args, host, port)
     print_msg(resp[1:].decode())
         
-def process_add_command(args, host, port):
+def process_add_command(args, host, port, options=None):
     """Adds a new process to be managed"""
+    resp = add_process(args, host, port, options)
+    if resp is not None:
+        print_msg(resp)
+        
+def add_process(args, host, port, options=None):
+    """Sends the addproc command.
+
+    Returns:
+        str: The server's reply, or None if the arguments were invalid (in
+        which case the error was already printed)
+    """
     name, command = args[:2]
     log_cpu = args[2] if len(args) >= 3 else "False"
     log_freq = args[3] if len(args) == 4 else "False"
-    dir_ = '"'+os.path.abspath(os.curdir)+'"'
+    options = dict(options or {})
+    dir_ = shlex.quote(os.path.abspath(options.pop("cwd", os.curdir)))
+    if "env" in options:
+        env = {}
+        for variable in options["env"]:
+            key, sep, value = variable.partition("=")
+            if not sep or not key:
+                print_msg(f"Error: Invalid environment variable '{variable}' (use KEY=VALUE)")
+                return None
+            env[key] = value
+        options["env"] = json.dumps(env)
+    extra = []
+    for option, value in options.items():
+        extra.append(shlex.quote(f"{option}={value}"))
     resp = send_command(const.CMD_ADD_PROCESS, 
-                        [name, command, log_cpu, log_freq, dir_], 
+                        [name, command, log_cpu, log_freq, dir_] + extra, 
                         host, port)
-    print_msg(resp[1:].decode())
+    return resp[1:].decode()
         
 def process_restart_command(args, host, port):
     """Restarts a given process/list of processes"""
@@ -350,29 +739,7 @@ def process_remove_command(args, host, port):
     resp = send_command(const.CMD_REMOVE_PROCESS, args, host, port)
     print_msg(resp[1:].decode())
 
-def send_command(cmd, args, host, port):
-    string = ' '.join([cmd]+args)
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.connect((host, port))
-    sock.sendall(string.encode("utf-8"))
-    resp = b""
-    while True:
-        data = sock.recv(2048)
-        if data == b"":
-            break
-        resp += data
-        if len(data) < 2048:
-            break
-    sock.close()
-    return resp
-    
 if __name__ == "__main__":
-    import subprocess
-    import sys
-    
-    from .pypm import main
-    
-    
     if len(sys.argv) >= 2:
         cmd = sys.argv[1]
         sys.argv.pop(1)
@@ -380,7 +747,16 @@ if __name__ == "__main__":
         print_msg(help_text)
         quit()
     
-    if cmd == "init":
+    if cmd == "bench":
+        from .bench import main
+        main(sys.argv[1:], prog="python -m pypm bench")
+
+    elif cmd in ("export", "import"):
+        from .export import main
+        main([cmd] + sys.argv[1:], prog="python -m pypm")
+
+    elif cmd == "init":
+        import subprocess
         
         argparser = get_start_parser()
         args, _ = argparser.parse_known_args()
@@ -390,8 +766,9 @@ if __name__ == "__main__":
         # ! command hangs and prints all output to the terminal window 
         # ! where it was called from
         if DEBUG:
+            from .pypm import main
             try:
-                main(args.port, args.logdir, args.logfreq)
+                main(args.port, args.logdir, args.logfreq, args.memmetric, args.maxjobs, args.use_async)
             except socket.error:
                 print_msg("Error: this port is already in use")
                 quit()
@@ -423,17 +800,28 @@ if __name__ == "__main__":
                                     "pypm.pypm", 
                                     str(args.port), 
                                     str(args.logdir), 
-                                    str(args.logfreq)],
+                                    str(args.logfreq),
+                                    args.memmetric,
+                                    str(args.maxjobs),
+                                    str(args.use_async)],
                     **kwargs).pid
             print_msg(f"Started process manager on port {args.port} with the PID {pid}")
         
     elif cmd in commands:
         argparser = get_cmd_parser(cmd)
         args, _ = argparser.parse_known_args()
-        for a in range(len(args.args)):
-            arg = args.args[a]
-            if " " in arg:
-                args.args[a] = "'"+arg+"'"
-        process_command(cmd, args.args, args.host, args.port)
+        set_output_format(args.output)
+        # The server splits commands like a shell would
+        args.args = [shlex.quote(arg) for arg in args.args]
+        if cmd == "logs":
+            process_command(cmd, args.args, args.host, args.port, get_log_filters(args))
+        elif cmd == "alert":
+            process_command(cmd, args.args, args.host, args.port, get_alert_options(args))
+        elif cmd == "metrics":
+            process_command(cmd, args.args, args.host, args.port, get_metrics_options(args))
+        elif cmd == "status":
+            process_command(cmd, args.args, args.host, args.port, {"sched": args.sched})
+        else:
+            process_command(cmd, args.args, args.host, args.port, get_process_options(args))
     else:
         print_msg(help_text)
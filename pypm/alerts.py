@@ -0,0 +1,302 @@
+import operator
+import re
+import threading
+import time
+
+FIRING = "firing"
+RESOLVED = "resolved"
+METRICS = ("cpu", "mem")
+ALL = "*"
+
+_OPS = {">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le}
+_UNITS = {"": 1, "%": 1, "b": 1, "kb": 2**10, "mb": 2**20, "gb": 2**30, "tb": 2**40}
+_DURATIONS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+_DURATION = r"\d+(?:\.\d+)?[smhd]"
+_CONDITION_RE = re.compile(
+    rf"(?:rate\(\s*(?P<rate>cpu|mem)\s*(?:,\s*(?P<window>{_DURATION}))?\s*\)|(?P<metric>cpu|mem))"
+    rf"\s*(?P<op>>=|<=|>|<)\s*(?P<value>\d+(?:\.\d+)?)\s*(?P<unit>[a-z%]*)(?:/s)?"
+    rf"(?:\s+for\s+(?P<for>{_DURATION}))?",
+    re.IGNORECASE
+)
+
+
+def parse_duration(text):
+    """Parses a duration like '30s', '5m', '2h' or '1d' into seconds"""
+    if not re.fullmatch(_DURATION, text):
+        raise ValueError(f"Invalid duration '{text}'")
+    return float(text[:-1]) * _DURATIONS[text[-1]]
+
+def parse_action(text):
+    """Checks an action: 'log', 'restart', 'webhook:URL' or 'exec:COMMAND'.
+
+    Raises:
+        ValueError: If the action is invalid
+
+    Returns:
+        tuple: (kind, argument)
+    """
+
+    kind, _, arg = text.partition(":")
+    if kind in ("log", "restart") and not arg:
+        return kind, None
+    if kind == "webhook" and arg.startswith(("http://", "https://")):
+        return kind, arg
+    if kind == "exec" and arg:
+        return kind, arg
+    raise ValueError(f"Invalid action '{text}' (use log, restart, webhook:URL or exec:COMMAND)")
+
+
+class Condition:
+    def __init__(self, spec):
+        """A condition on the samples of a process: a metric (cpu, in percent,
+        or mem, in bytes) or its rate of change per second over a window,
+        compared with a threshold, that has to hold for some time before it
+        counts. For example 'mem > 2GB', 'cpu > 90 for 5m' or
+        'rate(mem, 10m) > 1MB'.
+
+        Raises:
+            ValueError: If the condition is invalid
+        """
+
+        match = _CONDITION_RE.fullmatch(spec.strip())
+        if match is None:
+            raise ValueError(f"Invalid condition '{spec}'")
+        unit = match["unit"].lower()
+        if unit not in _UNITS:
+            raise ValueError(f"Invalid unit '{match['unit']}'")
+        self.spec = spec
+        self.metric = (match["rate"] or match["metric"]).lower()
+        self.rate = match["rate"] is not None
+        self.window = parse_duration(match["window"]) if match["window"] else 60
+        self.compare = _OPS[match["op"]]
+        self.threshold = float(match["value"]) * _UNITS[unit]
+        self.duration = parse_duration(match["for"]) if match["for"] else 0
+
+    def __repr__(self):
+        return self.spec
+
+
+class RateWindow:
+    __slots__ = ("window", "_times", "_values", "_next")
+
+    def __init__(self, window, buckets=8):
+        """Rate of change of a value over a sliding window, in constant
+        space: one sample is kept per window/buckets seconds, in a ring, so
+        the rate is measured over (roughly) the last window seconds however
+        often the value is sampled."""
+        self.window = window
+        self._times = [None] * buckets
+        self._values = [0.0] * buckets
+        self._next = 0
+
+    def add(self, timestamp, value):
+        """Adds a sample.
+
+        Returns:
+            float: Rate per second, or None until the samples span half the
+            window
+        """
+
+        buckets = len(self._times)
+        last = self._times[self._next - 1]
+        if last is None or timestamp - last >= self.window / buckets:
+            self._times[self._next] = timestamp
+            self._values[self._next] = value
+            self._next = (self._next + 1) % buckets
+        oldest = self._next if self._times[self._next] is not None else 0
+        elapsed = timestamp - self._times[oldest]
+        if elapsed < self.window / 2:
+            return None
+        return (value - self._values[oldest]) / elapsed
+
+
+class _State:
+    __slots__ = ("since", "firing", "value", "rate")
+
+    def __init__(self, rate=None):
+        self.since = None
+        self.firing = False
+        self.value = None
+        self.rate = rate
+
+
+class Rule:
+    def __init__(self, name, process, condition, action="log"):
+        """An alert on the samples of a process (or of every process, if
+        process is '*'), which fires when its condition starts holding and
+        resolves when it stops.
+
+        Args:
+            name (str): Name of the rule
+            process (str): Process name or '*'
+            condition (str): See Condition
+            action (str, optional): What to do when it fires (see
+            parse_action). Defaults to 'log'.
+
+        Raises:
+            ValueError: If the condition or action is invalid
+        """
+
+        self.name = name
+        self.process = process
+        self.condition = Condition(condition)
+        self.action = action
+        self.action_kind, self.action_arg = parse_action(action)
+        self._states = {}
+
+    def evaluate(self, process, timestamp, cpu, mem):
+        """Updates the rule with a new sample.
+
+        Returns:
+            str: FIRING or RESOLVED if the rule changed state, otherwise None
+        """
+
+        cond = self.condition
+        state = self._states.get(process)
+        if state is None:
+            state = self._states[process] = _State(RateWindow(cond.window) if cond.rate else None)
+        value = cpu if cond.metric == "cpu" else mem
+        if state.rate is not None:
+            value = state.rate.add(timestamp, value)
+            if value is None:
+                return None
+        state.value = value
+        if cond.compare(value, cond.threshold):
+            if state.since is None:
+                state.since = timestamp
+            if not state.firing and timestamp - state.since >= cond.duration:
+                state.firing = True
+                return FIRING
+        else:
+            state.since = None
+            if state.firing:
+                state.firing = False
+                return RESOLVED
+        return None
+
+    def forget(self, process):
+        """Drops the state of a process.
+
+        Returns:
+            bool: True if the rule was firing for it
+        """
+        state = self._states.pop(process, None)
+        return state is not None and state.firing
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "process": self.process,
+            "condition": self.condition.spec,
+            "action": self.action,
+            "firing": sorted(p for p, s in self._states.items() if s.firing),
+            "values": {p: s.value for p, s in self._states.items() if s.value is not None}
+        }
+
+
+class AlertEngine:
+    def __init__(self, budget=0.005):
+        """Evaluates alert rules on samples as they come in. Rules are
+        indexed by process, and each keeps a constant amount of state per
+        process, so a sample only costs the evaluation of its own rules.
+
+        Args:
+            budget (float, optional): Seconds evaluate may take per call.
+            Samples left over are evaluated on the next call (only the
+            latest sample of each process is kept). Defaults to 5ms.
+        """
+
+        self.budget = budget
+        self._lock = threading.Lock()
+        self._rules = {}
+        self._by_process = {}
+        self._samples = {}
+
+    def __len__(self):
+        return len(self._rules)
+
+    @property
+    def backlog(self):
+        """Number of processes whose latest sample wasn't evaluated yet"""
+        return len(self._samples)
+
+    def add(self, rule):
+        """Adds a rule, returning False if there is one with the same name"""
+        with self._lock:
+            if rule.name in self._rules:
+                return False
+            self._rules[rule.name] = rule
+            self._by_process.setdefault(rule.process, []).append(rule)
+            return True
+
+    def remove(self, name):
+        """Removes a rule, returning it (None if there was none)"""
+        with self._lock:
+            rule = self._rules.pop(name, None)
+            if rule is not None:
+                rules = self._by_process[rule.process]
+                rules.remove(rule)
+                if not rules:
+                    del self._by_process[rule.process]
+            return rule
+
+    def rules(self):
+        with self._lock:
+            return list(self._rules.values())
+
+    def watches(self, process):
+        """True if any rule applies to the process"""
+        return ALL in self._by_process or process in self._by_process
+
+    def forget(self, process):
+        """Drops the state of a removed process"""
+        with self._lock:
+            self._samples.pop(process, None)
+            for rule in self._by_process.get(process, []) + self._by_process.get(ALL, []):
+                rule.forget(process)
+
+    def reset(self, process):
+        """Starts over for a process that stopped, resolving the rules that
+        were firing for it.
+
+        Returns:
+            list: (rule, process, RESOLVED, None) for every rule that was
+            firing
+        """
+
+        with self._lock:
+            self._samples.pop(process, None)
+            rules = self._by_process.get(process, []) + self._by_process.get(ALL, [])
+            return [(rule, process, RESOLVED, None) for rule in rules if rule.forget(process)]
+
+    def observe(self, process, timestamp, cpu, mem):
+        """Queues a sample, replacing any that wasn't evaluated yet"""
+        if not self.watches(process):
+            return
+        with self._lock:
+            # Moved to the back, so every process gets its turn
+            self._samples.pop(process, None)
+            self._samples[process] = (timestamp, cpu, mem)
+
+    def evaluate(self, budget=None):
+        """Evaluates queued samples until there are none left or the budget
+        runs out.
+
+        Returns:
+            list: (rule, process, FIRING or RESOLVED, value) for every rule
+            that changed state
+        """
+
+        deadline = time.perf_counter() + (self.budget if budget is None else budget)
+        changes = []
+        with self._lock:
+            while self._samples:
+                process = next(iter(self._samples))
+                timestamp, cpu, mem = self._samples.pop(process)
+                for rule in self._by_process.get(process, []) + self._by_process.get(ALL, []):
+                    status = rule.evaluate(process, timestamp, cpu, mem)
+                    if status is not None:
+                        changes.append((rule, process, status, rule._states[process].value))
+                if time.perf_counter() >= deadline:
+                    break
+        return changes
@@ -0,0 +1,381 @@
+import asyncio
+import logging
+import os
+import shlex
+import sys
+import threading
+import time
+import warnings
+
+from . import constants as const
+from .manager import ProcessManager, command_timer
+from .startup import start_all_async
+
+
+def watch_children(loop):
+    """Makes asyncio wait for the children of a loop through pidfds (a file
+    descriptor each, polled by the loop) rather than through a thread per
+    child, which is its default before Python 3.12"""
+    if sys.version_info >= (3, 12) or not hasattr(os, "pidfd_open"):
+        return
+    try:
+        os.close(os.pidfd_open(os.getpid()))
+    except OSError:
+        # The kernel is too old
+        return
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        watcher = asyncio.PidfdChildWatcher()
+        watcher.attach_loop(loop)
+        asyncio.set_child_watcher(watcher)
+
+
+class _Connection:
+    __slots__ = ("writer", "limit")
+
+    def __init__(self, writer):
+        """Gives the stream of a client the part of the socket interface used
+        by the command handlers and the event bus, so they run unchanged on
+        the loop. Writes are buffered by the loop, and a client that lets
+        more than its limit pile up (a subscriber, or one not reading a long
+        reply) is dropped, like one timing out on a socket would be."""
+        self.writer = writer
+        # Roughly what a second of events can be
+        self.limit = 2**20
+
+    def settimeout(self, timeout):
+        # Writes never block anyway
+        pass
+
+    def sendall(self, data):
+        if self.writer.is_closing():
+            raise ConnectionResetError("Client went away")
+        if self.writer.transport.get_write_buffer_size() > self.limit:
+            raise TimeoutError("Client isn't reading")
+        self.writer.write(data)
+
+    def send(self, data):
+        # The transport takes everything, and buffers what it can't write
+        self.sendall(bytes(data))
+        return len(data)
+
+    async def drain(self):
+        await self.writer.drain()
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncProcessManager(ProcessManager):
+    def __init__(self, *args, **kwargs):
+        """A ProcessManager whose whole core runs on a single asyncio loop:
+        children are spawned through the loop and their pipes are read by its
+        tasks, clients are served by an asyncio server, and sampling, logging
+        and jobs run on timers. Since everything that touches the processes
+        runs on the loop, nothing races, and the number of threads doesn't
+        grow with the number of children (the loop's, plus the file
+        watcher's if files are watched, an idle one of asyncio's and the
+        ones of the executor running alert actions).
+
+        Commands that wait for processes (start, restart, kill and rem) are
+        coroutines, as are the ones sending long replies (status and logs),
+        which wait for the client to read each batch. The others are the
+        handlers of ProcessManager. Each process has a lock, so it is never started or stopped twice at once.
+        """
+
+        super().__init__(*args, **kwargs)
+        self._loop = None
+        self._server = None
+        self._locks = {}
+        # Created by run, on the loop
+        self._stopped = None
+        # Jobs the scheduler asked to start, spawned right after its tick
+        self._due = []
+        self._jobs.start = self._due.append
+        self._async_commands = {
+            const.CMD_START_PROCESS: self._process_command_start_proc_async,
+            const.CMD_RESTART_PROCESS: self._process_command_restart_proc_async,
+            const.CMD_KILL_PROCESS: self._process_command_kill_proc_async,
+            const.CMD_REMOVE_PROCESS: self._process_command_rem_proc_async,
+            const.CMD_STATUS: self._process_status_cmd_async,
+            const.CMD_LOGS: self._process_logs_cmd_async
+        }
+
+    def _lock(self, process):
+        lock = self._locks.get(process.name)
+        if lock is None:
+            lock = self._locks[process.name] = asyncio.Lock()
+        return lock
+
+    def rem_process(self, process):
+        super().rem_process(process)
+        self._locks.pop(process.name, None)
+
+    async def start_process(self, process):
+        async with self._lock(process):
+            await process.start_async()
+
+    async def stop_process(self, process):
+        async with self._lock(process):
+            await process.stop_async()
+
+    async def start_processes_async(self, processes):
+        """Same as start_processes, on the loop"""
+        return await start_all_async(processes, self.start_process, self.start_timeout)
+
+    async def stop_processes_async(self, processes):
+        """Same as stop_processes, on the loop"""
+        active = [p for p in processes if p.active]
+        for process in active:
+            process.terminate()
+        await asyncio.gather(*(self.stop_process(p) for p in active))
+
+    async def restart_process_async(self, process):
+        try:
+            async with self._lock(process):
+                if self._stop:
+                    return
+                if process.active:
+                    await process.stop_async()
+                await process.start_async()
+        except Exception:
+            logging.exception(f"Couldn't restart '{process.name}'")
+
+    def restart_process(self, process):
+        """Restarts a process on the loop. Unlike the one of ProcessManager,
+        it can be called from any thread (as probes, alerts and watched files
+        do), and returns at once."""
+        asyncio.run_coroutine_threadsafe(self.restart_process_async(process), self._loop)
+
+    async def _start_due_jobs(self):
+        due = list(self._due)
+        self._due.clear()
+        results = await asyncio.gather(*(self.start_process(p) for p in due), return_exceptions=True)
+        for process, result in zip(due, results):
+            if isinstance(result, Exception):
+                # Seen as a run that finished at once, with no exit code
+                logging.warning(f"Couldn't start job '{process.name}': {result}")
+
+    async def _handle_client(self, reader, writer):
+        conn = _Connection(writer)
+        try:
+            command = (await reader.read(2048)).decode("utf-8")
+            if await self._process_command_async(command, conn):
+                # Subscribed, so kept open until the client goes away
+                while await reader.read(4096):
+                    pass
+            await writer.drain()
+        except (ConnectionError, UnicodeDecodeError):
+            self._stats.count("command.reset")
+        finally:
+            writer.close()
+
+    async def _process_command_async(self, command, sock):
+        """Same as _process_command, awaiting the commands that wait for
+        processes"""
+        try:
+            argv = shlex.split(command)
+        except ValueError:
+            argv = None
+        handler = self._async_commands.get(argv[0]) if argv else None
+        if handler is None:
+            return self._process_command(command, sock)
+        start = time.perf_counter()
+        try:
+            await handler(argv, sock)
+        finally:
+            self._stats.observe(command_timer(argv[0]), time.perf_counter() - start)
+        return False
+
+    async def _process_command_start_proc_async(self, command, sock):
+        try:
+            if not (1 <= len(command) <= 2):
+                sock.sendall(const.MSG_CODE+b"Error: Invalid number of arguments")
+                return
+            if len(command) == 2:
+                name = command[1]
+                process = self.get_process(name)
+                if process is None:
+                    sock.sendall(const.MSG_CODE+b"Error: Couldn't find process '" + name.encode() + b"'")
+                    return
+                if process.job is not None:
+                    self._process_run_cmd(command, sock)
+                elif process.active:
+                    sock.sendall(const.MSG_CODE+b"Warning: Process was already running, so nothing was done")
+                else:
+                    await self.start_processes_async(self.with_dependencies(process))
+                    if process.active:
+                        sock.sendall(const.MSG_CODE+b"Successfully started process '" + name.encode() + b"'")
+                    else:
+                        sock.sendall(const.MSG_CODE+b"Error: Couldn't start process '" + name.encode() + b"'")
+            else:
+                services = self.services
+                if len(services) == 0:
+                    sock.sendall(const.MSG_CODE+b"Warning: No processes to start")
+                    return
+                started, _ = await self.start_processes_async([p for p in services if not p.active])
+                if len(started) == 0:
+                    sock.sendall(const.MSG_CODE+b"Warning: No processes were started")
+                else:
+                    sock.sendall(const.MSG_CODE+f"Started {len(started)} out of {len(services)} processes".encode())
+        except Exception:
+            sock.sendall(const.MSG_CODE+b"Error: Couldn't start process")
+
+    async def _process_command_restart_proc_async(self, command, sock):
+        try:
+            if not (1 <= len(command) <= 2):
+                sock.sendall(const.MSG_CODE+b"Error: Invalid number of arguments")
+                return
+            if len(command) == 2:
+                name = command[1]
+                process = self.get_process(name)
+                if process is None:
+                    sock.sendall(const.MSG_CODE+b"Error: Couldn't find process '" + name.encode() + b"'")
+                    return
+                if process.job is not None:
+                    sock.sendall(const.MSG_CODE+b"Error: '" + name.encode() + b"' is a job (use run)")
+                    return
+                async with self._lock(process):
+                    if process.active:
+                        await process.stop_async()
+                    await process.start_async()
+                sock.sendall(const.MSG_CODE+b"Successfully restarted process '" + name.encode() + b"'")
+            else:
+                services = self.services
+                if len(services) == 0:
+                    sock.sendall(const.MSG_CODE+b"Warning: No processes to restart")
+                    return
+                await self.stop_processes_async(services)
+                started, _ = await self.start_processes_async(services)
+                if len(started) == 0:
+                    sock.sendall(const.MSG_CODE+b"Warning: No processes were restarted")
+                else:
+                    sock.sendall(const.MSG_CODE+f"Restarted {len(started)} out of {len(services)} processes".encode())
+        except Exception:
+            sock.sendall(const.MSG_CODE+b"Error: Couldn't restart process")
+
+    async def _process_command_rem_proc_async(self, command, sock):
+        try:
+            if len(command) != 2:
+                sock.sendall(const.MSG_CODE+b"Error: Invalid number of arguments")
+                return
+            name = command[1]
+            process = self.get_process(name)
+            if process is None:
+                sock.sendall(const.MSG_CODE+b"Error: Couldn't find process '" + name.encode() + b"'")
+                return
+            for proc in self._processes:
+                if name in proc.depends_on:
+                    sock.sendall(const.MSG_CODE+b"Error: Process '" + proc.name.encode() + b"' depends on '" + name.encode() + b"'")
+                    return
+            await self.stop_process(process)
+            # It could have been removed while it was stopping
+            if process in self._processes:
+                self.rem_process(process)
+            sock.sendall(const.MSG_CODE+b"Successfully removed process '" + name.encode() + b"'")
+        except Exception:
+            sock.sendall(const.MSG_CODE+b"Error: Couldn't remove process")
+
+    async def _drain_batches(self, batches, sock):
+        """Runs a handler that yields after each batch it sends (see
+        ProcessManager._stream_status), so the reply never piles up in the
+        transport"""
+        for _ in batches:
+            await sock.drain()
+
+    async def _process_status_cmd_async(self, command, sock):
+        await self._drain_batches(self._stream_status(command, sock), sock)
+
+    async def _process_logs_cmd_async(self, command, sock):
+        await self._drain_batches(self._stream_logs(command, sock), sock)
+
+    async def _process_command_kill_proc_async(self, command, sock):
+        try:
+            if len(command) != 2:
+                sock.sendall(const.MSG_CODE+b"Error: Invalid number of arguments")
+                return
+            name = command[1]
+            process = self.get_process(name)
+            if process is None:
+                sock.sendall(const.MSG_CODE+b"Error: Couldn't find process '" + name.encode() + b"'")
+                return
+            if process.active:
+                await self.stop_process(process)
+                sock.sendall(const.MSG_CODE+b"Successfully killed process '" + name.encode() + b"'")
+            else:
+                sock.sendall(const.MSG_CODE+b"Error: Process '" + name.encode() + b"' is not active")
+        except Exception:
+            sock.sendall(const.MSG_CODE+b"Error: Couldn't kill process")
+
+    async def _every(self, period, func):
+        """Calls func every period seconds, from the start of one call to the
+        start of the next"""
+        while True:
+            start = time.monotonic()
+            try:
+                result = func()
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception:
+                logging.exception(f"{func.__name__} failed")
+            await asyncio.sleep(max(0, period - (time.monotonic() - start)))
+
+    async def _tick(self):
+        self._profile_tick()
+        tick = time.perf_counter()
+        self.serve_metric_requests()
+        self._jobs.tick(time.time())
+        if self._due:
+            await self._start_due_jobs()
+        if self._events.pending:
+            self.add_subscribers()
+        if len(self._alerts):
+            self.check_alerts()
+        self.drain_full_output()
+        self._stats.observe("tick", time.perf_counter() - tick)
+
+    def _process_command_stop(self, command, sock):
+        super()._process_command_stop(command, sock)
+        self._stopped.set()
+
+    def _update_subscribers(self):
+        if self._events.active:
+            self.update_subscribers()
+
+    async def run(self):
+        """Runs the daemon until it is stopped"""
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        self._sampler = threading.get_ident()
+        watch_children(self._loop)
+        self._server = await asyncio.start_server(self._handle_client, "localhost", self.port)
+        self._probes.start(self._loop)
+        timers = []
+        try:
+            await self.start_processes_async(self.services)
+            timers = [
+                asyncio.ensure_future(self._every(self.tick, self._tick)),
+                asyncio.ensure_future(self._every(self.log_period, self.log_metrics)),
+                asyncio.ensure_future(self._every(self.event_period, self._update_subscribers))
+            ]
+            await self._stopped.wait()
+        finally:
+            self._stop = True
+            for timer in timers:
+                timer.cancel()
+            await asyncio.gather(*timers, return_exceptions=True)
+            self._profile_tick()
+            self._server.close()
+            self._events.close()
+            self._probes.stop()
+            self._watcher.stop()
+            await asyncio.to_thread(self._executor.shutdown, wait=True, cancel_futures=True)
+            await self.stop_processes_async(self._processes)
+
+    def start(self):
+        # The loop listens on a socket of its own
+        self._socket.close()
+        try:
+            asyncio.run(self.run())
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,551 @@
+import argparse
+import json
+import os
+import platform
+import re
+import shlex
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import psutil
+
+from . import constants as const
+from . import procfs
+from .client import read_events, send_command, subscribe_command
+
+
+def spawn_children(n):
+    """Spawns n idle children to be measured"""
+    sleep = shutil.which("sleep")
+    if sleep is not None:
+        command = [sleep, "600"]
+    else:
+        command = [sys.executable, "-c", "import time; time.sleep(600)"]
+    return [subprocess.Popen(command) for _ in range(n)]
+
+def kill_children(children):
+    for child in children:
+        child.kill()
+    for child in children:
+        child.wait()
+
+def timeit(func, rounds):
+    """Returns the average time (in seconds) of a call to func"""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    return (time.perf_counter()-start) / rounds
+
+def bench_memory(children=1000, rounds=10):
+    """Compares the ways of reading the memory of every managed child.
+
+    Args:
+        children (int, optional): Number of children. Defaults to 1000.
+        rounds (int, optional): Number of sweeps to average. Defaults to 10.
+
+    Returns:
+        dict: Average time per sweep (in seconds) for each method
+    """
+
+    procs = spawn_children(children)
+    try:
+        pids = [p.pid for p in procs]
+        handles = [psutil.Process(pid) for pid in pids]
+        results = {
+            "psutil": timeit(lambda: [psutil.Process(pid).memory_info() for pid in pids], rounds),
+            "cached": timeit(lambda: [h.memory_info() for h in handles], rounds)
+        }
+        if procfs.AVAILABLE:
+            results["procfs"] = timeit(lambda: procfs.read_memory(pids), rounds)
+            results["procfs_detailed"] = timeit(lambda: procfs.read_memory(pids, True), rounds)
+        return results
+    finally:
+        kill_children(procs)
+
+# Modules only the daemon needs, which the client must never import
+SERVER_MODULES = ("pypm.manager", "pypm.process", "psutil", "asyncio", "tempfile")
+
+def bench_import(command="status", runs=5):
+    """Measures the cold start of the command line client with -X importtime.
+    The command is run against a port nothing listens on, so only the
+    startup and the failed connection are timed.
+
+    Args:
+        command (str, optional): Client command to run. Defaults to "status".
+        runs (int, optional): Number of runs to average. Defaults to 5.
+
+    Returns:
+        dict: Average wall time and import time (in seconds), the slowest
+        top-level imports and any server-side module that was imported
+    """
+
+    wall, imports = 0, 0
+    modules = {}
+    for _ in range(runs):
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-m", "pypm", command, "--port", "1"],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        wall += time.perf_counter() - start
+        for line in proc.stderr.splitlines():
+            match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)", line)
+            if match is None:
+                continue
+            cumulative, indent, module = int(match[2]), len(match[3]), match[4]
+            modules[module] = cumulative
+            if indent == 0:
+                imports += cumulative / 1e6
+    top = sorted(((m, t) for m, t in modules.items() if "." not in m or m.startswith("pypm")),
+                 key=lambda i: i[1], reverse=True)[:5]
+    return {
+        "wall": wall / runs,
+        "imports": imports / runs,
+        "slowest": {module: t / 1e6 for module, t in top},
+        "server_modules": [m for m in SERVER_MODULES if m in modules]
+    }
+
+def percentiles(samples):
+    """Summarizes a list of latencies (in seconds)"""
+    samples = sorted(samples)
+    def at(p):
+        return samples[min(len(samples)-1, int(p * len(samples)))]
+    return {
+        "p50": at(0.5),
+        "p95": at(0.95),
+        "p99": at(0.99),
+        "max": samples[-1]
+    }
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+class Daemon:
+    def __init__(self, log_frequency=30):
+        """A pypm instance running in its own process, on a free port and with
+        a temporary log directory, for the scenarios that go through the
+        client like a user would. Use it as a context manager.
+
+        Args:
+            log_frequency (float, optional): Logs per minute. Defaults to 30.
+        """
+
+        self.log_frequency = log_frequency
+        self.host = "localhost"
+        self.port = None
+        self.proc = None
+        self._dir = None
+
+    def __enter__(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.port = free_port()
+        self.proc = subprocess.Popen([sys.executable, "-m", "pypm.pypm", str(self.port),
+                                      self._dir.name, str(self.log_frequency), "rss"],
+                                     stdout=subprocess.DEVNULL)
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection((self.host, self.port), 0.1).close()
+                return self
+            except OSError:
+                time.sleep(0.05)
+        self.__exit__()
+        raise RuntimeError("The daemon didn't start")
+
+    def __exit__(self, *exc):
+        try:
+            self.send(const.CMD_STOP)
+            self.proc.wait(30)
+        except (OSError, subprocess.TimeoutExpired):
+            self.proc.kill()
+            self.proc.wait()
+        self._dir.cleanup()
+
+    @property
+    def dir(self):
+        return self._dir.name
+
+    def send(self, cmd, *args):
+        return send_command(cmd, list(args), self.host, self.port)
+
+    def add(self, name, command, *options):
+        resp = self.send(const.CMD_ADD_PROCESS, name, shlex.quote(command), "False", "False", shlex.quote(self.dir), *options)
+        if b"Error" in resp:
+            raise RuntimeError(resp[1:].decode())
+
+    @property
+    def rss(self):
+        return psutil.Process(self.proc.pid).memory_info().rss
+
+    @property
+    def cpu_time(self):
+        times = psutil.Process(self.proc.pid).cpu_times()
+        return times.user + times.system
+
+
+def sleep_command():
+    sleep = shutil.which("sleep")
+    if sleep is not None:
+        return f"{sleep} 600"
+    return f'{sys.executable} -c "import time; time.sleep(600)"'
+
+def bench_spawn(processes=100):
+    """Measures how fast the daemon starts and kills processes.
+
+    Args:
+        processes (int, optional): Number of processes. Defaults to 100.
+
+    Returns:
+        dict: Time to start them all with a single command and to kill them
+        one by one, and the resulting throughputs (processes per second)
+    """
+
+    with Daemon() as daemon:
+        sleep = sleep_command()
+        for i in range(processes):
+            daemon.add(f"p{i}", sleep)
+        start = time.perf_counter()
+        daemon.send(const.CMD_START_PROCESS)
+        started = time.perf_counter() - start
+        start = time.perf_counter()
+        for i in range(processes):
+            daemon.send(const.CMD_KILL_PROCESS, f"p{i}")
+        killed = time.perf_counter() - start
+    return {
+        "start": started,
+        "kill": killed,
+        "start_per_s": processes / started,
+        "kill_per_s": processes / killed
+    }
+
+def bench_latency(clients=8, requests=100, processes=50):
+    """Measures the latency of control commands sent by several clients at
+    once.
+
+    Args:
+        clients (int, optional): Concurrent clients. Defaults to 8.
+        requests (int, optional): Requests per client and command. Defaults 
+        to 100.
+        processes (int, optional): Number of managed processes. Defaults to 50.
+
+    Returns:
+        dict: Latency percentiles (in seconds) for each command, and the
+        overall throughput (requests per second)
+    """
+
+    with Daemon() as daemon:
+        sleep = sleep_command()
+        for i in range(processes):
+            daemon.add(f"p{i}", sleep)
+        daemon.send(const.CMD_START_PROCESS)
+        commands = [const.CMD_LIST, const.CMD_GET_PID, const.CMD_GET_MEMORY, const.CMD_STATUS]
+        latencies = {cmd: [] for cmd in commands}
+        def client():
+            for _ in range(requests):
+                for cmd in commands:
+                    start = time.perf_counter()
+                    daemon.send(cmd)
+                    latencies[cmd].append(time.perf_counter() - start)
+        threads = [threading.Thread(target=client) for _ in range(clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    results = {cmd: percentiles(samples) for cmd, samples in latencies.items()}
+    results["requests_per_s"] = clients * requests * len(commands) / elapsed
+    return results
+
+EMITTER = """\
+import sys, time
+rate, seconds = float(sys.argv[1]), float(sys.argv[2])
+line = b"x" * 99 + b"\\n"
+chunk = line * max(1, int(rate * 1e6 / 100 / 100))
+end = time.monotonic() + seconds
+next_write = time.monotonic()
+while time.monotonic() < end:
+    sys.stdout.buffer.write(chunk)
+    sys.stdout.buffer.flush()
+    next_write += 0.01
+    time.sleep(max(0, next_write - time.monotonic()))
+time.sleep(600)
+"""
+
+def bench_output(rate=10, seconds=5, policy="drop-oldest"):
+    """Measures output capture with a process writing at a fixed rate. The
+    output is read back through a subscription, like monit does.
+
+    Args:
+        rate (float, optional): Megabytes per second written. Defaults to 10.
+        seconds (float, optional): Duration of the scenario. Defaults to 5.
+        policy (str, optional): Output policy of the process. Defaults to
+        'drop-oldest'.
+
+    Returns:
+        dict: Bytes read by the daemon, dropped by the policy and received
+        by the subscriber, the capture throughput (MB/s), the CPU time the 
+        daemon spent (in seconds) and its peak RSS (in bytes)
+    """
+
+    with Daemon() as daemon:
+        emitter = os.path.join(daemon.dir, "emit.py")
+        with open(emitter, "w") as file:
+            file.write(EMITTER)
+        daemon.add("emitter", f"{sys.executable} {emitter} {rate} {seconds}", f"output_policy={policy}")
+        sock = subscribe_command(["emitter"], daemon.host, daemon.port)
+        if sock is None:
+            raise RuntimeError("Couldn't subscribe to the daemon")
+        cpu = daemon.cpu_time
+        start = time.perf_counter()
+        daemon.send(const.CMD_START_PROCESS, "emitter")
+        received = 0
+        peak = daemon.rss
+        # Output is pushed about once a second, so a longer silence means 
+        # everything was captured
+        sock.settimeout(2)
+        try:
+            for event in read_events(sock):
+                if event["type"] == "log":
+                    received += len(event["data"])
+                else:
+                    peak = max(peak, daemon.rss)
+                if time.perf_counter() - start > seconds + 2:
+                    break
+        except socket.timeout:
+            pass
+        finally:
+            sock.close()
+        elapsed = time.perf_counter() - start
+        cpu = daemon.cpu_time - cpu
+        status = json.loads(daemon.send(const.CMD_STATUS, "emitter")[1:])
+    output = status["output"]["stdout"]
+    return {
+        "captured": output["bytes"],
+        "dropped": output["dropped"],
+        "received": received,
+        "mb_per_s": output["bytes"] / 1e6 / min(elapsed, seconds),
+        "daemon_cpu": cpu,
+        "daemon_peak_rss": peak
+    }
+
+def bench_sampling(processes=100, rounds=10):
+    """Measures the cost of sampling the metrics of every process, in the 
+    current process and without a server.
+
+    Args:
+        processes (int, optional): Number of processes. Defaults to 100.
+        rounds (int, optional): Number of sweeps to average. Defaults to 10.
+
+    Returns:
+        dict: Average time per process (in seconds) to read the memory, the
+        CPU and every published metric
+    """
+
+    from .manager import ProcessManager
+    from .process import Process
+
+    pm = ProcessManager(port=0)
+    procs = [Process(f"p{i}", sleep_command()) for i in range(processes)]
+    for proc in procs:
+        pm.add_process(proc)
+        proc.start(True)
+    try:
+        # Prime the CPU counters, whose first reading is meaningless
+        pm.publish_events()
+        return {
+            "memory": timeit(lambda: pm.read_memory(procs), rounds) / processes,
+            "cpu": timeit(lambda: [p.get_cpu_perc() for p in procs], rounds) / processes,
+            "publish": timeit(pm.publish_events, rounds) / processes
+        }
+    finally:
+        for proc in procs:
+            proc.kill()
+        pm._socket.close()
+
+def bench_footprint(processes=10000):
+    """Measures the memory the daemon's bookkeeping takes per managed
+    process (the process object, its buffers, log index and row in the 
+    metrics table), without starting them.
+
+    Args:
+        processes (int, optional): Number of processes. Defaults to 10000.
+
+    Returns:
+        dict: Bytes per process, in total and for the metrics table alone
+    """
+
+    import gc
+    import tracemalloc
+
+    from .manager import ProcessManager
+    from .process import Process
+
+    pm = ProcessManager(port=0)
+    try:
+        gc.collect()
+        tracemalloc.start()
+        start = tracemalloc.get_traced_memory()[0]
+        for i in range(processes):
+            pm.add_process(Process(f"p{i}", sleep_command()))
+        pm.sample_metrics(pm._processes)
+        gc.collect()
+        total = tracemalloc.get_traced_memory()[0] - start
+        tracemalloc.stop()
+        return {
+            "per_process": total // processes,
+            "metrics_per_process": pm._metrics.nbytes // processes
+        }
+    finally:
+        pm._socket.close()
+
+def bench_rss(seconds=30, processes=20):
+    """Measures how the memory of the daemon grows over time while it 
+    captures output and answers commands.
+
+    Args:
+        seconds (float, optional): Duration of the scenario. Defaults to 30.
+        processes (int, optional): Number of chatty processes. Defaults to 20.
+
+    Returns:
+        dict: Resident memory (in bytes) of the daemon at the start, the end
+        and its peak, and the growth per minute
+    """
+
+    with Daemon(log_frequency=600) as daemon:
+        emitter = os.path.join(daemon.dir, "emit.py")
+        with open(emitter, "w") as file:
+            file.write(EMITTER)
+        for i in range(processes):
+            daemon.add(f"p{i}", f"{sys.executable} {emitter} 0.1 {seconds}")
+        daemon.send(const.CMD_START_PROCESS)
+        first = peak = daemon.rss
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            daemon.send(const.CMD_STATUS)
+            peak = max(peak, daemon.rss)
+            time.sleep(0.5)
+        last = daemon.rss
+    return {
+        "start": first,
+        "end": last,
+        "peak": max(peak, last),
+        "growth_per_min": (last - first) / seconds * 60
+    }
+
+def bench_alerts(rules=5000, processes=100, rounds=10):
+    """Measures how long the alert engine takes to evaluate a sample of 
+    every process, with the rules spread over them (half thresholds held
+    for a while and half rates), without any budget.
+
+    Returns:
+        dict: Time per round and per rule evaluated
+    """
+
+    from .alerts import AlertEngine, Rule
+
+    engine = AlertEngine()
+    for i in range(rules):
+        condition = "mem > 1GB for 5m" if i % 2 else "rate(mem, 1m) > 1MB"
+        engine.add(Rule(f"r{i}", f"p{i % processes}", condition))
+    times = []
+    for r in range(rounds):
+        for p in range(processes):
+            engine.observe(f"p{p}", r * 10, 50.0, 2**29 + r * 2**20)
+        start = time.perf_counter()
+        engine.evaluate(budget=float("inf"))
+        times.append(time.perf_counter() - start)
+    mean = sum(times) / len(times)
+    return {
+        "round": mean,
+        "rule": mean / rules
+    }
+
+def print_results(name, results):
+    print(f"{name}:")
+    for key, value in results.items():
+        if isinstance(value, dict):
+            print_results(f"    {key}", value)
+        elif isinstance(value, list):
+            print(f"    {key:<20}{', '.join(value) or '-':>10}")
+        elif isinstance(value, int) or "_per_" in key:
+            # Counts, sizes and rates rather than durations
+            print(f"    {key:<20}{value:12.1f}")
+        else:
+            print(f"    {key:<20}{value*1000:10.3f}ms")
+
+SCENARIOS = ("memory", "import", "spawn", "latency", "output", "sampling", "footprint", "rss",
+             "alerts")
+
+def run(args):
+    """Runs a scenario with the parsed command line arguments"""
+    if args.scenario == "memory":
+        return bench_memory(args.children, args.rounds)
+    if args.scenario == "import":
+        return bench_import(args.command, args.rounds)
+    if args.scenario == "spawn":
+        return bench_spawn(args.processes)
+    if args.scenario == "latency":
+        return bench_latency(args.clients, args.rounds, args.processes)
+    if args.scenario == "output":
+        return bench_output(args.rate, args.seconds, args.policy)
+    if args.scenario == "sampling":
+        return bench_sampling(args.processes, args.rounds)
+    if args.scenario == "footprint":
+        return bench_footprint(args.processes)
+    if args.scenario == "rss":
+        return bench_rss(args.seconds, args.processes)
+    if args.scenario == "alerts":
+        return bench_alerts(args.rules, args.processes, args.rounds)
+
+def main(argv=None, prog="python -m pypm.bench"):
+    from . import VERSION
+
+    parser = argparse.ArgumentParser(prog=prog)
+    parser.add_argument("scenario", choices=SCENARIOS + ("all",))
+    parser.add_argument("--children", type=int, default=1000, help="Number of children (memory)")
+    parser.add_argument("--processes", type=int, default=100, help="Number of managed processes")
+    parser.add_argument("--rules", type=int, default=5000, help="Number of alert rules (alerts)")
+    parser.add_argument("--clients", type=int, default=8, help="Concurrent clients (latency)")
+    parser.add_argument("--rate", type=float, default=10, help="MB/s written by the process (output)")
+    parser.add_argument("--policy", type=str, default="drop-oldest", help="Output policy (output)")
+    parser.add_argument("--seconds", type=float, default=5, help="Duration (output, rss)")
+    parser.add_argument("--rounds", type=int, default=10, help="Number of rounds")
+    parser.add_argument("--command", type=str, default="status", help="Client command (import)")
+    parser.add_argument("--max-ms", type=float, help="Fail if the client takes longer to start (import)")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args(argv)
+
+    scenarios = SCENARIOS if args.scenario == "all" else (args.scenario,)
+    results = {}
+    for scenario in scenarios:
+        args.scenario = scenario
+        results[scenario] = run(args)
+        if not args.json:
+            print_results(scenario, results[scenario])
+    if args.json:
+        print(json.dumps({
+            "version": VERSION,
+            "python": platform.python_version(),
+            "platform": sys.platform,
+            "cpus": os.cpu_count(),
+            "time": time.time(),
+            "results": results
+        }, indent=4))
+
+    imported = results.get("import")
+    if imported is not None:
+        if imported["server_modules"]:
+            sys.exit("The client imported server-side modules")
+        if args.max_ms is not None and imported["imports"]*1000 > args.max_ms:
+            sys.exit(f"Client imports took over {args.max_ms}ms")
+
+
+if __name__ == "__main__":
+    main()
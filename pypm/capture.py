@@ -0,0 +1,273 @@
+import asyncio
+import collections
+import os
+import selectors
+import sys
+import threading
+import time
+
+DROP_OLDEST = "drop-oldest"
+SAMPLE = "sample"
+BLOCK = "block"
+POLICIES = (DROP_OLDEST, SAMPLE, BLOCK)
+
+
+class OutputBuffer:
+    __slots__ = ("capacity", "policy", "sample_rate", "total", "dropped", 
+                 "on_drain", "_chunks", "_size", "_skipped", "_paused", "_lock")
+
+    def __init__(self, capacity=2**20, policy=DROP_OLDEST, sample_rate=10):
+        """Holds the output of a stream between two drains. It never holds
+        (much) more than its capacity: once full, the policy decides what
+        happens to new output.
+
+        Args:
+            capacity (int, optional): Maximum number of bytes held. Defaults
+            to 1MB.
+            policy (str, optional): 'drop-oldest' discards the oldest output
+            to make room, 'sample' keeps one out of every sample_rate chunks
+            (discarding the oldest output to make room for it) and 'block'
+            stops reading, so the child blocks on its next write until the
+            buffer is drained. Defaults to 'drop-oldest'.
+            sample_rate (int, optional): See policy. Defaults to 10.
+        """
+
+        if policy not in POLICIES:
+            raise ValueError(f"Invalid output policy '{policy}'")
+        self.capacity = capacity
+        self.policy = policy
+        self.sample_rate = sample_rate
+        self.total = 0
+        self.dropped = 0
+        self.on_drain = None
+        # Created on the first write, since many processes never print much
+        self._chunks = None
+        self._size = 0
+        self._skipped = 0
+        self._paused = False
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def full(self):
+        return self._size >= self.capacity
+
+    def write(self, data):
+        """Adds output read from the stream.
+
+        Returns:
+            bool: False if the stream shouldn't be read until the next drain
+        """
+
+        with self._lock:
+            self.total += len(data)
+            if self.policy == SAMPLE and self._size + len(data) > self.capacity:
+                self._skipped += 1
+                if self._skipped % self.sample_rate:
+                    self.dropped += len(data)
+                    return True
+            if self._chunks is None:
+                self._chunks = collections.deque()
+            self._chunks.append(data)
+            self._size += len(data)
+            if self.policy == BLOCK:
+                self._paused = self._size >= self.capacity
+                return not self._paused
+            self._trim()
+            return True
+
+    def _trim(self):
+        excess = self._size - self.capacity
+        while excess > 0:
+            chunk = self._chunks[0]
+            if len(chunk) <= excess:
+                self._chunks.popleft()
+                removed = len(chunk)
+            else:
+                self._chunks[0] = chunk[excess:]
+                removed = excess
+            self._size -= removed
+            self.dropped += removed
+            excess -= removed
+
+    def drain(self):
+        """Returns (and forgets) everything written since the last drain"""
+        with self._lock:
+            if not self._chunks:
+                return b""
+            data = b"".join(self._chunks)
+            self._chunks.clear()
+            self._size = 0
+            paused, self._paused = self._paused, False
+        if paused and self.on_drain is not None:
+            self.on_drain()
+        return data
+
+
+class OutputReader:
+    def __init__(self, chunk_size=2**16):
+        """Reads the pipes of every child into their buffers from a single
+        thread, so that capturing output costs neither a thread nor a file
+        per child. Pipes whose buffer is blocking are left unread until the
+        buffer is drained. On Windows, where pipes can't be polled, each pipe
+        gets its own thread instead.
+
+        Args:
+            chunk_size (int, optional): Maximum bytes read at once. Defaults
+            to 64KB.
+        """
+
+        self.chunk_size = chunk_size
+        self._selector = None
+        self._thread = None
+        self._lock = threading.Lock()
+        # Notified whenever a pipe reaches EOF
+        self._eof = threading.Condition(self._lock)
+        self._ops = []
+        self._wake_r = self._wake_w = None
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _submit(self, *op):
+        with self._lock:
+            self._ensure_started()
+            self._ops.append(op)
+        os.write(self._wake_w, b"\x00")
+
+    def add(self, file, buffer):
+        """Starts reading a pipe (a file opened in binary mode) into a
+        buffer. The pipe is closed once it reaches EOF or is removed."""
+        if sys.platform == "win32":
+            thread = threading.Thread(target=self._read_blocking, args=(file, buffer))
+            thread.daemon = True
+            thread.start()
+            return
+        os.set_blocking(file.fileno(), False)
+        buffer.on_drain = lambda: self._submit("resume", file, buffer)
+        self._submit("add", file, buffer)
+
+    def remove(self, file):
+        """Stops reading a pipe and closes it"""
+        if sys.platform == "win32":
+            file.close()
+            return
+        self._submit("remove", file, None)
+
+    def finish(self, files, timeout=1):
+        """Waits for pipes to reach EOF (for at most timeout seconds), so
+        that what a child wrote right before exiting is read too, then stops
+        reading them and closes them"""
+        deadline = time.monotonic() + timeout
+        with self._eof:
+            for file in files:
+                while not file.closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._eof.wait(remaining)
+        for file in files:
+            self.remove(file)
+
+    def _closed(self, file):
+        file.close()
+        with self._eof:
+            self._eof.notify_all()
+
+    def _apply(self):
+        with self._lock:
+            ops, self._ops = self._ops, []
+        for op, file, buffer in ops:
+            if file.closed:
+                continue
+            registered = file in self._selector.get_map()
+            if op == "add" or (op == "resume" and not registered):
+                if not registered:
+                    self._selector.register(file, selectors.EVENT_READ, buffer)
+            elif op == "remove":
+                if registered:
+                    self._selector.unregister(file)
+                file.close()
+
+    def _run(self):
+        while True:
+            for key, _ in self._selector.select():
+                if key.fileobj == self._wake_r:
+                    try:
+                        while os.read(self._wake_r, 4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    self._apply()
+                    continue
+                file, buffer = key.fileobj, key.data
+                if file.closed:
+                    # Removed by an earlier key of the same batch
+                    continue
+                try:
+                    data = os.read(file.fileno(), self.chunk_size)
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    data = b""
+                if not data:
+                    self._selector.unregister(file)
+                    self._closed(file)
+                elif not buffer.write(data):
+                    # Paused until the buffer is drained (see add)
+                    self._selector.unregister(file)
+
+    def _read_blocking(self, file, buffer):
+        resume = threading.Event()
+        buffer.on_drain = resume.set
+        try:
+            while True:
+                data = file.read1(self.chunk_size)
+                if not data:
+                    break
+                if not buffer.write(data):
+                    resume.clear()
+                    if not buffer.full:
+                        continue
+                    resume.wait()
+        except (OSError, ValueError):
+            pass
+        finally:
+            self._closed(file)
+
+
+async def pump(stream, buffer, chunk_size=2**16):
+    """Reads an asyncio stream (the pipe of a child spawned by asyncio) into
+    a buffer until EOF, on the running loop. Like OutputReader, it stops
+    reading while a blocking buffer is full, until the buffer is drained
+    (which must also happen on the loop)."""
+    resume = asyncio.Event()
+    buffer.on_drain = resume.set
+    while True:
+        data = await stream.read(chunk_size)
+        if not data:
+            return
+        if not buffer.write(data):
+            resume.clear()
+            await resume.wait()
+
+
+_reader = None
+
+def reader():
+    """Returns the reader shared by every process"""
+    global _reader
+    if _reader is None:
+        _reader = OutputReader()
+    return _reader
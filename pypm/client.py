@@ -0,0 +1,251 @@
+import json
+import socket
+import struct
+import sys
+
+from . import constants as const
+from .units import Size
+
+OUTPUT_FORMATS = ("text", "json", "ndjson")
+output_format = "text"
+
+
+def color(text, color):
+    """Adds color to given text.
+
+    Args:
+        text (str): Text
+        color (str): Name of the color (one of colorama.Fore's attributes)
+    """
+    # colorama is only needed when something is actually printed
+    from colorama import Fore, Style
+    return f"{getattr(Fore, color)}{text}{Style.RESET_ALL}"
+
+def isdata(bytearr):
+    """Returns True if the given data is an encoded string or binary data"""
+    return bytearr[0] == const.DATA_CODE[0]
+
+def set_output_format(fmt):
+    """Sets how results are printed (text, json or ndjson)"""
+    global output_format
+    output_format = fmt
+
+def write_records(lines, fmt=None):
+    """Writes JSON records to stdout as they come, either as a JSON array or
+    one per line, without holding them all in memory.
+
+    Args:
+        lines (iterable): Records, each already encoded as a line of JSON
+        (bytes, with or without the trailing newline)
+        fmt (str, optional): json or ndjson. Defaults to the output format.
+    """
+
+    out = sys.stdout.buffer
+    if (fmt or output_format) == "ndjson":
+        for line in lines:
+            out.write(line.rstrip(b"\n") + b"\n")
+    else:
+        out.write(b"[")
+        first = True
+        for line in lines:
+            if not first:
+                out.write(b",")
+            out.write(line.rstrip(b"\n"))
+            first = False
+        out.write(b"]\n")
+    out.flush()
+
+def print_msg(text):
+    """Prints the given text, coloring it based on the first word (or as a 
+    JSON object with its level if the output format isn't text)"""
+    if output_format != "text":
+        if text.startswith("Error:"):
+            level = "error"
+        elif text.startswith("Warning:"):
+            level = "warning"
+        else:
+            level = "info"
+        print(json.dumps({"level": level, "message": text}))
+    elif text.startswith("Error:"):
+        print(color(text, "RED"))
+    elif text.startswith("Warning:"):
+        print(color(text, "YELLOW"))
+    else:
+        print(text)
+
+def process_mem_command(args, host, port):
+    """Get the memory usage of a specific process/list of processes"""
+    resp = send_command(const.CMD_GET_MEMORY, args, host, port)
+    if isdata(resp):
+        values = {}
+        i = 0
+        while i+1 < len(resp) and b"\x00" in resp[1+i:]:
+            end = resp[1+i:].index(b"\x00")+1
+            name = resp[1+i:i+end].decode()
+            value = Size(struct.unpack("d", resp[1+i+end:i+end+9])[0])
+            values[name] = value
+            i += end+8
+        return values
+    else:
+        print_msg(resp[1:].decode())
+        return None
+    
+def process_cpu_command(args, host, port):
+    """Get the cpu usage of a specific process/list of processes"""
+    resp = send_command(const.CMD_GET_CPU, args, host, port)
+    if isdata(resp):
+        values = {}
+        i = 0
+        while i+1 < len(resp) and b"\x00" in resp[1+i:]:
+            end = resp[1+i:].index(b"\x00")+1
+            name = resp[1+i:i+end].decode()
+            value = struct.unpack("d", resp[1+i+end:i+end+9])[0]
+            values[name] = value
+            i += end+8
+        return values
+    else:
+        print_msg(resp[1:].decode())
+        return None
+    
+def process_pid_command(args, host, port):
+    """Get the PID of a specific process/list of processes"""
+    resp = send_command(const.CMD_GET_PID, args, host, port)
+    if isdata(resp):
+        values = {}
+        i = 0
+        while i+1 < len(resp) and b"\x00" in resp[1+i:]:
+            end = resp[1+i:].index(b"\x00")+1
+            name = resp[1+i:i+end].decode()
+            value = struct.unpack("i", resp[1+i+end:i+end+5])[0]
+            values[name] = value
+            i += end+4
+        return values
+    else:
+        print_msg(resp[1:].decode())
+        return None
+    
+def process_uptime_command(args, host, port):
+    """Get the uptime of a specific process/list of processes"""
+    resp = send_command(const.CMD_GET_UPTIME, args, host, port)
+    if isdata(resp):
+        values = {}
+        i = 0
+        while i+1 < len(resp) and b"\x00" in resp[1+i:]:
+            end = resp[1+i:].index(b"\x00")+1
+            name = resp[1+i:i+end].decode()
+            i += end
+            end = resp[1+i:].index(b"\x00")+1
+            value = resp[1+i:i+end].decode()
+            values[name] = value
+            i += end
+        return values
+    else:
+        print_msg(resp[1:].decode())
+        return None
+    
+def process_health_command(args, host, port):
+    """Get the status of the liveness and readiness probes of a specific 
+    process/list of processes"""
+    resp = send_command(const.CMD_GET_HEALTH, args, host, port)
+    if isdata(resp):
+        values = {}
+        fields = resp[1:].decode().split("\x00")
+        for i in range(0, len(fields)-2, 3):
+            values[fields[i]] = (fields[i+1], fields[i+2])
+        return values
+    else:
+        print_msg(resp[1:].decode())
+        return None
+    
+def process_overview_command(args, host, port):
+    """Gets the live usage and recent history of every process at once"""
+    resp = send_command(const.CMD_OVERVIEW, args, host, port)
+    if isdata(resp):
+        return json.loads(resp[1:])
+    else:
+        print_msg(resp[1:].decode())
+        return None
+    
+def process_stdout_command(args, host, port):
+    """Gets the last 100 lines of output from the process"""
+    resp = send_command(const.CMD_GET_STDOUT, args, host, port)
+    if isdata(resp):
+        return resp[1:].decode().split("\n")
+    else:
+        print_msg(resp[1:].decode())
+        
+def process_stderr_command(args, host, port):
+    """Gets the last 100 lines of output from the process"""
+    resp = send_command(const.CMD_GET_STDERR, args, host, port)
+    if isdata(resp):
+        return resp[1:].decode().split("\n")
+    else:
+        print_msg(resp[1:].decode())
+        
+def subscribe_command(args, host, port):
+    """Subscribes to the events of the pypm server (state changes, metric
+    deltas and the logs of the given processes)
+
+    Returns:
+        socket.socket: Connection the events will be read from, or None if
+        the subscription failed
+    """
+    string = ' '.join([const.CMD_SUBSCRIBE]+args)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.connect((host, port))
+    sock.sendall(string.encode("utf-8"))
+    code = sock.recv(1)
+    if code != const.DATA_CODE:
+        resp = code
+        while True:
+            data = sock.recv(2048)
+            if data == b"":
+                break
+            resp += data
+        sock.close()
+        if resp:
+            print_msg(resp[1:].decode())
+        return None
+    return sock
+
+def read_events(sock):
+    """Yields the events received through a subscription until it is closed"""
+    with sock.makefile("rb") as file:
+        try:
+            for line in file:
+                yield json.loads(line)
+        except (OSError, ValueError):
+            return
+
+def stream_command(cmd, args, host, port):
+    """Sends a command and yields the lines of the reply as they arrive. The
+    first line starts with the reply's code (data or message).
+
+    Args:
+        cmd (str): Command
+        args (list): List of command arguments
+        host (str): Remote host to connect to
+        port (int): Network port
+    """
+
+    string = ' '.join([cmd]+args)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.connect((host, port))
+    sock.sendall(string.encode("utf-8"))
+    with sock, sock.makefile("rb") as file:
+        yield from file
+
+def send_command(cmd, args, host, port):
+    string = ' '.join([cmd]+args)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.connect((host, port))
+    sock.sendall(string.encode("utf-8"))
+    chunks = []
+    while True:
+        # The server closes the connection once the whole reply was sent
+        data = sock.recv(65536)
+        if data == b"":
+            break
+        chunks.append(data)
+    sock.close()
+    return b"".join(chunks)
@@ -12,6 +12,54 @@ CMD_GET_PID = "procpid"
 CMD_GET_UPTIME = "procupt"
 CMD_GET_STDOUT = "procstdout"
 CMD_GET_STDERR = "porcstderr"
+CMD_GET_HEALTH = "prochealth"
+CMD_SUBSCRIBE = "subscribe"
+CMD_OVERVIEW = "overview"
+CMD_STATUS = "procstatus"
+CMD_SELFSTATS = "selfstats"
+CMD_PROFILE = "profile"
+CMD_LOGS = "logs"
+CMD_RUN = "runjob"
+CMD_JOBS = "jobs"
+CMD_SCHED = "procsched"
+CMD_ADD_ALERT = "alertadd"
+CMD_REMOVE_ALERT = "alertrem"
+CMD_ALERTS = "alerts"
+CMD_METRICS = "metrics"
+
+PROCESS_OPTIONS = (
+    "tree", 
+    "mem_metric", 
+    "liveness", 
+    "readiness", 
+    "probe_period", 
+    "probe_timeout", 
+    "probe_threshold",
+    "depends_on",
+    "output_policy",
+    "output_buffer",
+    "env",
+    "cron",
+    "overlap",
+    "job",
+    "watch",
+    "ignore",
+    "stop_signal",
+    "grace",
+    "cpus",
+    "nice",
+    "ionice"
+)
+MEMORY_METRICS = ("rss", "vms", "uss", "pss", "swap")
+# Suffix of the series file (in the log directory) of each logged metric
+METRIC_FILES = {
+    "cpu": "_log_cpu",
+    "mem": "_log_mem",
+    "ctxsw": "_log_ctxsw",
+    "migrations": "_log_migr",
+    "job_duration": "_job_duration",
+    "job_exit": "_job_exit"
+}
 
 DATA_CODE = b"\x00"
 MSG_CODE = b"\x01"
\ No newline at end of file
@@ -0,0 +1,138 @@
+import json
+import threading
+
+
+def encode(event):
+    """Encodes an event as a line of JSON"""
+    return json.dumps(event, separators=(",", ":")).encode() + b"\n"
+
+
+class Subscriber:
+    def __init__(self, sock, names, limit):
+        """A client listening for events. Its socket is non-blocking, and
+        whatever it doesn't accept at once is kept until the next send.
+
+        Args:
+            sock (socket.socket): Connection to the client
+            names (list): Processes whose logs should be sent. Other events
+            are sent for every process.
+            limit (int): Bytes it can fall behind before it is dropped
+        """
+
+        self.sock = sock
+        self.names = set(names)
+        self.limit = limit
+        self.buffer = bytearray()
+
+    def wants(self, event):
+        return event["type"] != "log" or event["name"] in self.names
+
+    def send(self, data=b""):
+        """Sends data after whatever is still buffered, without blocking.
+
+        Raises:
+            OSError: If the client went away or fell more than limit bytes
+            behind
+        """
+        self.buffer += data
+        if len(self.buffer) > self.limit:
+            raise TimeoutError("Subscriber isn't reading")
+        while self.buffer:
+            try:
+                sent = self.sock.send(self.buffer)
+            except (BlockingIOError, InterruptedError):
+                return
+            del self.buffer[:sent]
+
+
+class EventBus:
+    def __init__(self, buffer_limit=2**20):
+        """Pushes state changes, metric deltas and new log output to the
+        clients that subscribed to them. The last value of every state and
+        metric event is kept, so that unchanged values are never resent and
+        new subscribers can be brought up to date at once.
+
+        Args:
+            buffer_limit (int, optional): Bytes of events a subscriber can
+            fall behind before it is dropped, so a slow client never blocks
+            the thread publishing. Defaults to 1MB.
+        """
+
+        self.buffer_limit = buffer_limit
+        self.lock = threading.RLock()
+        self._subscribers = []
+        self._last = {}
+        # (sock, names) of clients waiting to be subscribed
+        self._pending = []
+
+    @property
+    def active(self):
+        return len(self._subscribers) > 0
+
+    @property
+    def pending(self):
+        return len(self._pending) > 0
+
+    def request(self, sock, names=()):
+        """Queues a client to be subscribed by the thread that publishes the
+        events (see take_pending), so that it is brought up to date by the
+        same thread that samples and publishes everything else"""
+        with self.lock:
+            self._pending.append((sock, names))
+
+    def take_pending(self):
+        """Returns (and forgets) the clients queued by request"""
+        with self.lock:
+            pending, self._pending = self._pending, []
+        return pending
+
+    def subscribe(self, sock, names=()):
+        """Adds a subscriber and sends it the last known value of everything"""
+        subscriber = Subscriber(sock, names, self.buffer_limit)
+        with self.lock:
+            try:
+                sock.settimeout(0)
+                subscriber.send(b"".join(map(encode, self._last.values())))
+            except OSError:
+                sock.close()
+                return
+            self._subscribers.append(subscriber)
+
+    def close(self):
+        with self.lock:
+            for subscriber in self._subscribers:
+                subscriber.sock.close()
+            for sock, _ in self._pending:
+                sock.close()
+            self._subscribers = []
+            self._pending = []
+
+    def publish(self, event):
+        """Sends an event to every subscriber that wants it"""
+        data = encode(event)
+        with self.lock:
+            for subscriber in list(self._subscribers):
+                try:
+                    # The others still get what they have buffered
+                    subscriber.send(data if subscriber.wants(event) else b"")
+                except OSError:
+                    subscriber.sock.close()
+                    self._subscribers.remove(subscriber)
+
+    def update(self, event_type, name, **data):
+        """Publishes an event only if it differs from the last one of the
+        same type for the same process"""
+        event = dict(type=event_type, name=name, **data)
+        key = (event_type, name)
+        with self.lock:
+            if self._last.get(key) == event:
+                return
+            self._last[key] = event
+            self.publish(event)
+
+    def forget(self, name):
+        """Drops the last known values for a process that was removed"""
+        with self.lock:
+            for key in list(self._last):
+                if key[1] == name:
+                    del self._last[key]
@@ -0,0 +1,232 @@
+import argparse
+import csv
+import os
+import sys
+
+from . import series
+
+FORMATS = ("csv", "parquet")
+_EXTENSIONS = {".csv": "csv", ".parquet": "parquet", ".pq": "parquet"}
+
+
+def guess_format(path):
+    """Returns the format of a file from its extension (None if unknown)"""
+    return _EXTENSIONS.get(os.path.splitext(path)[1].lower())
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Parquet files need pyarrow (pip install pyarrow)") from None
+    return pyarrow
+
+def chunks(path, since=None, until=None, chunk=65536):
+    """Reads a series file chunk samples at a time.
+
+    Args:
+        path (str): Path of the series file
+        since (float, optional): UNIX timestamp of the first sample. Defaults
+        to None.
+        until (float, optional): UNIX timestamp of the last sample. Defaults
+        to None.
+        chunk (int, optional): Samples per chunk. Defaults to 65536.
+
+    Raises:
+        ValueError: If a time range is given for a legacy file, which has no
+        timestamps
+
+    Returns:
+        tuple: (metric, iterator of (timestamps, values) lists). For legacy
+        files the metric is None and the timestamps are all None.
+    """
+
+    with open(path, "rb") as file:
+        metric = series.read_header(file)
+    if metric is None:
+        if since is not None or until is not None:
+            raise ValueError("Legacy series files have no timestamps to filter by")
+        samples = ((None, value) for value in series.read_legacy(path, chunk))
+    else:
+        samples = series.read_range(path, since, until, chunk)
+    def batches():
+        timestamps, values = [], []
+        for timestamp, value in samples:
+            timestamps.append(timestamp)
+            values.append(value)
+            if len(values) >= chunk:
+                yield timestamps, values
+                timestamps, values = [], []
+        if values:
+            yield timestamps, values
+    return metric, batches()
+
+def export(path, out, fmt="csv", since=None, until=None, chunk=65536):
+    """Converts a series file to CSV or Parquet, a chunk at a time, so memory
+    doesn't depend on the size of the file. Both have a 'timestamp' column
+    (UNIX seconds in CSV, microseconds since the epoch in UTC in Parquet,
+    empty for legacy files) and a column named after the metric, and values
+    are written as 64 bit floats whatever the byte order of the machine.
+
+    Args:
+        path (str): Path of the series file
+        out (str or file): Output path (or a text file, for CSV)
+        fmt (str, optional): 'csv' or 'parquet'. Defaults to 'csv'.
+        since (float, optional): UNIX timestamp of the first sample. Defaults
+        to None.
+        until (float, optional): UNIX timestamp of the last sample. Defaults
+        to None.
+        chunk (int, optional): Samples converted at once (a row group,
+        in Parquet). Defaults to 65536.
+
+    Raises:
+        ValueError: If the format is unknown
+        RuntimeError: If pyarrow is needed but not installed
+
+    Returns:
+        int: Number of samples written
+    """
+
+    if fmt not in FORMATS:
+        raise ValueError(f"Invalid format '{fmt}' ({', '.join(FORMATS)})")
+    metric, batches = chunks(path, since, until, chunk)
+    column = metric or "value"
+    count = 0
+    if fmt == "csv":
+        file = open(out, "w", newline="") if isinstance(out, str) else out
+        try:
+            writer = csv.writer(file)
+            writer.writerow(["timestamp", column])
+            for timestamps, values in batches:
+                writer.writerows(zip(("" if t is None else repr(t) for t in timestamps), map(repr, values)))
+                count += len(values)
+        finally:
+            if file is not out:
+                file.close()
+        return count
+
+    pa = _pyarrow()
+    schema = pa.schema(
+        [("timestamp", pa.timestamp("us", tz="UTC")), (column, pa.float64())],
+        metadata={"pypm.metric": column}
+    )
+    with pa.parquet.ParquetWriter(out, schema) as writer:
+        for timestamps, values in batches:
+            micros = [None if t is None else round(t * 1e6) for t in timestamps]
+            writer.write_batch(pa.record_batch([pa.array(micros, pa.int64()).cast(schema.field(0).type),
+                                                pa.array(values, pa.float64())], schema=schema))
+            count += len(values)
+    return count
+
+def _read_csv(path):
+    file = open(path, newline="")
+    reader = csv.reader(file)
+    header = next(reader, None)
+    if header is None or len(header) != 2 or header[0] != "timestamp":
+        file.close()
+        raise ValueError(f"'{path}' isn't an exported series (expected a timestamp and a value column)")
+    def samples():
+        with file:
+            for row in reader:
+                if not row[0]:
+                    raise ValueError("Samples without timestamps can't be imported")
+                yield float(row[0]), float(row[1])
+    return header[1], samples()
+
+def _read_parquet(path, chunk):
+    pa = _pyarrow()
+    parquet = pa.parquet.ParquetFile(path)
+    schema = parquet.schema_arrow
+    if len(schema) != 2 or schema.field(0).name != "timestamp":
+        raise ValueError(f"'{path}' isn't an exported series (expected a timestamp and a value column)")
+    def samples():
+        for batch in parquet.iter_batches(batch_size=chunk):
+            timestamps = batch.column(0)
+            if timestamps.null_count:
+                raise ValueError("Samples without timestamps can't be imported")
+            if pa.types.is_timestamp(timestamps.type):
+                micros = timestamps.cast(pa.timestamp("us", tz="UTC")).cast(pa.int64()).to_pylist()
+                timestamps = [m / 1e6 for m in micros]
+            else:
+                timestamps = timestamps.cast(pa.float64()).to_pylist()
+            yield from zip(timestamps, batch.column(1).cast(pa.float64()).to_pylist())
+    return schema.field(1).name, samples()
+
+def import_file(path, dest, fmt=None, chunk=65536):
+    """Converts an exported CSV or Parquet file back into a series file,
+    which pypm.visual can plot (or the metrics command can query, if it is
+    put in the log directory with the right name).
+
+    Args:
+        path (str): Path of the exported file
+        dest (str): Path of the series file, which is replaced
+        fmt (str, optional): 'csv' or 'parquet'. Defaults to None (from the
+        extension).
+        chunk (int, optional): Samples converted at once. Defaults to
+        65536.
+
+    Raises:
+        ValueError: If the file isn't an exported series, or has samples
+        without timestamps or out of order
+        RuntimeError: If pyarrow is needed but not installed
+
+    Returns:
+        tuple: (metric, number of samples)
+    """
+
+    fmt = fmt or guess_format(path)
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format of '{path}' (use --format)")
+    if fmt == "csv":
+        metric, samples = _read_csv(path)
+    else:
+        metric, samples = _read_parquet(path, chunk)
+    # Written aside, so a bad row doesn't leave half a file behind
+    partial = dest + ".partial"
+    try:
+        count = series.write(partial, metric, samples, chunk)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    os.replace(partial, dest)
+    return metric, count
+
+def main(argv=None, prog="python -m pypm.export"):
+    from .client import print_msg
+    from .logs import parse_since
+
+    parser = argparse.ArgumentParser(prog=prog)
+    commands = parser.add_subparsers(dest="command", required=True)
+    exporter = commands.add_parser("export", help="Convert a series file to CSV or Parquet")
+    exporter.add_argument("file", help="Series file (e.g. logs/worker_log_cpu)")
+    exporter.add_argument("-o", "--out", help="Output file (default standard output, for CSV)")
+    exporter.add_argument("--format", choices=FORMATS, help="Output format (default from the extension, or CSV)")
+    exporter.add_argument("--since", help="Start of the range (e.g. 6h, a UNIX timestamp or an ISO date)")
+    exporter.add_argument("--until", help="End of the range")
+    importer = commands.add_parser("import", help="Convert a CSV or Parquet export back into a series file")
+    importer.add_argument("file", help="Exported file")
+    importer.add_argument("dest", help="Series file to write (replaced if it exists)")
+    importer.add_argument("--format", choices=FORMATS, help="Input format (default from the extension)")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "export":
+            fmt = args.format or (guess_format(args.out) if args.out else None) or "csv"
+            if fmt == "parquet" and args.out is None:
+                raise ValueError("Parquet needs an output file (-o)")
+            since = parse_since(args.since) if args.since else None
+            until = parse_since(args.until) if args.until else None
+            count = export(args.file, args.out or sys.stdout, fmt, since, until)
+            if args.out is not None:
+                print_msg(f"Exported {count} samples to '{args.out}'")
+        else:
+            metric, count = import_file(args.file, args.dest, args.format)
+            print_msg(f"Imported {count} {metric} samples into '{args.dest}'")
+    except (OSError, ValueError, RuntimeError) as e:
+        print_msg(f"Error: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+import asyncio
+import random
+import shlex
+import threading
+import urllib.parse
+
+UNKNOWN = "unknown"
+PASSING = "passing"
+FAILING = "failing"
+
+
+class Probe:
+    def __init__(self, period=10, timeout=1, threshold=3):
+        """Base class of all health probes.
+
+        Args:
+            period (float, optional): Seconds between checks. Defaults to 10.
+            timeout (float, optional): Seconds before a check is considered
+            failed. Defaults to 1.
+            threshold (int, optional): Consecutive failures needed for the
+            probe to be considered failing. Defaults to 3.
+        """
+
+        self.period = period
+        self.timeout = timeout
+        self.threshold = threshold
+        self.failures = 0
+        self.status = UNKNOWN
+
+    def reset(self):
+        self.failures = 0
+        self.status = UNKNOWN
+
+    async def check(self):
+        """Performs the actual check. Returns True if it succeeded."""
+        raise NotImplementedError
+
+    async def run(self):
+        """Runs a single check and updates the status of the probe.
+
+        Returns:
+            str: New status of the probe
+        """
+
+        try:
+            ok = await asyncio.wait_for(self.check(), self.timeout)
+        except (asyncio.TimeoutError, OSError, ValueError):
+            ok = False
+        if ok:
+            self.failures = 0
+            self.status = PASSING
+        else:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.status = FAILING
+        return self.status
+
+
+class TCPProbe(Probe):
+    def __init__(self, host, port, **kwargs):
+        """Succeeds if a TCP connection can be established"""
+        super().__init__(**kwargs)
+        self.host = host
+        self.port = port
+
+    async def check(self):
+        _, writer = await asyncio.open_connection(self.host, self.port)
+        writer.close()
+        await writer.wait_closed()
+        return True
+
+    def __repr__(self):
+        return f"tcp:{self.host}:{self.port}"
+
+
+class HTTPProbe(Probe):
+    def __init__(self, url, **kwargs):
+        """Succeeds if a GET request to the url returns a 2xx or 3xx status"""
+        super().__init__(**kwargs)
+        self.url = url
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme != "http":
+            raise ValueError("Only http:// URLs are supported")
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 80
+        self.path = parsed.path or "/"
+        if parsed.query:
+            self.path += "?" + parsed.query
+
+    async def check(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            request = f"GET {self.path} HTTP/1.0\r\nHost: {self.host}\r\nConnection: close\r\n\r\n"
+            writer.write(request.encode())
+            await writer.drain()
+            status = (await reader.readline()).split()
+            return len(status) >= 2 and 200 <= int(status[1]) < 400
+        finally:
+            writer.close()
+
+    def __repr__(self):
+        return self.url
+
+
+class ExecProbe(Probe):
+    def __init__(self, command, **kwargs):
+        """Succeeds if the command exits with status 0"""
+        super().__init__(**kwargs)
+        self.command = command
+
+    async def check(self):
+        proc = await asyncio.create_subprocess_exec(*shlex.split(self.command),
+                                                    stdout=asyncio.subprocess.DEVNULL,
+                                                    stderr=asyncio.subprocess.DEVNULL)
+        try:
+            return await proc.wait() == 0
+        except asyncio.CancelledError:
+            proc.kill()
+            await proc.wait()
+            raise
+
+    def __repr__(self):
+        return f"exec:{self.command}"
+
+
+def parse_probe(spec, **kwargs):
+    """Creates a probe from its textual specification, which can be
+    'tcp:PORT', 'tcp:HOST:PORT', 'http://HOST[:PORT]/PATH' or 'exec:COMMAND'.
+
+    Args:
+        spec (str): Probe specification
+        **kwargs: Passed on to the probe (period, timeout, threshold)
+
+    Raises:
+        ValueError: If the specification is invalid
+
+    Returns:
+        Probe: The probe
+    """
+
+    if spec.startswith("tcp:"):
+        host, _, port = spec[4:].rpartition(":")
+        return TCPProbe(host or "localhost", int(port), **kwargs)
+    if spec.startswith("http://"):
+        return HTTPProbe(spec, **kwargs)
+    if spec.startswith("exec:") and spec[5:].strip():
+        return ExecProbe(spec[5:], **kwargs)
+    raise ValueError(f"Invalid probe '{spec}'")
+
+
+class ProbeScheduler:
+    def __init__(self, jitter=0.1):
+        """Runs every probe of every process on a single asyncio loop, which
+        lives in its own thread. Each probe is a coroutine sleeping between
+        checks, so an idle probe costs nothing but a timer.
+
+        Args:
+            jitter (float, optional): Fraction of the period by which each
+            sleep is randomly shortened or lengthened, so probes don't all
+            fire at once. Defaults to 0.1.
+        """
+
+        self.jitter = jitter
+        self._loop = None
+        self._thread = None
+        self._tasks = {}
+        self._pending = []
+        self._shared = False
+
+    def start(self, loop=None):
+        """Starts running probes, on a loop of their own in a new thread or,
+        if given, on an already running loop (from that loop's thread)"""
+        if loop is not None:
+            self._loop = loop
+            self._shared = True
+            for args in self._pending:
+                self.add(*args)
+            self._pending = []
+            return
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        for args in self._pending:
+            self.add(*args)
+        self._pending = []
+
+    def stop(self):
+        if self._loop is None:
+            return
+        if self._shared:
+            # The owner of the loop is the one to wait for the tasks
+            for tasks in self._tasks.values():
+                for task in tasks:
+                    task.cancel()
+            self._tasks = {}
+            self._loop = None
+            return
+        asyncio.run_coroutine_threadsafe(self._cancel_all(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+
+    def add(self, process, probe, callback):
+        """Starts probing a process.
+
+        Args:
+            process (Process): Process being probed
+            probe (Probe): The probe
+            callback (callable): Called with (process, probe) after every
+            check, from the scheduler's thread
+        """
+
+        if self._loop is None:
+            self._pending.append((process, probe, callback))
+            return
+        def schedule():
+            task = self._loop.create_task(self._run(process, probe, callback))
+            self._tasks.setdefault(process.name, []).append(task)
+        self._loop.call_soon_threadsafe(schedule)
+
+    def remove(self, process):
+        """Stops all the probes of a process"""
+        if self._loop is None:
+            self._pending = [p for p in self._pending if p[0] is not process]
+            return
+        def cancel():
+            for task in self._tasks.pop(process.name, []):
+                task.cancel()
+        self._loop.call_soon_threadsafe(cancel)
+
+    async def _cancel_all(self):
+        tasks = [task for tasks in self._tasks.values() for task in tasks]
+        self._tasks = {}
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, process, probe, callback):
+        await asyncio.sleep(random.uniform(0, probe.period))
+        while True:
+            if process.active:
+                await probe.run()
+                callback(process, probe)
+            delay = probe.period * random.uniform(1-self.jitter, 1+self.jitter)
+            await asyncio.sleep(delay)
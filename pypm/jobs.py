@@ -0,0 +1,267 @@
+import collections
+import datetime
+import heapq
+import threading
+import time
+
+SKIP = "skip"
+QUEUE = "queue"
+OVERLAP_POLICIES = (SKIP, QUEUE)
+
+_MACROS = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@hourly": "0 * * * *",
+}
+_MONTHS = ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"]
+_DAYS = ["sun", "mon", "tue", "wed", "thu", "fri", "sat"]
+
+
+def _parse_field(field, low, high, names=None):
+    values = set()
+    for part in field.lower().split(","):
+        part, _, step = part.partition("/")
+        step = int(step) if step else 1
+        if part == "*":
+            start, end = low, high
+        else:
+            bounds = [
+                names.index(b) + (1 if names is _MONTHS else 0) if names and b in names else int(b)
+                for b in part.split("-")
+            ]
+            start, end = bounds[0], bounds[-1]
+            if len(bounds) == 1 and step > 1:
+                end = high
+        if step < 1 or not (low <= start <= end <= high):
+            raise ValueError(f"Invalid cron field '{field}'")
+        values.update(range(start, end+1, step))
+    return values
+
+
+class CronExpression:
+    def __init__(self, spec):
+        """A standard five field cron expression (minute, hour, day of the
+        month, month and day of the week), or one of @hourly, @daily,
+        @weekly, @monthly and @yearly.
+
+        Raises:
+            ValueError: If the expression is invalid
+        """
+
+        self.spec = spec
+        fields = _MACROS.get(spec.strip(), spec).split()
+        if len(fields) != 5:
+            raise ValueError(f"Invalid cron expression '{spec}'")
+        try:
+            self.minutes = _parse_field(fields[0], 0, 59)
+            self.hours = _parse_field(fields[1], 0, 23)
+            self.days = _parse_field(fields[2], 1, 31)
+            self.months = _parse_field(fields[3], 1, 12, _MONTHS)
+            # Both 0 and 7 are sunday
+            self.weekdays = {d % 7 for d in _parse_field(fields[4], 0, 7, _DAYS)}
+        except (ValueError, IndexError):
+            raise ValueError(f"Invalid cron expression '{spec}'") from None
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+        # Catches dates that don't exist, like the 30th of february
+        self.next_after(datetime.datetime.now())
+
+    def _day_matches(self, date):
+        # Like cron, if both day fields are restricted either one can match
+        in_month = date.day in self.days
+        in_week = (date.weekday() + 1) % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return in_month and in_week
+        return in_month or in_week
+
+    def next_after(self, after):
+        """Returns the first time (a naive local datetime) after the given one
+        that matches the expression"""
+        t = after.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        limit = t + datetime.timedelta(days=366*5)
+        while t < limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + datetime.timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + datetime.timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += datetime.timedelta(minutes=1)
+            else:
+                return t
+        raise ValueError(f"Cron expression '{self.spec}' never matches")
+
+    def __repr__(self):
+        return self.spec
+
+
+class Job:
+    __slots__ = ("cron", "overlap", "history", "runs", "skipped", "next_run",
+                 "started", "queued")
+
+    def __init__(self, cron=None, overlap=SKIP, history=20):
+        """Makes a process a job: something that runs to completion, either
+        on a schedule or when asked to, instead of being kept running.
+
+        Args:
+            cron (CronExpression, optional): Schedule. Defaults to None (only
+            run on demand).
+            overlap (str, optional): What to do when the job is due while it
+            is still running: 'skip' the run or 'queue' it until the current
+            one finishes. Defaults to 'skip'.
+            history (int, optional): Number of past runs kept. Defaults to 20.
+        """
+
+        if overlap not in OVERLAP_POLICIES:
+            raise ValueError(f"Invalid overlap policy '{overlap}'")
+        self.cron = cron
+        self.overlap = overlap
+        self.history = collections.deque(maxlen=history)
+        self.runs = 0
+        self.skipped = 0
+        self.next_run = None
+        self.started = None
+        self.queued = False
+
+    def to_dict(self):
+        last = self.history[-1] if self.history else None
+        return {
+            "cron": self.cron.spec if self.cron is not None else None,
+            "overlap": self.overlap,
+            "next_run": self.next_run,
+            "running": self.started is not None,
+            "queued": self.queued,
+            "runs": self.runs,
+            "skipped": self.skipped,
+            "last_start": last[0] if last else None,
+            "last_duration": last[1] if last else None,
+            "last_exit": last[2] if last else None,
+        }
+
+
+class JobScheduler:
+    def __init__(self, start, on_finish=None, max_concurrent=4):
+        """Runs jobs when they are due, from a heap of their next run times.
+        It has no thread of its own: tick is called by the main loop, so a
+        thousand idle jobs cost nothing but their place in the heap.
+
+        Args:
+            start (callable): Called with a process to start it
+            on_finish (callable, optional): Called with (process, start time,
+            duration, exit code) when a run finishes. Defaults to None.
+            max_concurrent (int, optional): Maximum number of jobs running at
+            once. Jobs over the limit wait for a free slot. Defaults to 4.
+        """
+
+        self.start = start
+        self.on_finish = on_finish
+        self.max_concurrent = max_concurrent
+        self._lock = threading.Lock()
+        self._heap = []
+        self._jobs = {}
+        self._pending = collections.deque()
+        self._running = {}
+
+    def _schedule(self, process, now):
+        job = process.job
+        if job.cron is None:
+            job.next_run = None
+            return
+        at = job.cron.next_after(datetime.datetime.fromtimestamp(now)).timestamp()
+        job.next_run = at
+        # Stale entries (of removed or rescheduled jobs) are skipped on pop
+        heapq.heappush(self._heap, (at, process.name))
+
+    def add(self, process):
+        with self._lock:
+            self._jobs[process.name] = process
+            self._schedule(process, time.time())
+
+    def remove(self, process):
+        with self._lock:
+            self._jobs.pop(process.name, None)
+            self._running.pop(process.name, None)
+            process.job.queued = False
+
+    @property
+    def running(self):
+        return len(self._running)
+
+    def trigger(self, process):
+        """Asks for a job to run as soon as there's a free slot.
+
+        Returns:
+            bool: False if the run was skipped, because the job is already
+            running (or waiting to) and doesn't queue runs
+        """
+
+        with self._lock:
+            return self._request(process)
+
+    def _request(self, process):
+        job = process.job
+        if job.queued or (process.name in self._running and job.overlap == SKIP):
+            job.skipped += 1
+            return False
+        job.queued = True
+        self._pending.append(process)
+        return True
+
+    def tick(self, now=None):
+        """Collects finished runs, then starts the jobs that are due and fit
+        in the concurrency limit.
+
+        Returns:
+            list: Processes that were started
+        """
+
+        if now is None:
+            now = time.time()
+        finished, started = [], []
+        with self._lock:
+            for name, process in list(self._running.items()):
+                if not process.active:
+                    del self._running[name]
+                    job = process.job
+                    duration = now - job.started
+                    job.history.append((job.started, duration, process.exit_code))
+                    finished.append((process, job.started, duration, process.exit_code))
+                    job.started = None
+            while self._heap and self._heap[0][0] <= now:
+                at, name = heapq.heappop(self._heap)
+                process = self._jobs.get(name)
+                if process is None or process.job.next_run != at:
+                    continue
+                self._schedule(process, now)
+                self._request(process)
+            # Jobs queued behind their own run keep their place, without
+            # holding up the ones queued after them
+            waiting = collections.deque()
+            while self._pending and len(self._running) < self.max_concurrent:
+                process = self._pending.popleft()
+                if process.name in self._running:
+                    waiting.append(process)
+                    continue
+                process.job.queued = False
+                if self._jobs.get(process.name) is not process:
+                    continue
+                try:
+                    self.start(process)
+                except Exception:
+                    process.job.history.append((now, 0, None))
+                    continue
+                process.job.runs += 1
+                process.job.started = now
+                self._running[process.name] = process
+                started.append(process)
+            waiting.extend(self._pending)
+            self._pending = waiting
+        if self.on_finish is not None:
+            for args in finished:
+                self.on_finish(*args)
+        return started
@@ -0,0 +1,346 @@
+import bisect
+import collections
+import heapq
+import json
+import os
+import re
+import time
+
+DEBUG = "debug"
+INFO = "info"
+WARNING = "warning"
+ERROR = "error"
+CRITICAL = "critical"
+LEVELS = (DEBUG, INFO, WARNING, ERROR, CRITICAL)
+SEVERITY = {level: i for i, level in enumerate(LEVELS)}
+
+_ALIASES = {
+    "trace": DEBUG,
+    "debug": DEBUG,
+    "info": INFO,
+    "notice": INFO,
+    "warn": WARNING,
+    "warning": WARNING,
+    "err": ERROR,
+    "error": ERROR,
+    "exception": ERROR,
+    "crit": CRITICAL,
+    "critical": CRITICAL,
+    "fatal": CRITICAL,
+    "panic": CRITICAL,
+}
+_LEVEL_RE = re.compile(r"\b(trace|debug|info|notice|warn(?:ing)?|err(?:or)?|exception|crit(?:ical)?|fatal|panic)\b",
+                       re.IGNORECASE)
+_LEVEL_FIELDS = ("level", "severity", "lvl", "levelname", "loglevel")
+
+
+def parse_level(line):
+    """Guesses the level of a plain text log line from the first level-like
+    word in it, returning None if there is none"""
+    match = _LEVEL_RE.search(line)
+    if match is None:
+        return None
+    return _ALIASES[match[1].lower()]
+
+def parse_since(text, now=None):
+    """Parses the start of a time range, which can be a duration back from
+    now ('30s', '10m', '2h', '1d'), a UNIX timestamp or an ISO date.
+
+    Raises:
+        ValueError: If the text is none of those
+
+    Returns:
+        float: UNIX timestamp
+    """
+
+    if now is None:
+        now = time.time()
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([smhd])", text)
+    if match is not None:
+        return now - float(match[1]) * {"s": 1, "m": 60, "h": 3600, "d": 86400}[match[2]]
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    import datetime
+    try:
+        return datetime.datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        raise ValueError(f"Invalid time '{text}'") from None
+
+def parse_line(line):
+    """Parses a log line, which may be a JSON object.
+
+    Returns:
+        tuple: (level, fields). Fields is None for plain text lines.
+    """
+
+    if line.startswith("{"):
+        try:
+            fields = json.loads(line)
+        except ValueError:
+            fields = None
+        if isinstance(fields, dict):
+            level = None
+            for key in _LEVEL_FIELDS:
+                if isinstance(fields.get(key), str):
+                    level = _ALIASES.get(fields[key].lower())
+                    break
+            return level, fields
+    return parse_level(line), None
+
+
+class LogRecord:
+    __slots__ = ("seq", "time", "stream", "level", "text", "fields")
+
+    def __init__(self, seq, time, stream, level, text, fields=None):
+        """A line of output"""
+        self.seq = seq
+        self.time = time
+        self.stream = stream
+        self.level = level
+        self.text = text
+        self.fields = fields
+
+    def to_dict(self):
+        record = {
+            "time": self.time,
+            "stream": self.stream,
+            "level": self.level,
+            "text": self.text
+        }
+        if self.fields is not None:
+            record["fields"] = self.fields
+        return record
+
+
+class LogIndex:
+    __slots__ = ("max_records", "max_line", "_records", "_times", "_levels", 
+                 "_partial", "_seq")
+    
+    def __init__(self, max_records=10000, max_line=4096):
+        """Parses output into records as it is captured and keeps the most
+        recent ones, indexed by time (records are in time order) and level,
+        so they can be searched without scanning everything.
+
+        Args:
+            max_records (int, optional): Number of records kept. Defaults to
+            10000.
+            max_line (int, optional): Lines are cut to this many characters.
+            Defaults to 4096.
+        """
+
+        self.max_records = max_records
+        self.max_line = max_line
+        self._records = []
+        self._times = []
+        # Created on the first line of each level
+        self._levels = {}
+        self._partial = {}
+        self._seq = 0
+
+    def __len__(self):
+        return len(self._records)
+
+    def feed(self, stream, data, timestamp=None):
+        """Parses newly captured output. An incomplete last line is held back
+        until the rest of it arrives.
+
+        Args:
+            stream (str): stdout or stderr
+            data (bytes): New output
+            timestamp (float, optional): When it was captured. Defaults to
+            the current time.
+
+        Returns:
+            list: The new LogRecords
+        """
+
+        if not data:
+            return []
+        if timestamp is None:
+            timestamp = time.time()
+        lines = (self._partial.pop(stream, b"") + data).split(b"\n")
+        if lines[-1]:
+            self._partial[stream] = lines[-1][-self.max_line:]
+        new = []
+        for line in lines[:-1]:
+            text = line[:self.max_line].decode("utf-8", "replace").rstrip("\r")
+            if text:
+                new.append(self._add(stream, text, timestamp))
+        if len(self._records) >= 2 * self.max_records:
+            self._trim()
+        return new
+
+    def _add(self, stream, text, timestamp):
+        level, fields = parse_line(text)
+        record = LogRecord(self._seq, timestamp, stream, level, text, fields)
+        self._seq += 1
+        self._records.append(record)
+        self._times.append(timestamp)
+        if level is not None:
+            self._levels.setdefault(level, []).append(record.seq)
+        return record
+
+    def _trim(self):
+        # Done in batches, since it means copying what's left
+        drop = len(self._records) - self.max_records
+        first = self._records[drop].seq
+        del self._records[:drop]
+        del self._times[:drop]
+        for seqs in self._levels.values():
+            del seqs[:bisect.bisect_left(seqs, first)]
+
+    def query(self, grep=None, level=None, since=None, stream=None, limit=None):
+        """Searches the records.
+
+        Args:
+            grep (str, optional): Regular expression the line must match.
+            Defaults to None.
+            level (str, optional): Minimum level. Lines without a level are
+            left out. Defaults to None.
+            since (float, optional): UNIX timestamp of the oldest record.
+            Defaults to None.
+            stream (str, optional): Only records of this stream. Defaults to
+            None.
+            limit (int, optional): Only the most recent matches. Defaults to
+            None.
+
+        Raises:
+            ValueError: If the level is invalid
+            re.error: If the regular expression is invalid
+
+        Returns:
+            list: Matching LogRecords, oldest first
+        """
+
+        if not self._records:
+            return []
+        start = 0 if since is None else bisect.bisect_left(self._times, since)
+        first = self._records[0].seq
+        if level is not None:
+            if level not in SEVERITY:
+                raise ValueError(f"Invalid level '{level}'")
+            min_seq = first + start
+            seqs = heapq.merge(*(
+                seqs[bisect.bisect_left(seqs, min_seq):]
+                for lvl, seqs in self._levels.items() if SEVERITY[lvl] >= SEVERITY[level]
+            ))
+            candidates = (self._records[seq - first] for seq in seqs)
+        else:
+            candidates = self._records[start:]
+        pattern = re.compile(grep) if grep else None
+        result = [
+            record for record in candidates
+            if (stream is None or record.stream == stream)
+            and (pattern is None or pattern.search(record.text))
+        ]
+        if limit is not None:
+            result = result[-limit:] if limit > 0 else []
+        return result
+
+
+class LogFile:
+    def __init__(self, path, max_bytes=10*2**20, backups=5):
+        """Records written to disk as JSON lines, rotated once the file gets 
+        too big (path.1 being the most recent rotated file).
+
+        Args:
+            path (str): Path of the current file
+            max_bytes (int, optional): Size at which the file is rotated.
+            Defaults to 10MB.
+            backups (int, optional): Number of rotated files kept. Defaults
+            to 5.
+        """
+
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._size = os.path.getsize(path) if os.path.isfile(path) else 0
+
+    def write(self, records):
+        if not records:
+            return
+        data = "".join(json.dumps(r.to_dict(), separators=(",", ":")) + "\n" for r in records).encode()
+        if self._size + len(data) > self.max_bytes and self._size > 0:
+            self.rotate()
+        with open(self.path, "ab") as file:
+            file.write(data)
+        self._size += len(data)
+
+    def rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.isfile(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i+1}")
+        if os.path.isfile(self.path):
+            os.replace(self.path, f"{self.path}.1")
+        self._size = 0
+
+    def paths(self):
+        """Returns the paths of every file, oldest first"""
+        paths = [f"{self.path}.{i}" for i in range(self.backups, 0, -1)]
+        return [p for p in paths + [self.path] if os.path.isfile(p)]
+
+    def read(self):
+        """Yields every record (as a dict), oldest first, reading a line at 
+        a time"""
+        for path in self.paths():
+            try:
+                with open(path, "rb") as file:
+                    for line in file:
+                        try:
+                            yield json.loads(line)
+                        except ValueError:
+                            continue
+            except FileNotFoundError:
+                # Rotated away while being read
+                continue
+
+
+def record_filter(grep=None, level=None, since=None, stream=None):
+    """Returns a function telling whether a record (as a dict) matches the 
+    given filters (see LogIndex.query)
+
+    Raises:
+        ValueError: If the level is invalid
+        re.error: If the regular expression is invalid
+    """
+
+    if level is not None and level not in SEVERITY:
+        raise ValueError(f"Invalid level '{level}'")
+    pattern = re.compile(grep) if grep else None
+    min_severity = SEVERITY[level] if level is not None else None
+    def matches(record):
+        return ((since is None or record["time"] >= since)
+                and (stream is None or record["stream"] == stream)
+                and (min_severity is None or SEVERITY.get(record["level"], -1) >= min_severity)
+                and (pattern is None or pattern.search(record["text"]) is not None))
+    return matches
+
+def merge(sources, matches=None, limit=None):
+    """Merges several time ordered sources of records into a single one, in
+    time order. Only the next record of each source is held at once (plus
+    the last limit matches), so memory doesn't depend on the size of the 
+    logs.
+
+    Args:
+        sources (dict): Iterable of records (as dicts) for each name. Each
+        record is given the name of its source.
+        matches (callable, optional): Filter (see record_filter). Defaults to
+        None.
+        limit (int, optional): Only the most recent matches. Defaults to None.
+
+    Returns:
+        iterator: Matching records, oldest first
+    """
+
+    def named(name, records):
+        for record in records:
+            if matches is None or matches(record):
+                record["name"] = name
+                yield record
+    merged = heapq.merge(*(named(name, records) for name, records in sources.items()),
+                         key=lambda r: r["time"])
+    if limit is not None:
+        return iter(collections.deque(merged, maxlen=max(0, limit)))
+    return merged
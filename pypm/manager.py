@@ -1,5 +1,9 @@
+import concurrent.futures
+import cProfile
+import json
 import logging
 import os
+import re
 import select
 import shlex
 import socket
@@ -7,24 +11,78 @@ import struct
 import threading
 import time
 
+import psutil
+
 from . import constants as const
-from .process import Process
+from . import alerts, capture, health, jobs, logs, procfs, scheduling, series, watch
+from .events import EventBus
+from .metrics import MetricsTable
+from .process import Process, parse_signal, split_command
+from .startup import start_all
+from .stats import Stats, sample_stacks, write_stacks
+from .tree import sum_memory
+
+
+# Keys of the records sent by the status command
+STATUS_FIELDS = ("name", "pid", "status", "mem", "mem_metric", "cpu", "uptime", "liveness", "readiness",
+                 "output", "cpus", "nice", "ionice", "ctx_switches", "migrations")
+
+# Names of the commands clients can send
+COMMANDS = frozenset(value for key, value in vars(const).items() if key.startswith("CMD_"))
+
+
+def command_timer(name):
+    """Name of the timer of a command. Anything a client sends that isn't a
+    command shares one, so the timers can't grow without bound."""
+    return "command." + (name if name in COMMANDS else "unknown")
 
 
 def sbool(string):
     return True if string == "True" else False
 
+def parse_options(args):
+    """Parses the trailing 'key=value' arguments of a command into a dict"""
+    options = {}
+    for arg in args:
+        key, sep, value = arg.partition("=")
+        if not sep:
+            raise ValueError(f"Invalid option '{arg}'")
+        options[key] = value
+    return options
+
 
 # TODO: Add documentation
 class ProcessManager:
-    def __init__(self, port=8080, log_dir=None, log_frequency=30):
+    def __init__(self, port=8080, log_dir=None, log_frequency=30, mem_metric="rss", max_jobs=4):
         self.port = port
         self.log_dir = log_dir
         self.log_frequency = log_frequency
+        self.mem_metric = mem_metric
+        self.start_timeout = 60
+        self.event_period = 1
+        self.tick = 0.1
+        self.sample_period = 0.5
         self._processes = []
         self._log_cpu = []
         self._log_memory = []
         self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._probes = health.ProbeScheduler()
+        self._watcher = watch.FileWatcher()
+        self._alerts = alerts.AlertEngine()
+        self._jobs = jobs.JobScheduler(lambda p: p.start(True), self._on_job_finished, max_jobs)
+        self._events = EventBus()
+        # Runs restarts and alert actions, which block, for any thread
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="pypm-action")
+        self._metrics = MetricsTable()
+        # Only the main loop samples (see request_metrics); other threads
+        # queue their requests and are woken up once they are served
+        self._sampler = None
+        self._sample_requests = []
+        self._sample_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stats = Stats()
+        self._profile = None
+        self._profile_lock = threading.Lock()
         self._server_thread = None
         self._stop = False
         
@@ -42,21 +100,355 @@ class ProcessManager:
         
         if process in self._processes:
             return False
+        if process.mem_metric is None:
+            process.mem_metric = self.mem_metric
         self._processes.append(process)
+        self._metrics.row(process.name)
         if log_cpu and process not in self._log_cpu:
             self._log_cpu.append(process)
         if log_memory and process not in self._log_memory:
             self._log_memory.append(process) 
+        for probe in process.probes:
+            self._probes.add(process, probe, self._on_probe_result)
+        if self.log_dir is not None:
+            process.log_sink = self._log_sink(process)
+        if process.job is not None:
+            self._jobs.add(process)
+        if process.watch:
+            self.watch_process(process)
         return True
             
     def rem_process(self, process):
         """Removes a process"""
         self._processes.remove(process)
+        self._metrics.remove(process.name)
+        self._probes.remove(process)
+        self._events.forget(process.name)
+        self._alerts.forget(process.name)
+        if process.job is not None:
+            self._jobs.remove(process)
+        if process.watch:
+            self._watcher.remove(process.name)
         if process in self._log_cpu:
             self._log_cpu.remove(process)
         if process in self._log_memory:
             self._log_memory.remove(process)
             
+    def get_process(self, name):
+        for process in self._processes:
+            if process.name == name:
+                return process
+        return None
+            
+    @property
+    def services(self):
+        """Processes that are kept running (as opposed to jobs, which are
+        only started by the job scheduler)"""
+        return [p for p in self._processes if p.job is None]
+            
+    def start_processes(self, processes):
+        """Starts several processes, respecting their dependencies (see 
+        startup.start_all).
+
+        Returns:
+            tuple: (list of processes that started, list of those that didn't)
+        """
+        
+        return start_all(processes, lambda p: p.start(True), self.start_timeout)
+    
+    def stop_processes(self, processes):
+        """Stops several processes at once: all of them are asked to stop
+        first, and then each is waited on until the end of its own grace 
+        period, so stopping many takes about as long as stopping one."""
+        active = [p for p in processes if p.active]
+        for process in active:
+            process.terminate()
+        for process in active:
+            process.kill()
+    
+    def with_dependencies(self, process):
+        """Returns the process and all of its (direct or indirect) 
+        dependencies that aren't running"""
+        result, queue = [], [process]
+        while queue:
+            proc = queue.pop()
+            if proc in result or (proc is not process and proc.active):
+                continue
+            result.append(proc)
+            for dep in proc.depends_on:
+                dependency = self.get_process(dep)
+                if dependency is not None:
+                    queue.append(dependency)
+        return result
+            
+    def drain_output(self, process):
+        """Moves new output of a process into its buffers, and pushes it to
+        the subscribers"""
+        with self._events.lock, self._stats.timer("drain"):
+            for stream, new in (("stdout", process.process_stdout()), 
+                                ("stderr", process.process_stderr())):
+                if new:
+                    self._stats.count("drain.bytes", len(new))
+                    self._events.publish({
+                        "type": "log", 
+                        "name": process.name, 
+                        "stream": stream, 
+                        "data": new.decode("utf-8", "replace")
+                    })
+    
+    def log_file(self, process):
+        """Returns the file the output of a process is written to (None if
+        there is no log directory)"""
+        if self.log_dir is None:
+            return None
+        return logs.LogFile(os.path.join(self.log_dir, process.name + ".log"))
+    
+    def _log_sink(self, process):
+        log_file = self.log_file(process)
+        def sink(records):
+            try:
+                self.assert_logdir_exists()
+                with self._stats.timer("log.write"):
+                    log_file.write(records)
+            except OSError:
+                self._stats.count("log.errors")
+        return sink
+    
+    def add_subscribers(self):
+        """Subscribes the clients queued by the subscribe command, bringing
+        them up to date with the current state and the output of the
+        processes they follow"""
+        pending = self._events.take_pending()
+        if not pending:
+            return
+        with self._events.lock:
+            self.publish_events()
+            for sock, names in pending:
+                self._events.subscribe(sock, names)
+                for name in names:
+                    process = self.get_process(name)
+                    if process is None:
+                        # Removed in the meantime
+                        continue
+                    for stream, data in (("stdout", process.stdout), ("stderr", process.stderr)):
+                        self._events.publish({
+                            "type": "log", 
+                            "name": name, 
+                            "stream": stream, 
+                            "data": data.decode("utf-8", "replace"),
+                            "reset": True
+                        })
+            
+    def publish_events(self):
+        """Pushes the state and metrics of every process that changed since
+        the last call to the subscribers"""
+        processes = list(self._processes)
+        self._events.update("processes", None, 
+                            processes=[[p.name, p.command] for p in processes])
+        metrics = self.sample_metrics(processes)
+        for process in processes:
+            _, cpu, mem = metrics.get(process.name)
+            self._events.update("state", process.name, 
+                                pid=process.pid, start=process.start_time)
+            self._events.update("metrics", process.name, cpu=round(cpu, 1), mem=int(mem))
+            
+    def sample_metrics(self, processes, max_age=None):
+        """Samples the CPU and memory usage of the processes that weren't 
+        sampled in the last max_age seconds into the metrics table. Every
+        reader goes through the table, so the CPU usage is always measured
+        over (at least) max_age seconds, and asking for the usage of many
+        processes at once costs a single sweep.
+
+        Args:
+            processes (list): Processes
+            max_age (float, optional): Defaults to sample_period.
+
+        Returns:
+            MetricsTable: The table
+        """
+        
+        if max_age is None:
+            max_age = self.sample_period
+        now = time.time()
+        stale, seen = [], set()
+        for process in processes:
+            if not process.active:
+                # Nothing to measure, and it shouldn't show its last usage
+                self._metrics.set(process.name, now, 0, 0)
+            elif process.name not in seen and self._metrics.age(process.name, now) >= max_age:
+                # A process listed twice would read a CPU usage of 0 the
+                # second time
+                seen.add(process.name)
+                stale.append(process)
+        if stale:
+            info = self.read_memory(stale)
+            with self._stats.timer("sample.cpu"):
+                for process in stale:
+                    cpu, mem = process.get_cpu_perc(), process.mem_bytes(info.get(process.pid))
+                    self._metrics.set(process.name, now, cpu, mem)
+                    self._alerts.observe(process.name, now, cpu, mem)
+        return self._metrics
+            
+    def request_metrics(self, processes, timeout=5):
+        """Same as sample_metrics, for any thread. Sampling resets the
+        window the CPU usage is measured over, so it is left to the main
+        loop, which serves every pending request with a single sweep.
+
+        Args:
+            processes (list): Processes
+            timeout (float, optional): How long to wait for the main loop, 
+                after which the last samples are used. Defaults to 5.
+
+        Returns:
+            MetricsTable: The table
+        """
+        
+        if self._sampler is None or self._sampler == threading.get_ident():
+            return self.sample_metrics(processes)
+        if self._stop:
+            return self._metrics
+        done = threading.Event()
+        with self._sample_lock:
+            self._sample_requests.append((processes, done))
+        self._wake.set()
+        done.wait(timeout)
+        return self._metrics
+    
+    def serve_metric_requests(self):
+        """Samples the processes other threads asked for (see request_metrics)"""
+        with self._sample_lock:
+            requests, self._sample_requests = self._sample_requests, []
+        if not requests:
+            return
+        try:
+            self.sample_metrics([p for processes, _ in requests for p in processes])
+        finally:
+            for _, done in requests:
+                done.set()
+            
+    def watch_process(self, process):
+        """Restarts a process whenever the files it watches change"""
+        ignore = list(watch.DEFAULT_IGNORE) + process.ignore
+        if self.log_dir is not None:
+            # Its own logs would restart it forever
+            log_dir = os.path.abspath(self.log_dir)
+            ignore += [log_dir, os.path.join(log_dir, "*")]
+        paths = [os.path.join(process.cwd, path) for path in process.watch]
+        self._watcher.add(process.name, paths, lambda changed: self._on_files_changed(process, changed), ignore)
+        
+    def _on_files_changed(self, process, paths):
+        if process.job is not None or not process.active:
+            return
+        logging.info(f"Restarting '{process.name}' after changes to {len(paths)} path(s), e.g. '{paths[0]}'")
+        self._stats.count("watch.restarts")
+        self.run_in_background(self.restart_process, process)
+        
+    def _on_job_finished(self, process, start, duration, exit_code):
+        """Records the duration and exit code of a finished job run"""
+        self.drain_output(process)
+        logging.info(f"Job '{process.name}' finished in {duration:.2f}s with exit code {exit_code}")
+        self._stats.observe("job.duration", duration)
+        if exit_code != 0:
+            self._stats.count("job.failures")
+        if self.log_dir is None:
+            return
+        self.assert_logdir_exists()
+        log_file = os.path.join(self.log_dir, process.name)
+        with self._stats.timer("log.write"):
+            series.append(log_file+"_job_duration", "duration", duration, start)
+            series.append(log_file+"_job_exit", "exit", -1 if exit_code is None else exit_code, start)
+            
+    def check_alerts(self):
+        """Samples the processes that alert rules apply to and evaluates the
+        rules (within the engine's time budget)"""
+        watched = [p for p in self._processes if self._alerts.watches(p.name)]
+        self.sample_metrics([p for p in watched if p.active])
+        with self._stats.timer("alerts"):
+            changes = self._alerts.evaluate()
+            for process in watched:
+                if not process.active:
+                    changes += self._alerts.reset(process.name)
+        for rule, name, status, value in changes:
+            self._on_alert(rule, name, status, value)
+            
+    def _on_alert(self, rule, name, status, value):
+        log = logging.warning if status == alerts.FIRING else logging.info
+        if value is None:
+            log(f"Alert '{rule.name}' {status} for '{name}' ({rule.condition}, process stopped)")
+        else:
+            log(f"Alert '{rule.name}' {status} for '{name}' ({rule.condition}, value {value:g})")
+        self._stats.count("alerts." + status)
+        alert = {
+            "alert": rule.name,
+            "process": name,
+            "status": status,
+            "condition": rule.condition.spec,
+            "value": value,
+            "time": time.time()
+        }
+        self._events.publish(dict(type="alert", name=name, **alert))
+        if rule.action_kind == "webhook":
+            self.run_in_background(self._send_webhook, rule.action_arg, alert)
+        elif status != alerts.FIRING:
+            return
+        elif rule.action_kind == "exec":
+            self.run_in_background(self._run_alert_command, rule.action_arg, alert)
+        elif rule.action_kind == "restart":
+            process = self.get_process(name)
+            if process is not None and process.job is None and process.active:
+                self.run_in_background(self.restart_process, process)
+                
+    def _send_webhook(self, url, alert):
+        import urllib.request
+        request = urllib.request.Request(url, data=json.dumps(alert).encode(), method="POST",
+                                         headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=5):
+                pass
+        except (OSError, ValueError) as e:
+            self._stats.count("alerts.errors")
+            logging.warning(f"Couldn't send alert '{alert['alert']}' to {url}: {e}")
+            
+    def _run_alert_command(self, command, alert):
+        import subprocess
+        env = dict(os.environ, **{f"PYPM_{key.upper()}": str(value) for key, value in alert.items()})
+        try:
+            subprocess.run(split_command(command), env=env, timeout=60,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except (OSError, ValueError, subprocess.TimeoutExpired) as e:
+            self._stats.count("alerts.errors")
+            logging.warning(f"Couldn't run the action of alert '{alert['alert']}': {e}")
+            
+    def run_in_background(self, func, *args):
+        """Runs a blocking function (e.g. a restart) on the manager's
+        executor. It can be called from any thread, and since nobody waits
+        for the result, failures are logged.
+
+        Returns:
+            concurrent.futures.Future: The call, or None if shutting down
+        """
+        try:
+            future = self._executor.submit(func, *args)
+        except RuntimeError:
+            # Shutting down
+            return None
+        def done(future):
+            if not future.cancelled() and future.exception() is not None:
+                logging.error(f"{func.__name__} failed", exc_info=future.exception())
+        future.add_done_callback(done)
+        return future
+            
+    def restart_process(self, process):
+        if process.active:
+            process.kill()
+        process.start(True)
+            
+    def _on_probe_result(self, process, probe):
+        """Restarts processes whose liveness probe started failing"""
+        if probe is process.liveness and probe.status == health.FAILING and process.job is None:
+            probe.reset()
+            self.run_in_background(self.restart_process, process)
+            
     def assert_logdir_exists(self):
         if self.log_dir is None:
             raise ValueError("Log directory wasn't specified")
@@ -66,20 +458,102 @@ class ProcessManager:
     def log_process_cpu(self, process):
         self.assert_logdir_exists()
         log_file = os.path.join(self.log_dir, process.name)
-        with open(log_file+"_log_cpu", "ab") as file:
-            file.write(struct.pack("d", process.get_cpu_perc()))
+        _, cpu, _ = self.sample_metrics([process]).get(process.name)
+        with self._stats.timer("log.write"):
+            series.append(log_file+"_log_cpu", "cpu", cpu)
             
     def log_process_memory(self, process):
         self.assert_logdir_exists()
         log_file = os.path.join(self.log_dir, process.name)
-        with open(log_file+"_log_mem", "ab") as file:
-            file.write(struct.pack("d", process.get_mem_usage().bytes))
+        _, _, mem = self.sample_metrics([process]).get(process.name)
+        with self._stats.timer("log.write"):
+            series.append(log_file+"_log_mem", process.mem_metric, mem)
+            
+    def log_process_sched(self, process):
+        self.assert_logdir_exists()
+        info = self.read_sched(process)
+        if info is None:
+            return
+        log_file = os.path.join(self.log_dir, process.name)
+        with self._stats.timer("log.write"):
+            series.append(log_file+"_log_ctxsw", "ctxsw", info.voluntary + info.involuntary)
+            if info.migrations is not None:
+                series.append(log_file+"_log_migr", "migrations", info.migrations)
+            
+    def read_sched(self, process):
+        """Reads the context switches and CPU migrations of a process (over
+        its whole tree if needed).
+
+        Returns:
+            procfs.SchedInfo: Totals since it started (migrations are None if
+            they can't be read), or None if it isn't running
+        """
+        
+        if not process.active:
+            return None
+        with self._stats.timer("sample.sched"):
+            infos = []
+            for pid in process.pids():
+                try:
+                    info = procfs.read_sched(pid) if procfs.AVAILABLE else None
+                    if info is None:
+                        switches = psutil.Process(pid).num_ctx_switches()
+                        info = procfs.SchedInfo(switches.voluntary, switches.involuntary, None)
+                    infos.append(info)
+                except (OSError, psutil.Error):
+                    continue
+        if not infos:
+            return None
+        migrations = [i.migrations for i in infos]
+        return procfs.SchedInfo(sum(i.voluntary for i in infos), 
+                                sum(i.involuntary for i in infos),
+                                None if None in migrations else sum(migrations))
+            
+    def read_memory(self, processes):
+        """Reads the memory usage of several processes in a single sweep.
+
+        Args:
+            processes (list): Processes to read
+
+        Returns:
+            dict: procfs.MemoryInfo for each active process' PID, summed over
+            its whole tree if needed (empty if /proc isn't available, in 
+            which case each process is queried separately)
+        """
+        
+        if not procfs.AVAILABLE:
+            return {}
+        with self._stats.timer("sample.memory"):
+            return self._read_memory(processes)
+        
+    def _read_memory(self, processes):
+        pids = {}
+        basic, detailed = [], []
+        for process in processes:
+            if process.active:
+                pids[process.pid] = process.pids()
+                (detailed if process.detailed_memory else basic).extend(pids[process.pid])
+        info = procfs.read_memory(basic)
+        info.update(procfs.read_memory(detailed, True))
+        return {
+            pid: sum_memory(info[p] for p in tree if p in info) 
+            for pid, tree in pids.items()
+        }
             
     def _process_command(self, command, sock):
+        """Handles a command received through sock.
+
+        Returns:
+            bool: True if the connection was kept open (for subscriptions)
+        """
+        
+        start = time.perf_counter()
         try:
             command = shlex.split(command)
             if len(command) == 0:
                 sock.sendall(const.MSG_CODE+b"Error: Unrecognized command")  
+            elif command[0] == const.CMD_SUBSCRIBE:
+                return self._process_command_subscribe(command, sock)
             elif command[0] == const.CMD_GET_MEMORY:
                 self._process_get_mem_cmd(command, sock)
             elif command[0] == const.CMD_GET_CPU:
@@ -104,12 +578,60 @@ class ProcessManager:
                 self._process_get_stderr(command, sock)
             elif command[0] == const.CMD_GET_STDOUT:
                 self._process_get_stdout(command, sock)
+            elif command[0] == const.CMD_GET_HEALTH:
+                self._process_get_health_cmd(command, sock)
+            elif command[0] == const.CMD_STATUS:
+                self._process_status_cmd(command, sock)
+            elif command[0] == const.CMD_OVERVIEW:
+                self._process_overview_cmd(command, sock)
             elif command[0] == const.CMD_LIST:
                 self._process_list_cmd(command, sock)
+            elif command[0] == const.CMD_LOGS:
+                self._process_logs_cmd(command, sock)
+            elif command[0] == const.CMD_SELFSTATS:
+                self._process_selfstats_cmd(command, sock)
+            elif command[0] == const.CMD_PROFILE:
+                self._process_profile_cmd(command, sock)
+            elif command[0] == const.CMD_RUN:
+                self._process_run_cmd(command, sock)
+            elif command[0] == const.CMD_JOBS:
+                self._process_jobs_cmd(command, sock)
+            elif command[0] == const.CMD_SCHED:
+                self._process_sched_cmd(command, sock)
+            elif command[0] == const.CMD_ADD_ALERT:
+                self._process_add_alert_cmd(command, sock)
+            elif command[0] == const.CMD_REMOVE_ALERT:
+                self._process_rem_alert_cmd(command, sock)
+            elif command[0] == const.CMD_ALERTS:
+                self._process_alerts_cmd(command, sock)
+            elif command[0] == const.CMD_METRICS:
+                self._process_metrics_cmd(command, sock)
             else:
                 sock.sendall(const.MSG_CODE+b"Error: Unrecognized command") 
         except ConnectionResetError:
-            pass
+            self._stats.count("command.reset")
+        except ValueError:
+            # Unbalanced quotes
+            sock.sendall(const.MSG_CODE+b"Error: Unrecognized command")
+        finally:
+            if isinstance(command, list) and command:
+                self._stats.observe(command_timer(command[0]), time.perf_counter() - start)
+        return False
+    
+    def _process_command_subscribe(self, command, sock):
+        try:
+            names = command[1:]
+            for name in names:
+                if self.get_process(name) is None:
+                    sock.sendall(const.MSG_CODE+b"Error: Couldn't find process '" + name.encode() + b"'")
+                    return False
+            sock.sendall(const.DATA_CODE)
+            # Subscribed by the main loop on its next tick (see add_subscribers)
+            self._events.request(sock, names)
+            return True
+        except Exception:
+            sock.sendall(const.MSG_CODE+b"Error: Couldn't subscribe")
+            return False
             
     def _process_get_stdout(self, command, sock):
         try:
@@ -145,6 +667,95 @@ class ProcessManager:
         except Exception:
             sock.sendall(const.MSG_CODE+b"Error: Couldn't get stderr")
     
+    def _process_logs_cmd(self, command, sock):
+        for _ in self._stream_logs(command, sock):
+            pass
+            
+    def _stream_logs(self, command, sock):
+        """Sends the lines asked for by a logs command in batches, yielding
+        after each one (so the async daemon can wait for the client to read
+        it)"""
+        streaming = False
+        try:
+            names = [arg for arg in command[1:] if "=" not in arg]
+            processes = []
+            for name in names:
+                process = self.get_process(name)
+                if process is None:
+                    sock.sendall(const.MSG_CODE+b"Error: Couldn't find process '" + name.encode() + b"'")
+                    return
+                processes.append(process)
+            try:
+                options = parse_options([arg for arg in command[1:] if "=" in arg])
+                for option in options:
+                    if option not in ("grep", "level", "since", "stream", "limit", "merge"):
+                        raise ValueError(f"Unknown option '{option}'")
+                merge = sbool(options.get("merge"))
+                if len(names) == 0 or (len(names) > 1 and not merge):
+                    raise ValueError("Invalid number of arguments (use merge=True for several processes)")
+                since = options.get("since")
+                filters = {
+                    "grep": options.get("grep"),
+                    "level": options.get("level"),
+                    "since": float(since) if since is not None else None,
+                    "stream": options.get("stream")
+                }
+                limit = options.get("limit")
+                limit = int(limit) if limit is not None else None
+                for process in processes:
+                    # Include what was printed since the last drain
+                    self.drain_output(process)
+                if merge:
+                    records = self.merged_logs(processes, filters, limit)
+                else:
+                    records = (r.to_dict() for r in processes[0].logs.query(limit=limit, **filters))
+            except (ValueError, re.error) as e:
+                sock.sendall(const.MSG_CODE+b"Error: " + str(e).encode())
+                return
+            sock.sendall(const.DATA_CODE)
+            streaming = True
+            batch = []
+            for record in records:
+                batch.append(json.dumps(record, separators=(",", ":")))
+                if len(batch) == 256:
+                    sock.sendall("\n".join(batch).encode() + b"\n")
+                    yield
+                    batch = []
+            if batch:
+                sock.sendall("\n".join(batch).encode() + b"\n")
+        except ConnectionResetError:
+            raise
+        except Exception:
+            if streaming:
+                logging.exception("Couldn't send the logs")
+            else:
+                sock.sendall(const.MSG_CODE+b"Error: Couldn't get logs")
+            
+    def merged_logs(self, processes, filters, limit=None):
+        """Interleaves the output of several processes in time order. The 
+        log files (current and rotated) are read when there are any, since 
+        they go further back than the records kept in memory.
+
+        Args:
+            processes (list): Processes
+            filters (dict): Filters (see logs.record_filter)
+            limit (int, optional): Only the most recent records. Defaults to
+            None.
+
+        Returns:
+            iterator: Records (as dicts, with the name of the process), 
+            oldest first
+        """
+        
+        sources = {}
+        for process in processes:
+            log_file = self.log_file(process)
+            if log_file is not None and log_file.paths():
+                sources[process.name] = log_file.read()
+            else:
+                sources[process.name] = (r.to_dict() for r in process.logs.query())
+        return logs.merge(sources, logs.record_filter(**filters), limit)
+    
     def _process_list_cmd(self, command, sock):
         try:
             if len(command) == 1:
@@ -191,7 +802,7 @@ class ProcessManager:
                     memory = None
                     for process in self._processes:
                         if process.name == name:
-                            memory = process.get_mem_usage().bytes   
+                            _, _, memory = self.request_metrics([process]).get(name)
                             break 
                     if memory is None:
                         sock.sendall(const.MSG_CODE+b"Error: Couldn't find process '" + name.encode() + b"'")
@@ -199,8 +810,9 @@ class ProcessManager:
                         sock.sendall(const.DATA_CODE+name.encode()+b"\x00"+struct.pack("d", memory))
                 else:
                     memory = []
+                    metrics = self.request_metrics(self._processes)
                     for process in self._processes:
-                        memory.append((process.name, process.get_mem_usage().bytes))
+                        memory.append((process.name, metrics.get(process.name)[2]))
                     message = []
                     for mem in memory:
                         message.append(mem[0].encode()+b"\x00"+struct.pack("d", mem[1]))
@@ -210,6 +822,151 @@ class ProcessManager:
         except Exception:
             sock.sendall(const.MSG_CODE+b"Error: Couldn't get process memory usage")
             
+    def _process_get_health_cmd(self, command, sock):
+        try:
+            if 1 <= len(command) <= 2:
+                if len(command) == 2:
+                    processes = [p for p in self._processes if p.name == command[1]]
+                    if len(processes) == 0:
+                        sock.sendall(const.MSG_CODE+b"Error: Couldn't find process '" + command[1].encode() + b"'")
+                        return
+                else:
+                    processes = self._processes
+                message = []
+                for process in processes:
+                    liveness, readiness = process.health
+                    message.append(process.name.encode()+b"\x00"
+                                   +str(liveness or "N/A").encode()+b"\x00"
+                                   +str(readiness or "N/A").encode()+b"\x00")
+                sock.sendall(const.DATA_CODE+b"".join(message))
+            else:
+                sock.sendall(const.MSG_CODE+b"Error: Invalid number of arguments")
+        except Exception:
+            sock.sendall(const.MSG_CODE+b"Error: Couldn't get process health")
+            
+    def history(self, process, kind, n):
+        """Returns the last n logged values of the CPU or memory usage of a
+        process (or an empty list if they aren't being logged)"""
+        logged = self._log_cpu if kind == "cpu" else self._log_memory
+        if self.log_dir is None or process not in logged:
+            return []
+        path = os.path.join(self.log_dir, process.name+"_log_"+kind)
+        try:
+            return series.tail(path, n)
+        except FileNotFoundError:
+            return []
+            
+    def status_record(self, process, metrics, sched=False):
+        """Returns the status of a process as a dict (see the status command),
+        given the sampled metrics. Its context switches and migrations are
+        only read (one file per process in its tree) if sched is True."""
+        sampled = process.name in metrics
+        _, cpu, mem = metrics.get(process.name)
+        liveness, readiness = process.health
+        sched = self.read_sched(process) if sched else None
+        return {
+            "name": process.name,
+            "pid": process.pid if process.active else None,
+            "status": "active" if process.active else "stopped",
+            "mem": int(mem) if sampled else None,
+            "mem_metric": process.mem_metric,
+            "cpu": cpu if sampled else None,
+            "uptime": process.uptime.seconds if process.active else 0,
+            "liveness": liveness,
+            "readiness": readiness,
+            "output": process.output_stats,
+            "cpus": process.cpus,
+            "nice": process.nice,
+            "ionice": process.ionice,
+            "ctx_switches": None if sched is None else {
+                "voluntary": sched.voluntary, 
+                "involuntary": sched.involuntary
+            },
+            "migrations": None if sched is None else sched.migrations
+        }
+            
+    def _process_status_cmd(self, command, sock):
+        for _ in self._stream_status(command, sock):
+            pass
+            
+    def _stream_status(self, command, sock):
+        """Sends the records of a status command in batches, yielding after
+        each one (see _stream_logs)"""
+        streaming = False
+        try:
+            names = [arg for arg in command[1:] if "=" not in arg]
+            try:
+                options = parse_options([arg for arg in command[1:] if "=" in arg])
+                for option in options:
+                    if option != "sched":
+                        raise ValueError(f"Unknown option '{option}'")
+            except ValueError as e:
+                sock.sendall(const.MSG_CODE+b"Error: " + str(e).encode())
+                return
+            sched = sbool(options.get("sched"))
+            if len(names) <= 1:
+                if len(names) == 1:
+                    processes = [p for p in self._processes if p.name == names[0]]
+                    if len(processes) == 0:
+                        sock.sendall(const.MSG_CODE+b"Error: Couldn't find process '" + names[0].encode() + b"'")
+                        return
+                else:
+                    processes = list(self._processes)
+                sock.sendall(const.DATA_CODE)
+                streaming = True
+                # Records are sent in batches, so neither side ever holds the
+                # status of a whole large fleet
+                for i in range(0, len(processes), 256):
+                    batch = processes[i:i+256]
+                    metrics = self.request_metrics(batch)
+                    lines = []
+                    for process in batch:
+                        try:
+                            record = self.status_record(process, metrics, sched)
+                        except Exception:
+                            # It changed while being read (e.g. it exited),
+                            # which mustn't break the records already sent
+                            logging.exception(f"Couldn't get the status of '{process.name}'")
+                            record = dict.fromkeys(STATUS_FIELDS)
+                            record["name"] = process.name
+                        lines.append(json.dumps(record, separators=(",", ":")).encode())
+                    sock.sendall(b"\n".join(lines) + b"\n")
+                    yield
+            else:
+                sock.sendall(const.MSG_CODE+b"Error: Invalid number of arguments")
+        except ConnectionResetError:
+            raise
+        except Exception:
+            if streaming:
+                # An error message would corrupt the records, so the client
+                # only sees them end early
+                logging.exception("Couldn't send the status")
+            else:
+                sock.sendall(const.MSG_CODE+b"Error: Couldn't get process status")
+            
+    def _process_overview_cmd(self, command, sock):
+        try:
+            if 1 <= len(command) <= 2:
+                samples = int(command[1]) if len(command) == 2 else 30
+                processes = list(self._processes)
+                metrics = self.request_metrics(processes)
+                overview = []
+                for process in processes:
+                    _, cpu, mem = metrics.get(process.name)
+                    overview.append({
+                        "name": process.name,
+                        "pid": process.pid,
+                        "cpu": cpu,
+                        "mem": int(mem),
+                        "cpu_history": self.history(process, "cpu", samples),
+                        "mem_history": self.history(process, "mem", samples)
+                    })
+                sock.sendall(const.DATA_CODE+json.dumps(overview, separators=(",", ":")).encode())
+            else:
+                sock.sendall(const.MSG_CODE+b"Error: Invalid number of arguments")
+        except Exception:
+            sock.sendall(const.MSG_CODE+b"Error: Couldn't get overview")
+            
     def _process_get_pid_cmd(self, command, sock):
         try:
             if 1 <= len(command) <= 2:
@@ -245,7 +1002,7 @@ class ProcessManager:
                     cpu = None
                     for process in self._processes:
                         if process.name == name:
-                            cpu = process.get_cpu_perc()   
+                            _, cpu, _ = self.request_metrics([process]).get(name)
                             break 
                     if cpu is None:
                         sock.sendall(const.MSG_CODE+b"Error: Couldn't find process '" + name.encode() + b"'")
@@ -253,8 +1010,9 @@ class ProcessManager:
                         sock.sendall(const.DATA_CODE+name.encode()+b"\x00"+struct.pack("d", cpu))
                 else:
                     cpu = []
+                    metrics = self.request_metrics(self._processes)
                     for process in self._processes:
-                        cpu.append((process.name, process.get_cpu_perc()))
+                        cpu.append((process.name, metrics.get(process.name)[1]))
                     message = []
                     for c in cpu:
                         message.append(c[0].encode()+b"\x00"+struct.pack("d", c[1]))
@@ -266,8 +1024,8 @@ class ProcessManager:
             
     def _process_command_add_proc(self, command, sock):
         try:
-            if len(command) == 6:
-                name, cmd, log_cpu, log_freq, dir_ = command[1:]
+            if len(command) >= 6:
+                name, cmd, log_cpu, log_freq, dir_ = command[1:6]
                 if len(name) > 16:
                     sock.sendall(const.MSG_CODE+b"Error: Name can't be over 16 characters long")
                     return
@@ -277,7 +1035,105 @@ class ProcessManager:
                 if not cmd.isprintable():
                     sock.sendall(const.MSG_CODE+b"Error: Invalid command")
                     return
-                process = Process(name, cmd, dir_)
+                try:
+                    options = parse_options(command[6:])
+                except ValueError as e:
+                    sock.sendall(const.MSG_CODE+b"Error: " + str(e).encode())
+                    return
+                for option in options:
+                    if option not in const.PROCESS_OPTIONS:
+                        sock.sendall(const.MSG_CODE+b"Error: Unknown option '" + option.encode() + b"'")
+                        return
+                mem_metric = options.get("mem_metric")
+                if mem_metric is not None and mem_metric not in const.MEMORY_METRICS:
+                    sock.sendall(const.MSG_CODE+b"Error: Invalid memory metric '" + mem_metric.encode() + b"'")
+                    return
+                try:
+                    probe_options = {
+                        "period": float(options.get("probe_period", 10)),
+                        "timeout": float(options.get("probe_timeout", 1)),
+                        "threshold": int(options.get("probe_threshold", 3))
+                    }
+                    probes = {}
+                    for kind in ("liveness", "readiness"):
+                        if kind in options:
+                            probes[kind] = health.parse_probe(options[kind], **probe_options)
+                except ValueError as e:
+                    sock.sendall(const.MSG_CODE+b"Error: " + str(e).encode())
+                    return
+                output_policy = options.get("output_policy", capture.DROP_OLDEST)
+                if output_policy not in capture.POLICIES:
+                    sock.sendall(const.MSG_CODE+b"Error: Invalid output policy '" + output_policy.encode() + b"'")
+                    return
+                try:
+                    output_buffer = int(options.get("output_buffer", 2**20))
+                    if output_buffer <= 0:
+                        raise ValueError
+                except ValueError:
+                    sock.sendall(const.MSG_CODE+b"Error: Invalid output buffer size")
+                    return
+                depends_on = [d for d in options.get("depends_on", "").split(",") if d]
+                for dep in depends_on:
+                    if self.get_process(dep) is None:
+                        sock.sendall(const.MSG_CODE+b"Error: Couldn't find dependency '" + dep.encode() + b"'")
+                        return
+                if not os.path.isdir(dir_):
+                    sock.sendall(const.MSG_CODE+b"Error: Directory '" + dir_.encode() + b"' doesn't exist")
+                    return
+                job = None
+                if "overlap" in options and not ("cron" in options or sbool(options.get("job"))):
+                    sock.sendall(const.MSG_CODE+b"Error: Only jobs have an overlap policy")
+                    return
+                if "cron" in options or sbool(options.get("job")):
+                    try:
+                        cron = jobs.CronExpression(options["cron"]) if "cron" in options else None
+                        job = jobs.Job(cron, options.get("overlap", jobs.SKIP))
+                    except ValueError as e:
+                        sock.sendall(const.MSG_CODE+b"Error: " + str(e).encode())
+                        return
+                try:
+                    stop_signal = parse_signal(options.get("stop_signal", "TERM"))
+                    grace = float(options.get("grace", 10))
+                    if grace < 0:
+                        raise ValueError("Invalid grace period")
+                except ValueError as e:
+                    sock.sendall(const.MSG_CODE+b"Error: " + str(e).encode())
+                    return
+                try:
+                    sched = self.parse_scheduling(options)
+                except ValueError as e:
+                    sock.sendall(const.MSG_CODE+b"Error: " + str(e).encode())
+                    return
+                watched = [p for p in options.get("watch", "").split(",") if p]
+                for path in watched:
+                    if not os.path.exists(os.path.join(dir_, path)):
+                        sock.sendall(const.MSG_CODE+b"Error: Watched path '" + path.encode() + b"' doesn't exist")
+                        return
+                try:
+                    env = json.loads(options.get("env", "{}"))
+                    if not isinstance(env, dict) or not all(isinstance(v, str) for v in env.values()):
+                        raise ValueError
+                except ValueError:
+                    sock.sendall(const.MSG_CODE+b"Error: Invalid environment")
+                    return
+                try:
+                    process = Process(name, cmd, dir_, 
+                                      depends_on=depends_on,
+                                      tree=sbool(options.get("tree")), 
+                                      mem_metric=mem_metric,
+                                      output_policy=output_policy,
+                                      output_buffer=output_buffer,
+                                      env=env,
+                                      job=job,
+                                      watch=watched,
+                                      ignore=[g for g in options.get("ignore", "").split(",") if g],
+                                      stop_signal=stop_signal,
+                                      grace=grace,
+                                      **sched,
+                                      **probes)
+                except ValueError as e:
+                    sock.sendall(const.MSG_CODE+b"Error: Invalid command (" + str(e).encode() + b")")
+                    return
                 if self.add_process(process, sbool(log_cpu), sbool(log_freq)):
                     sock.sendall(const.MSG_CODE+b"Successfully added process '" + name.encode() + b"'")
                 else:
@@ -302,28 +1158,26 @@ class ProcessManager:
                 if process is None:
                     sock.sendall(const.MSG_CODE+b"Error: Couldn't find process '" + name.encode() + b"'")
                     return
+                if process.job is not None:
+                    sock.sendall(const.MSG_CODE+b"Error: '" + name.encode() + b"' is a job (use run)")
+                    return
                 if process.active:
                     process.kill()
                 process.start(True)
                 sock.sendall(const.MSG_CODE+b"Successfully restarted process '" + name.encode() + b"'")
             else:
-                if len(self._processes) == 0:
+                services = self.services
+                if len(services) == 0:
                     sock.sendall(const.MSG_CODE+b"Warning: No processes to restart")
                     return
-                c = 0
-                for process in self._processes:
-                    try:
-                        if process.active:
-                            process.kill()
-                        process.start(True)
-                        c += 1
-                    except Exception:
-                        pass
+                self.stop_processes(services)
+                started, _ = self.start_processes(services)
+                c = len(started)
                 if c == 0:
                     sock.sendall(const.MSG_CODE+b"Warning: No processes were restarted")
                 else:
                     total = str(c).encode()
-                    length = str(len(self._processes)).encode()
+                    length = str(len(services)).encode()
                     sock.sendall(const.MSG_CODE+b"Restarted " + total + b" out of " + length + b" processes")
                 
         except Exception:
@@ -336,36 +1190,32 @@ class ProcessManager:
                 return
             if len(command) == 2:
                 name = command[1]
-                process = None
-                for proc in self._processes:
-                    if proc.name == name:
-                        process = proc
-                        break 
+                process = self.get_process(name)
                 if process is None:
                     sock.sendall(const.MSG_CODE+b"Error: Couldn't find process '" + name.encode() + b"'")
                     return
-                if process.active:
+                if process.job is not None:
+                    self._process_run_cmd(command, sock)
+                elif process.active:
                     sock.sendall(const.MSG_CODE+b"Warning: Process was already running, so nothing was done")
                 else:
-                    process.start(True)
-                    sock.sendall(const.MSG_CODE+b"Successfully started process '" + name.encode() + b"'")
+                    self.start_processes(self.with_dependencies(process))
+                    if process.active:
+                        sock.sendall(const.MSG_CODE+b"Successfully started process '" + name.encode() + b"'")
+                    else:
+                        sock.sendall(const.MSG_CODE+b"Error: Couldn't start process '" + name.encode() + b"'")
             else:
-                if len(self._processes) == 0:
+                services = self.services
+                if len(services) == 0:
                     sock.sendall(const.MSG_CODE+b"Warning: No processes to start")
                     return
-                c = 0
-                for process in self._processes:
-                    if not process.active:
-                        try:
-                            process.start(True)
-                            c += 1
-                        except Exception:
-                            pass
+                started, _ = self.start_processes([p for p in services if not p.active])
+                c = len(started)
                 if c == 0:
                     sock.sendall(const.MSG_CODE+b"Warning: No processes were started")
                 else:
                     total = str(c).encode()
-                    length = str(len(self._processes)).encode()
+                    length = str(len(services)).encode()
                     sock.sendall(const.MSG_CODE+b"Started " + total + b" out of " + length + b" processes")
                 
         except Exception:
@@ -385,6 +1235,10 @@ class ProcessManager:
             if process is None:
                 sock.sendall(const.MSG_CODE+b"Error: Couldn't find process '" + name.encode() + b"'")
                 return
+            for proc in self._processes:
+                if name in proc.depends_on:
+                    sock.sendall(const.MSG_CODE+b"Error: Process '" + proc.name.encode() + b"' depends on '" + name.encode() + b"'")
+                    return
             if process.active:
                 process.kill()
             self.rem_process(process)
@@ -416,12 +1270,374 @@ class ProcessManager:
         except Exception:
             sock.sendall(const.MSG_CODE+b"Error: Couldn't kill process")
             
+    def _process_run_cmd(self, command, sock):
+        try:
+            if len(command) != 2:
+                sock.sendall(const.MSG_CODE+b"Error: Invalid number of arguments")
+                return
+            name = command[1]
+            process = self.get_process(name)
+            if process is None:
+                sock.sendall(const.MSG_CODE+b"Error: Couldn't find process '" + name.encode() + b"'")
+                return
+            if process.job is None:
+                sock.sendall(const.MSG_CODE+b"Error: '" + name.encode() + b"' isn't a job")
+                return
+            if self._jobs.trigger(process):
+                sock.sendall(const.MSG_CODE+b"Queued job '" + name.encode() + b"'")
+            else:
+                sock.sendall(const.MSG_CODE+b"Warning: Job '" + name.encode() + b"' is already running, so nothing was done")
+        except Exception:
+            sock.sendall(const.MSG_CODE+b"Error: Couldn't run job")
+            
+    def _process_jobs_cmd(self, command, sock):
+        try:
+            if len(command) != 1:
+                sock.sendall(const.MSG_CODE+b"Error: Invalid number of arguments")
+                return
+            result = []
+            for process in self._processes:
+                if process.job is not None:
+                    result.append({"name": process.name, "command": process.command,
+                                   **process.job.to_dict()})
+            sock.sendall(const.DATA_CODE+json.dumps(result, separators=(",", ":")).encode())
+        except Exception:
+            sock.sendall(const.MSG_CODE+b"Error: Couldn't list jobs")
+            
+    def query_metrics(self, name, metric="cpu", since=None, until=None, step=None, 
+                      aggregates=("avg",), max_points=10000):
+        """Aggregates the logged history of a metric of a process into 
+        buckets of step seconds, reading only the requested time range.
+
+        Args:
+            name (str): Process name
+            metric (str, optional): One of const.METRIC_FILES. Defaults to
+            'cpu'.
+            since (float, optional): UNIX timestamp. Defaults to an hour ago.
+            until (float, optional): UNIX timestamp. Defaults to now.
+            step (float, optional): Bucket width in seconds. Defaults to 
+            whatever gives about 500 buckets (but at least the log period).
+            aggregates (tuple, optional): See series.aggregate. Defaults to
+            ("avg",).
+            max_points (int, optional): Maximum number of buckets. Defaults
+            to 10000.
+
+        Raises:
+            ValueError: If an argument is invalid or nothing was logged
+
+        Returns:
+            dict: The buckets, by column
+        """
+        
+        if metric not in const.METRIC_FILES:
+            raise ValueError(f"Invalid metric '{metric}' ({', '.join(const.METRIC_FILES)})")
+        if not aggregates:
+            raise ValueError("No aggregates")
+        for aggregate in aggregates:
+            series.check_aggregate(aggregate)
+        if self.log_dir is None:
+            raise ValueError("Log directory wasn't specified")
+        path = os.path.join(self.log_dir, name + const.METRIC_FILES[metric])
+        if not os.path.isfile(path):
+            raise ValueError(f"No {metric} history for '{name}'")
+        until = time.time() if until is None else until
+        since = until - 3600 if since is None else since
+        if step is None:
+            step = max(self.log_period, (until - since) / 500)
+        if step <= 0 or (until - since) / step > max_points:
+            raise ValueError(f"Invalid step (at most {max_points} points can be returned)")
+        with open(path, "rb") as file:
+            unit = series.read_header(file)
+        times, columns = [], {aggregate: [] for aggregate in aggregates}
+        with self._stats.timer("metrics.query"):
+            samples = series.read_range(path, since, until)
+            for start, values in series.downsample(samples, step, aggregates):
+                times.append(start)
+                for aggregate, value in zip(aggregates, values):
+                    columns[aggregate].append(round(value, 3))
+        return {
+            "name": name,
+            "metric": metric,
+            "unit": unit,
+            "step": step,
+            "time": times,
+            "values": columns
+        }
+        
+    def _process_metrics_cmd(self, command, sock):
+        try:
+            if len(command) < 2:
+                sock.sendall(const.MSG_CODE+b"Error: Invalid number of arguments")
+                return
+            name = command[1]
+            try:
+                options = parse_options(command[2:])
+                for option in options:
+                    if option not in ("metric", "since", "until", "step", "agg"):
+                        raise ValueError(f"Unknown option '{option}'")
+                step = options.get("step")
+                if step is not None:
+                    step = float(step) if step.replace(".", "", 1).isdigit() else alerts.parse_duration(step)
+                result = self.query_metrics(
+                    name, 
+                    options.get("metric", "cpu"),
+                    float(options["since"]) if "since" in options else None,
+                    float(options["until"]) if "until" in options else None,
+                    step,
+                    tuple(a for a in options.get("agg", "avg").split(",") if a)
+                )
+            except ValueError as e:
+                sock.sendall(const.MSG_CODE+b"Error: " + str(e).encode())
+                return
+            sock.sendall(const.DATA_CODE+json.dumps(result, separators=(",", ":")).encode())
+        except Exception:
+            sock.sendall(const.MSG_CODE+b"Error: Couldn't query metrics")
+            
+    def _process_add_alert_cmd(self, command, sock):
+        try:
+            if not 4 <= len(command) <= 5:
+                sock.sendall(const.MSG_CODE+b"Error: Invalid number of arguments")
+                return
+            name, process, condition = command[1:4]
+            if not name.isidentifier():
+                sock.sendall(const.MSG_CODE+b"Error: Invalid name")
+                return
+            if process != alerts.ALL and self.get_process(process) is None:
+                sock.sendall(const.MSG_CODE+b"Error: Couldn't find process '" + process.encode() + b"'")
+                return
+            try:
+                options = parse_options(command[4:])
+                for option in options:
+                    if option != "action":
+                        raise ValueError(f"Unknown option '{option}'")
+                rule = alerts.Rule(name, process, condition, options.get("action", "log"))
+            except ValueError as e:
+                sock.sendall(const.MSG_CODE+b"Error: " + str(e).encode())
+                return
+            if self._alerts.add(rule):
+                sock.sendall(const.MSG_CODE+b"Successfully added alert '" + name.encode() + b"'")
+            else:
+                sock.sendall(const.MSG_CODE+b"Error: There is already an alert named '" + name.encode() + b"'")
+        except Exception:
+            sock.sendall(const.MSG_CODE+b"Error: Couldn't add alert")
+            
+    def _process_rem_alert_cmd(self, command, sock):
+        try:
+            if len(command) != 2:
+                sock.sendall(const.MSG_CODE+b"Error: Invalid number of arguments")
+                return
+            if self._alerts.remove(command[1]) is None:
+                sock.sendall(const.MSG_CODE+b"Error: Couldn't find alert '" + command[1].encode() + b"'")
+            else:
+                sock.sendall(const.MSG_CODE+b"Successfully removed alert '" + command[1].encode() + b"'")
+        except Exception:
+            sock.sendall(const.MSG_CODE+b"Error: Couldn't remove alert")
+            
+    def _process_alerts_cmd(self, command, sock):
+        try:
+            if len(command) != 1:
+                sock.sendall(const.MSG_CODE+b"Error: Invalid number of arguments")
+                return
+            rules = [rule.to_dict() for rule in self._alerts.rules()]
+            sock.sendall(const.DATA_CODE+json.dumps(rules, separators=(",", ":")).encode())
+        except Exception:
+            sock.sendall(const.MSG_CODE+b"Error: Couldn't list alerts")
+    
+    @staticmethod
+    def parse_scheduling(options):
+        """Parses the cpus, nice and ionice options.
+
+        Raises:
+            ValueError: If any of them is invalid
+
+        Returns:
+            dict: The settings (None for those missing)
+        """
+        
+        parsers = {
+            "cpus": scheduling.parse_cpus,
+            "nice": scheduling.parse_nice,
+            "ionice": scheduling.parse_ionice
+        }
+        return {
+            key: parse(options[key]) if key in options else None
+            for key, parse in parsers.items()
+        }
+        
+    def _process_sched_cmd(self, command, sock):
+        try:
+            if len(command) < 2:
+                sock.sendall(const.MSG_CODE+b"Error: Invalid number of arguments")
+                return
+            name = command[1]
+            process = self.get_process(name)
+            if process is None:
+                sock.sendall(const.MSG_CODE+b"Error: Couldn't find process '" + name.encode() + b"'")
+                return
+            try:
+                options = parse_options(command[2:])
+                for option in options:
+                    if option not in ("cpus", "nice", "ionice"):
+                        raise ValueError(f"Unknown option '{option}'")
+                sched = self.parse_scheduling(options)
+            except ValueError as e:
+                sock.sendall(const.MSG_CODE+b"Error: " + str(e).encode())
+                return
+            if options:
+                try:
+                    process.set_scheduling(**sched)
+                except psutil.AccessDenied:
+                    sock.sendall(const.MSG_CODE+b"Error: Not allowed to raise the priority of '" + name.encode() + b"'")
+                    return
+                except NotImplementedError as e:
+                    sock.sendall(const.MSG_CODE+b"Error: " + str(e).encode())
+                    return
+            cpus = ",".join(map(str, process.cpus)) if process.cpus is not None else "all"
+            nice = process.nice if process.nice is not None else "default"
+            ionice = process.ionice if process.ionice is not None else "default"
+            prefix = "Updated" if options else "Scheduling of"
+            sock.sendall(const.MSG_CODE+f"{prefix} '{name}': cpus={cpus} nice={nice} ionice={ionice}".encode())
+        except Exception:
+            sock.sendall(const.MSG_CODE+b"Error: Couldn't change scheduling")
+            
+    def _process_selfstats_cmd(self, command, sock):
+        try:
+            if len(command) != 1:
+                sock.sendall(const.MSG_CODE+b"Error: Invalid number of arguments")
+                return
+            stats = self._stats.snapshot()
+            me = psutil.Process()
+            times = me.cpu_times()
+            stats.update({
+                "rss": me.memory_info().rss,
+                "cpu_time": times.user + times.system,
+                "threads": me.num_threads(),
+                "processes": len(self._processes),
+                "active": sum(1 for p in self._processes if p.active),
+                "jobs_running": self._jobs.running,
+                "alert_rules": len(self._alerts),
+                "alert_backlog": self._alerts.backlog,
+                "subscribers": len(self._events._subscribers),
+                "output": {p.name: p.output_stats for p in self._processes}
+            })
+            sock.sendall(const.DATA_CODE+json.dumps(stats).encode())
+        except Exception:
+            sock.sendall(const.MSG_CODE+b"Error: Couldn't get statistics")
+            
+    def profile(self, seconds, mode="sample"):
+        """Profiles the daemon in the background and writes the result to the
+        log directory. Sampling covers every thread, while cProfile only 
+        covers the main loop (sampling, log writes and output drains).
+
+        Args:
+            seconds (float): How long to profile for
+            mode (str, optional): 'sample' for collapsed stacks or 'cprofile'
+            for a pstats file. Defaults to 'sample'.
+
+        Raises:
+            ValueError: If a profile is already being taken
+
+        Returns:
+            str: Path the result will be written to
+        """
+        
+        self.assert_logdir_exists()
+        with self._profile_lock:
+            if self._profile is not None:
+                raise ValueError("A profile is already being taken")
+            stamp = time.strftime("%Y%m%d-%H%M%S")
+            extension = "prof" if mode == "cprofile" else "txt"
+            path = os.path.join(self.log_dir, f"profile-{stamp}.{extension}")
+            # A cProfile request is picked up by the main loop, which 
+            # profiles itself
+            self._profile = {
+                "mode": mode,
+                "deadline": time.monotonic() + seconds,
+                "path": path,
+                "profiler": None
+            }
+            if mode == "sample":
+                def sample():
+                    try:
+                        write_stacks(sample_stacks(seconds), path)
+                    finally:
+                        with self._profile_lock:
+                            self._profile = None
+                thread = threading.Thread(target=sample)
+                thread.daemon = True
+                thread.start()
+        return path
+    
+    def _profile_tick(self):
+        """Starts or stops profiling the main loop if requested"""
+        with self._profile_lock:
+            if self._profile is None or self._profile["mode"] != "cprofile":
+                return
+            profiler = self._profile["profiler"]
+            if time.monotonic() >= self._profile["deadline"] or self._stop:
+                if profiler is not None:
+                    profiler.disable()
+                    profiler.dump_stats(self._profile["path"])
+                self._profile = None
+            elif profiler is None:
+                self._profile["profiler"] = profiler = cProfile.Profile()
+                profiler.enable()
+            
+    def _process_profile_cmd(self, command, sock):
+        try:
+            if not (1 <= len(command) <= 3):
+                sock.sendall(const.MSG_CODE+b"Error: Invalid number of arguments")
+                return
+            try:
+                seconds = float(command[1]) if len(command) >= 2 else 10
+            except ValueError:
+                sock.sendall(const.MSG_CODE+b"Error: Invalid duration")
+                return
+            mode = command[2] if len(command) == 3 else "sample"
+            if mode not in ("sample", "cprofile") or not (0 < seconds <= 3600):
+                sock.sendall(const.MSG_CODE+b"Error: Invalid profiling mode or duration")
+                return
+            try:
+                path = self.profile(seconds, mode)
+            except ValueError as e:
+                sock.sendall(const.MSG_CODE+b"Error: " + str(e).encode())
+                return
+            sock.sendall(const.MSG_CODE+f"Profiling for {seconds:g}s, writing to '{os.path.abspath(path)}'".encode())
+        except Exception:
+            sock.sendall(const.MSG_CODE+b"Error: Couldn't start profiling")
+    
     def _process_command_stop(self, command, sock):
         host = socket.gethostname().encode()
         port = str(self.port).encode()
         sock.sendall(const.MSG_CODE+b"Stopped pypm running on " + host + b":" + port)
         self._stop = True
         
+    def log_metrics(self):
+        """Logs the usage of the processes it is logged for, and drains the
+        output of every process"""
+        self.sample_metrics(self._log_memory + self._log_cpu)
+        for process in self._processes:
+            if process in self._log_memory:
+                self.log_process_memory(process)
+            if process in self._log_cpu:
+                self.log_process_cpu(process)
+                self.log_process_sched(process)
+            # Also drains what processes printed before exiting
+            self.drain_output(process)
+            
+    def drain_full_output(self):
+        """Drains output that filled its buffer right away, so it is neither
+        dropped nor blocked for a whole logging period"""
+        for process in self._processes:
+            if process.output_full and process.active:
+                self.drain_output(process)
+                
+    def update_subscribers(self):
+        """Pushes new output, states and metrics to the subscribers"""
+        for process in self._processes:
+            self.drain_output(process)
+        self.publish_events()
+        
     @property
     def has_active_processes(self):
         return len(list(filter(lambda p: p.active, self._processes))) >= 1
@@ -432,8 +1648,8 @@ class ProcessManager:
     
     def start(self):
         self._socket.bind(("localhost", self.port))
-        for process in self._processes:
-            process.start(True)
+        self._probes.start()
+        self.start_processes(self.services)
         self.main_loop()
         
     def server_loop(self):
@@ -442,32 +1658,55 @@ class ProcessManager:
             try:
                 sock, _ = self._socket.accept()
                 command = sock.recv(2048).decode("utf-8")
-                self._process_command(command, sock)
-                sock.close()
+                if command.split(None, 1)[:1] in ([const.CMD_START_PROCESS], [const.CMD_RESTART_PROCESS]):
+                    # These wait for processes to become ready, which
+                    # mustn't keep other clients waiting. They share the
+                    # executor, so only a few ever run at once.
+                    if self.run_in_background(self._serve, command, sock) is None:
+                        sock.close()
+                else:
+                    self._serve(command, sock)
             except ConnectionResetError:
                 pass
+            
+    def _serve(self, command, sock):
+        if not self._process_command(command, sock):
+            sock.close()
         
     def main_loop(self):
         try:
-            start = time.time()
+            last_log = last_event = time.time()
+            self._sampler = threading.get_ident()
             self._server_thread = threading.Thread(target=self.server_loop)
             self._server_thread.start()
             while not self._stop:
-                if time.time() - start > self.log_period:
-                    
-                    start = time.time()
-                    for process in self._processes:
-                        if process in self._log_memory:
-                            self.log_process_memory(process)
-                        if process in self._log_cpu:
-                            self.log_process_cpu(process)
-                        if process.active:
-                            process.process_stdout()
-                            process.process_stderr()
+                self._wake.clear()
+                self.serve_metric_requests()
+                self._profile_tick()
+                tick = time.perf_counter()
+                now = time.time()
+                self._jobs.tick(now)
+                if self._events.pending:
+                    self.add_subscribers()
+                if len(self._alerts):
+                    self.check_alerts()
+                if now - last_log > self.log_period:
+                    last_log = now
+                    self.log_metrics()
+                else:
+                    self.drain_full_output()
+                if self._events.active and now - last_event > self.event_period:
+                    last_event = now
+                    self.update_subscribers()
+                self._stats.observe("tick", time.perf_counter() - tick)
+                # Woken up early by requests for metrics
+                self._wake.wait(self.tick)
         except KeyboardInterrupt:    
             pass
         finally:
             self._stop = True
+            self.serve_metric_requests()
+            self._profile_tick()
             
             # * In case the server_loop hasn't stopped yet, prevent
             # * socket.accept() from hanging by connecting
@@ -485,6 +1724,9 @@ class ProcessManager:
                 pass
             
             self._socket.close()
-            for process in self._processes:
-                if process.active:
-                    process.kill()
+            self._events.close()
+            self._probes.stop()
+            self._watcher.stop()
+            # Restarts still running finish before everything is stopped
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self.stop_processes(self._processes)
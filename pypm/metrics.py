@@ -0,0 +1,77 @@
+import threading
+from array import array
+
+
+class MetricsTable:
+    __slots__ = ("_rows", "_free", "_lock", "time", "cpu", "mem")
+
+    def __init__(self):
+        """Latest sample of every process, stored by column in arrays of
+        doubles rather than as objects, so each process costs a few bytes per
+        metric. Rows of removed processes are reused.
+
+        Rows are added and removed by whichever thread adds or removes the
+        process, so that is done under a lock, while samples are only ever
+        written by the thread that samples (see ProcessManager.sample_metrics).
+        """
+        self._rows = {}
+        self._free = []
+        self._lock = threading.Lock()
+        self.time = array("d")
+        self.cpu = array("d")
+        self.mem = array("d")
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, name):
+        return name in self._rows
+
+    def row(self, name):
+        """Returns the row of a process, adding it if needed"""
+        with self._lock:
+            row = self._rows.get(name)
+            if row is None:
+                if self._free:
+                    row = self._free.pop()
+                else:
+                    row = len(self.time)
+                    for column in (self.time, self.cpu, self.mem):
+                        column.append(0)
+                self._rows[name] = row
+            return row
+
+    def remove(self, name):
+        with self._lock:
+            row = self._rows.pop(name, None)
+            if row is not None:
+                for column in (self.time, self.cpu, self.mem):
+                    column[row] = 0
+                self._free.append(row)
+
+    def set(self, name, timestamp, cpu, mem):
+        """Records a sample. Samples of processes without a row (removed
+        while they were being sampled) are dropped."""
+        row = self._rows.get(name)
+        if row is None:
+            return
+        self.time[row] = timestamp
+        self.cpu[row] = cpu
+        self.mem[row] = mem
+
+    def get(self, name):
+        """Returns the last (timestamp, cpu, mem) sample of a process, all 0
+        if it has none"""
+        row = self._rows.get(name)
+        if row is None:
+            return 0.0, 0.0, 0.0
+        return self.time[row], self.cpu[row], self.mem[row]
+
+    def age(self, name, now):
+        """Seconds since a process was last sampled"""
+        return now - self.get(name)[0]
+
+    @property
+    def nbytes(self):
+        """Bytes used by the columns"""
+        return sum(c.buffer_info()[1] * c.itemsize for c in (self.time, self.cpu, self.mem))
@@ -1,12 +1,14 @@
 import curses
+import datetime
+import socket
 import sys
 import threading
 import time
 import traceback
 
-from .__main__ import (process_cpu_command, process_mem_command,
-                       process_pid_command, process_stderr_command,
-                       process_stdout_command, process_uptime_command)
+from .client import (process_overview_command, read_events,
+                     subscribe_command)
+from .logs import parse_level
 from .units import Size, Time
 
 CTRL_Z = 26
@@ -18,6 +20,8 @@ K_RIGHT = 454
 K_RETURN = 10
 K_ESCAPE = 27
 K_SPACE = 32
+K_O = 111
+SPARKS = "▁▂▃▄▅▆▇█"
 DISPLAY = {
     "command": "Command",
     "pid": "PID",
@@ -35,11 +39,104 @@ def wrap(string, width):
 def pad(string, size):
     return string[:size] + " "*max(0, size-len(string))
 
+def sparkline(values, width, low=None):
+    """Draws the last values that fit in width as a line of bars, scaled 
+    between low (by default, the smallest value) and the largest value"""
+    values = values[-width:] if width > 0 else []
+    if low is None:
+        low = min(values, default=0)
+    top = max(values, default=0)
+    if top <= low:
+        return SPARKS[0]*len(values)
+    return "".join(SPARKS[round((max(v, low)-low)/(top-low)*(len(SPARKS)-1))] for v in values)
+
+
+class LogBuffer:
+    def __init__(self, max_size=10000):
+        """Text of a log, split in lines, together with an index of those 
+        lines wrapped to the width of the screen and the level of each row.
+        Appending only wraps (and parses) the new lines, and the whole index 
+        is only rebuilt when the width changes.
+
+        Args:
+            max_size (int, optional): Maximum number of characters kept. 
+            Defaults to 10000.
+        """
+        
+        self.max_size = max_size
+        self._lines = [""]
+        self._size = 0
+        self._width = None
+        self._rows = []
+        self._levels = []
+        self._counts = []
+        
+    def reset(self, text=""):
+        self._lines = [""]
+        self._size = 0
+        self._width = None
+        self.append(text)
+        
+    def append(self, text):
+        if text == "":
+            return
+        new = text.split("\n")
+        new[0] = self._lines.pop() + new[0]
+        self._lines.extend(new)
+        self._size += len(text)
+        if self._width is not None:
+            # The last line may have been incomplete, so it's wrapped again
+            last = self._counts.pop()
+            if last > 0:
+                del self._rows[-last:]
+                del self._levels[-last:]
+            for line in new:
+                self._wrap(line)
+        if self._size > self.max_size * 1.5:
+            self._trim()
+            
+    def _wrap(self, line):
+        rows = list(wrap(line.replace("\x00", ""), self._width))
+        self._rows.extend(rows)
+        self._levels.extend([parse_level(line)] * len(rows))
+        self._counts.append(len(rows))
+            
+    def _trim(self):
+        # Trimming is done in batches, since it means copying what's left
+        drop, rows = 0, 0
+        while self._size > self.max_size and drop < len(self._lines)-1:
+            self._size -= len(self._lines[drop]) + 1
+            if self._width is not None:
+                rows += self._counts[drop]
+            drop += 1
+        del self._lines[:drop]
+        if self._width is not None:
+            del self._counts[:drop]
+            del self._rows[:rows]
+            del self._levels[:rows]
+        
+    def rows(self, width):
+        """Returns the wrapped rows of the log for the given width"""
+        if width != self._width:
+            self._width = width
+            self._rows = []
+            self._levels = []
+            self._counts = []
+            for line in self._lines:
+                self._wrap(line)
+        return self._rows
+    
+    def levels(self, width):
+        """Returns the level of each of the rows returned by rows(width)"""
+        self.rows(width)
+        return self._levels
+
 class App:
-    def __init__(self, host, port):
+    def __init__(self, host, port, max_log_size=10000):
         self._host = host
         self._port = port
         self._processes = {}
+        self._names = []
         self._selected_proc = 0
         self._log_offset = 0
         self._log_mode = "stderr"
@@ -49,10 +146,12 @@ class App:
         self._topleftwin = None
         self._toprightwin = None
         self._botrightwin = None
+        self._overviewwin = None
         self._should_update = {
             "topleft": False,
             "topright": False,
-            "botright": False            
+            "botright": False,
+            "overview": False
         }
         self.WHITE = None
         self.YELLOW = None
@@ -62,45 +161,138 @@ class App:
         self.RED = None
         self.rows = 0
         self.cols = 0
+        self.max_log_size = max_log_size
+        self.input_timeout = 100
+        self.overview_period = 2
+        self.overview_samples = 60
         
+        self._lock = threading.RLock()
+        self._sock = None
+        self._resubscribe = False
+        self._start_times = {}
+        self._overview = False
+        self._overview_data = []
+        self._overview_offset = 0
+        self._overview_wakeup = threading.Event()
         self._stop = False
         
-    def update_info(self):
+    @property
+    def selected_name(self):
+        if len(self._names) == 0:
+            return None
+        return self._names[self._selected_proc]
+    
+    def listen(self):
+        """Subscribes to the server's events for the selected process, and 
+        applies them as they arrive. Subscribing again when the selection 
+        changes is done by closing the connection (see resubscribe)."""
         try:
-            start = time.time()
             while not self._stop:
-                if len(self._processes) > 0:
-                    keys = list(self._processes.keys())
-                    proc = keys[self._selected_proc]
-                    if time.time()-start > 1:
-                        mem = process_mem_command([proc], self._host, self._port)
-                        if mem is None:
-                            break
-                        cpu = process_cpu_command([proc], self._host, self._port)
-                        if cpu is None:
-                            break
-                        uptime = process_uptime_command([proc], self._host, self._port)
-                        if uptime is None:
-                            break
-                        pid = process_pid_command([proc], self._host, self._port)
-                        if pid is None:
-                            break
-                        stdout = process_stdout_command([proc], self._host, self._port)
-                        stderr = process_stderr_command([proc], self._host, self._port)
-                        self._processes[proc]["pid"] = pid[proc] if pid[proc] != -1 else "N/A"
-                        self._processes[proc]["uptime"] = uptime[proc]
-                        self._processes[proc]["mem"] = mem[proc]
-                        self._processes[proc]["cpu"] = str(cpu[proc])+"%"
-                        self._processes[proc]["logs"]["stdout"] = stdout
-                        self._processes[proc]["logs"]["stderr"] = stderr
-                        start = time.time()
-                    self.schedule_update(["botright", "topright"])
+                name = self.selected_name
+                sock = subscribe_command([name] if name is not None else [], self._host, self._port)
+                if sock is None:
+                    break
+                self._sock = sock
+                for event in read_events(sock):
+                    with self._lock:
+                        self.handle_event(event)
+                sock.close()
+                if not self._resubscribe:
+                    break
+                self._resubscribe = False
         except Exception:
             traceback.print_exc()
             pass
         finally:
             self._stop = True
             
+    def resubscribe(self):
+        """Drops the current subscription so that listen subscribes again, 
+        for the newly selected process"""
+        if self._sock is not None:
+            self._resubscribe = True
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            
+    def handle_event(self, event):
+        """Applies an event received from the server, scheduling an update of 
+        the panes it affects"""
+        name = event.get("name")
+        if event["type"] == "processes":
+            selected = self.selected_name
+            names = [n for n, _ in event["processes"]]
+            for removed in set(self._processes) - set(names):
+                del self._processes[removed]
+                self._start_times.pop(removed, None)
+            for n, command in event["processes"]:
+                if n not in self._processes:
+                    self.add_process(n, command)
+            self._names = names
+            if len(self._processes) == 0:
+                self._selected_proc = 0
+            elif selected in self._processes:
+                self._selected_proc = names.index(selected)
+            else:
+                self._selected_proc = min(self._selected_proc, len(self._processes)-1)
+                self.resubscribe()
+            self.schedule_update()
+            return
+        if name not in self._processes:
+            return
+        proc = self._processes[name]
+        if event["type"] == "state":
+            proc["pid"] = event["pid"] if event["pid"] != -1 else "N/A"
+            self._start_times[name] = event["start"]
+            self.update_uptime(name)
+        elif event["type"] == "metrics":
+            proc["mem"] = str(Size(event["mem"]))
+            proc["cpu"] = str(event["cpu"])+"%"
+        elif event["type"] == "log":
+            log = proc["logs"][event["stream"]]
+            if event.get("reset"):
+                log.reset(event["data"])
+            else:
+                log.append(event["data"])
+            if name == self.selected_name:
+                self.schedule_update(["topright"])
+            return
+        if name == self.selected_name:
+            self.schedule_update(["botright"])
+            
+    def poll_overview(self):
+        """Fetches the usage and history of every process with a single 
+        request, every overview_period seconds while the overview is shown"""
+        try:
+            while not self._stop:
+                if self._overview:
+                    data = process_overview_command([str(self.overview_samples)], self._host, self._port)
+                    if data is None:
+                        break
+                    with self._lock:
+                        self._overview_data = data
+                        self.schedule_update(["overview"])
+                self._overview_wakeup.wait(self.overview_period)
+                self._overview_wakeup.clear()
+        except Exception:
+            traceback.print_exc()
+        finally:
+            self._stop = True
+            
+    def toggle_overview(self):
+        self._overview = not self._overview
+        self._overview_wakeup.set()
+        self.schedule_update()
+            
+    def update_uptime(self, name):
+        start = self._start_times.get(name)
+        if start is None:
+            self._processes[name]["uptime"] = "0s"
+        else:
+            delta = datetime.timedelta(seconds=time.time()-start)
+            self._processes[name]["uptime"] = str(Time(delta))
+            
     def add_process(self, name, command):
         self._processes[name]={
             "command": command,
@@ -109,10 +301,12 @@ class App:
             "mem": "0.0B",
             "cpu": "0.0%",
             "logs": {
-                "stdout": [],
-                "stderr": []
+                "stdout": LogBuffer(self.max_log_size),
+                "stderr": LogBuffer(self.max_log_size)
             }
         }
+        if name not in self._names:
+            self._names.append(name)
         
     def schedule_update(self, screens=[]):
         if screens == []:
@@ -125,7 +319,10 @@ class App:
             )
         
     def start(self):
-        thread = threading.Thread(target=self.update_info)
+        thread = threading.Thread(target=self.listen)
+        thread.setDaemon(True)
+        thread.start()
+        thread = threading.Thread(target=self.poll_overview)
         thread.setDaemon(True)
         thread.start()
         curses.wrapper(self.main_loop)
@@ -138,13 +335,14 @@ class App:
 
         curses.raw()
         curses.curs_set(False)
-        self._screen.nodelay(True)
+        self._screen.timeout(self.input_timeout)
         lsize = (self.rows-1, self.cols//3)
         self._topleftwin = curses.newwin(*lsize, 0, 0)
         height = self.rows-9
         width = self.cols-lsize[1]
         self._toprightwin = curses.newwin(height, width, 0, lsize[1])
         self._botrightwin = curses.newwin(self.rows-height-1, width, height, lsize[1])
+        self._overviewwin = curses.newwin(self.rows-1, self.cols, 0, 0)
         
         curses.use_default_colors()
         curses.init_pair(1, curses.COLOR_WHITE, curses.COLOR_BLACK)
@@ -162,16 +360,18 @@ class App:
         self.YELLOW = curses.color_pair(6)
         return True
     
-    def get_log_lines(self, ltype):
-        max_x = self._toprightwin.getmaxyx()[1]-4
-        keys = list(self._processes.keys())
-        proc_name = keys[self._selected_proc]
-        proc = self._processes[proc_name]
-        c = 0
-        for line in proc["logs"][ltype]:
-            for sub in wrap(line, max_x):
-                c += 1
-        return c
+    def log_size(self):
+        """Returns the width and height available for the logs"""
+        max_y, max_x = self._toprightwin.getmaxyx()
+        return max_x-4, max_y-3
+    
+    def get_log_rows(self, ltype):
+        proc = self._processes[self.selected_name]
+        return proc["logs"][ltype].rows(self.log_size()[0])
+    
+    def get_log_levels(self, ltype):
+        proc = self._processes[self.selected_name]
+        return proc["logs"][ltype].levels(self.log_size()[0])
         
     def update_topleftwin(self):
         self._topleftwin.erase()
@@ -183,12 +383,8 @@ class App:
         max_y , max_x = self._topleftwin.getmaxyx()
         max_x -= 4
         max_y -= 4
-        for i in range(len(self._processes)):
-            if i-self._proc_offset < 0:
-                continue
-            if i-self._proc_offset >= max_y:
-                break
-            proc = list(self._processes.keys())[i]
+        visible = self._names[self._proc_offset:self._proc_offset+max_y]
+        for i, proc in enumerate(visible, self._proc_offset):
             if i == self._selected_proc:
                 self._topleftwin.attron(self.SELECT)
             self._topleftwin.addstr(2+i-self._proc_offset, 2, pad(proc, max_x))
@@ -207,31 +403,18 @@ class App:
         self._toprightwin.box()
         self._toprightwin.attroff(self.BLUE)
         self._toprightwin.addstr(0, 2, f" Logs ({self._log_mode}) ")
-        self._toprightwin.move(2, 0)
-        max_y , max_x = self._toprightwin.getmaxyx()
-        max_x -= 4
-        max_y -= 3
+        width, height = self.log_size()
         if len(self._processes) > 0:
-            keys = list(self._processes.keys())
-            proc_name = keys[self._selected_proc]
-            proc = self._processes[proc_name]
-            c = self.get_log_lines(self._log_mode)
-            start = max(0, c-max_y)
-            l = 2-start-self._log_offset
-            for line in proc["logs"][self._log_mode]:
-                for sub in wrap(line, max_x):
-                    if l >= 2:
-                        if "warning" in sub.lower():
-                            self._toprightwin.attron(self.YELLOW)
-                        elif "error" in sub.lower() or "critical" in sub.lower():
-                            self._toprightwin.attron(self.RED)
-                        self._toprightwin.addstr(l, 2, sub.replace("\x00", ""))
-                        self._toprightwin.attroff(self.YELLOW|self.RED)
-                    l += 1
-                    if l > max_y:
-                        break
-                if l > max_y:
-                    break
+            rows = self.get_log_rows(self._log_mode)
+            levels = self.get_log_levels(self._log_mode)
+            first = max(0, len(rows)-height) + self._log_offset
+            for l, (sub, level) in enumerate(zip(rows[first:first+height], levels[first:first+height]), 2):
+                if level == "warning":
+                    self._toprightwin.attron(self.YELLOW)
+                elif level in ("error", "critical"):
+                    self._toprightwin.attron(self.RED)
+                self._toprightwin.addstr(l, 2, sub)
+                self._toprightwin.attroff(self.YELLOW|self.RED)
         self._toprightwin.refresh()
         
     def update_botrightwin(self):
@@ -245,8 +428,7 @@ class App:
         max_x -= 4
         max_y -= 3
         if len(self._processes) > 0:
-            keys = list(self._processes.keys())
-            proc_name = keys[self._selected_proc]
+            proc_name = self.selected_name
             proc = self._processes[proc_name]
             if proc["pid"] == "N/A":
                 self._botrightwin.attron(self.RED)
@@ -265,6 +447,37 @@ class App:
                 self._botrightwin.addstr(2+i, 2, f"{attr}: {pad(value, max_x-len(attr)-2)}")
         self._botrightwin.refresh()
         
+    def update_overviewwin(self):
+        self._overviewwin.erase()
+        self._overviewwin.attron(self.BLUE)
+        self._overviewwin.box()
+        self._overviewwin.attroff(self.BLUE)
+        self._overviewwin.addstr(0, 2, " Overview ")
+        max_y, max_x = self._overviewwin.getmaxyx()
+        max_x -= 4
+        height = max_y-4
+        history = (max_x-16-8-10-2) // 2
+        header = pad("Name", 16) + pad("CPU", 8) + pad("Memory", 10) + pad("CPU history", history+1) + "Memory history"
+        self._overviewwin.addstr(1, 2, pad(header, max_x), self.YELLOW)
+        selected = self.selected_name
+        names = [p["name"] for p in self._overview_data]
+        if selected in names:
+            index = names.index(selected)
+            if index < self._overview_offset:
+                self._overview_offset = index
+            elif index >= self._overview_offset+height:
+                self._overview_offset = index-height+1
+        visible = self._overview_data[self._overview_offset:self._overview_offset+height]
+        for l, proc in enumerate(visible, 2):
+            line = (pad(proc["name"], 16)
+                    + pad(f"{round(proc['cpu'], 1)}%", 8)
+                    + pad(str(Size(proc["mem"])), 10)
+                    + pad(sparkline(proc["cpu_history"], history, 0), history+1)
+                    + sparkline(proc["mem_history"], history))
+            attr = self.SELECT if proc["name"] == selected else (self.WHITE if proc["pid"] != -1 else self.RED)
+            self._overviewwin.addstr(l, 2, pad(line, max_x), attr)
+        self._overviewwin.refresh()
+        
     def update_proc_offset(self):
         max_y = self._topleftwin.getmaxyx()[0]-4
         if len(self._processes) < max_y:
@@ -277,6 +490,13 @@ class App:
             elif self._selected_proc-self._proc_offset <= 0:
                 self._proc_offset = self._selected_proc
         
+    def select_process(self):
+        """Called when the selected process changes"""
+        self._log_offset = 0
+        self.update_proc_offset()
+        self.resubscribe()
+        self.schedule_update()
+        
     def main_loop(self, screen):
         self._screen = screen
         if not self.setup():
@@ -285,12 +505,19 @@ class App:
         self._botrightwin.erase()
         self._toprightwin.erase()
         self._topleftwin.erase()
-        string = "Press Ctrl+C to exit | Use [SPACE] to change log mode".center(self.cols-1)
+        string = "Press Ctrl+C to exit | Use [SPACE] to change log mode | [O] overview".center(self.cols-1)
         self._screen.addstr(self.rows-1, 0, string)
         self.schedule_update()
+        last_uptime = time.time()
         
         while not self._stop:
             char = self._screen.getch()
+            if time.time() - last_uptime > 1:
+                last_uptime = time.time()
+                with self._lock:
+                    if self.selected_name is not None:
+                        self.update_uptime(self.selected_name)
+                        self.schedule_update(["botright"])
             if char != -1:
                 if char == curses.KEY_RESIZE:
                     if not self.setup():
@@ -299,7 +526,7 @@ class App:
                     self._botrightwin.erase()
                     self._toprightwin.erase()
                     self._topleftwin.erase()
-                    string = "Press Ctrl+C to exit | Use [SPACE] to change log mode".center(self.cols-1)
+                    string = "Press Ctrl+C to exit | Use [SPACE] to change log mode | [O] overview".center(self.cols-1)
                     self._screen.addstr(self.rows-1, 0, string)
                     self._screen.refresh()
                     self.schedule_update()
@@ -313,6 +540,8 @@ class App:
                             self._log_mode = "stdout"
                         else:
                             self._log_mode = "stderr"
+                elif char == K_O:
+                    self.toggle_overview()
                 elif char == K_RIGHT or char == curses.KEY_RIGHT:
                     self._selected = (self._selected + 1)%3
                     self.schedule_update()
@@ -320,48 +549,45 @@ class App:
                     self._selected = (self._selected - 1)%3
                     self.schedule_update()
                 elif char == K_UP or char == curses.KEY_UP:
-                    if self._selected == 0:
+                    if self._selected == 0 or self._overview:
                         if len(self._processes) != 0:
                             self._selected_proc -= 1
                             self._selected_proc %= len(self._processes)
-                            self.update_proc_offset()
-                            self.schedule_update(["topleft"])
+                            self.select_process()
                     elif self._selected == 1:
                         if len(self._processes) != 0:
-                            keys = list(self._processes.keys())
-                            proc_name = keys[self._selected_proc]
-                            proc = self._processes[proc_name]
-                            lines = self.get_log_lines(self._log_mode)
-                            max_y = self._toprightwin.getmaxyx()[0] - 3
+                            lines = len(self.get_log_rows(self._log_mode))
+                            max_y = self.log_size()[1]
                             if self._log_offset > -(lines - max_y):
                                 self._log_offset -= 1
                                 self.schedule_update(["topright"])
                 elif char == K_DOWN or char == curses.KEY_DOWN:
-                    if self._selected == 0:
+                    if self._selected == 0 or self._overview:
                         if len(self._processes) != 0:
                             self._selected_proc += 1
                             self._selected_proc %= len(self._processes)
-                            self.update_proc_offset()
-                            self.schedule_update(["topleft"])
+                            self.select_process()
                     elif self._selected == 1:
                         if len(self._processes) != 0:
-                            keys = list(self._processes.keys())
-                            proc_name = keys[self._selected_proc]
-                            proc = self._processes[proc_name]
-                            lines = self.get_log_lines(self._log_mode)
                             if self._log_offset < 0:
                                 self._log_offset += 1
                                 self.schedule_update(["topright"])
                 
-            if self._should_update["topleft"]:
-                self.update_topleftwin()
-                self._should_update["topleft"] = False
-            if self._should_update["topright"]:
-                self.update_toprightwin()
-                self._should_update["topright"] = False  
-            if self._should_update["botright"]:
-                self.update_botrightwin()
-                self._should_update["botright"] = False  
+            with self._lock:
+                if self._overview:
+                    if self._should_update["overview"]:
+                        self._should_update["overview"] = False
+                        self.update_overviewwin()
+                    continue
+                if self._should_update["topleft"]:
+                    self._should_update["topleft"] = False
+                    self.update_topleftwin()
+                if self._should_update["topright"]:
+                    self._should_update["topright"] = False  
+                    self.update_toprightwin()
+                if self._should_update["botright"]:
+                    self._should_update["botright"] = False  
+                    self.update_botrightwin()
                 
 
 if __name__ == "__main__":
@@ -1,98 +1,462 @@
+import asyncio
 import datetime
+import logging
 import os
+import shlex
+import signal
 import subprocess
-import tempfile
+import sys
 import threading
+import time
 
 import psutil
 
+from . import capture, health, procfs, scheduling
+from .logs import LogIndex
+from .tree import ProcessTree, memory_info
 from .units import Size, Time
 
 
+_total_memory = None
+
+def total_memory():
+    """Returns the total physical memory, which is only looked up once"""
+    global _total_memory
+    if _total_memory is None:
+        _total_memory = psutil.virtual_memory().total
+    return _total_memory
+
+
+def split_command(command):
+    """Splits a command line into its arguments, the way a shell would
+    (quotes group arguments, and aren't part of them)
+
+    Raises:
+        ValueError: If the quotes aren't balanced or there is no command
+    """
+    argv = shlex.split(command, posix=sys.platform != "win32")
+    if len(argv) == 0:
+        raise ValueError("Empty command")
+    return argv
+
+
+# Windows has no SIGKILL, and only knows how to terminate processes
+SIGKILL = getattr(signal, "SIGKILL", None)
+
+
+def parse_signal(text):
+    """Parses a signal given by name ('TERM', 'SIGTERM') or number.
+
+    Raises:
+        ValueError: If there is no such signal
+    """
+    name = text.upper()
+    try:
+        return signal.Signals(int(text)) if text.isdigit() else signal.Signals[
+            name if name.startswith("SIG") else "SIG" + name]
+    except (KeyError, ValueError):
+        raise ValueError(f"Invalid signal '{text}'") from None
+
+
+class _AsyncChild:
+    __slots__ = ("process",)
+
+    def __init__(self, process):
+        """Gives a child spawned by asyncio the part of the Popen interface
+        that Process relies on. Its exit is noticed by the loop, so poll
+        never blocks or reaps anything itself."""
+        self.process = process
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    def poll(self):
+        return self.process.returncode
+
+    def terminate(self):
+        self.process.terminate()
+
+    def kill(self):
+        self.process.kill()
+
+
+_cpu_count = None
+
+def cpu_count():
+    global _cpu_count
+    if _cpu_count is None:
+        _cpu_count = psutil.cpu_count()
+    return _cpu_count
+
+
 class Process:
-    def __init__(self, name, command, dir="."):
+    # A daemon can manage thousands of processes, so they don't get a __dict__
+    __slots__ = ("max_buff_size", "name", "depends_on", "tree", "mem_metric",
+                 "liveness", "readiness",
+                 "output_policy", "output_buffer",
+                 "env", "job", "watch", "ignore",
+                 "stop_signal", "grace",
+                 "cpus", "nice", "ionice",
+                 "_command", "_argv", "_process", "_handle", "_tree", "_start",
+                 "_outstream", "_errstream", "_outcapture", "_errcapture",
+                 "_outbuff", "_errbuff", "_readers",
+                 "logs", "log_sink", "_dir", "_lock", "_stopping")
+    
+    def __init__(self, name, command, dir=".", tree=False, mem_metric=None,
+                 liveness=None, readiness=None, depends_on=(), 
+                 output_policy=capture.DROP_OLDEST, output_buffer=2**20, env=None,
+                 job=None, watch=(), ignore=(), stop_signal=signal.SIGTERM, grace=10,
+                 cpus=None, nice=None, ionice=None):
         self.max_buff_size = 10000
         self.name = name
+        self.depends_on = list(depends_on)
+        self.tree = tree
+        self.mem_metric = mem_metric
+        self.liveness = liveness
+        self.readiness = readiness
+        self.output_policy = output_policy
+        self.output_buffer = output_buffer
+        self.env = dict(env) if env is not None else {}
+        # A jobs.Job if this process runs to completion instead of being kept
+        # running
+        self.job = job
+        # Paths (relative to dir) whose changes restart the process, except
+        # for those matching the ignore globs
+        self.watch = list(watch)
+        self.ignore = list(ignore)
+        # Sent first when stopping, and followed by SIGKILL if the process is
+        # still running after grace seconds
+        self.stop_signal = stop_signal
+        self.grace = grace
+        # Scheduling settings (see scheduling.apply), None meaning the default
+        self.cpus = cpus
+        self.nice = nice
+        self.ionice = ionice
         self._command = command
+        self._argv = split_command(command)
         self._process = None
-        self._start = Time(0)
-        self._cpu_usage = 0
-        self._thread = None
+        self._handle = None
+        self._tree = None
+        self._start = None
         self._outstream = None
         self._errstream = None
+        self._outcapture = capture.OutputBuffer(output_buffer, output_policy)
+        self._errcapture = capture.OutputBuffer(output_buffer, output_policy)
         self._outbuff = b""
         self._errbuff = b""
+        # Tasks reading the pipes of a child spawned by start_async
+        self._readers = ()
+        self.logs = LogIndex()
+        self.log_sink = None
         self._dir = dir
-        print(self._dir)
+        self._lock = threading.Lock()
+        self._stopping = None
         
     def __eq__(self, other):
         return isinstance(other, Process) and other.name == self.name
         
     def start(self, pipe=False):
-        previous = os.path.abspath(os.curdir)
-        os.chdir(self._dir)
+        # Only one start of the same process at a time, but different 
+        # processes are started in parallel
+        with self._lock:
+            self._spawn(pipe)
+            
+    def _spawn(self, pipe):
+        kwargs, sched = self._prepare_spawn()
+        if pipe:
+            self._process = subprocess.Popen(self._argv,
+                                             stdout=subprocess.PIPE,
+                                             stderr=subprocess.PIPE,
+                                             **kwargs)
+            self._outstream = self._process.stdout
+            self._errstream = self._process.stderr
+            capture.reader().add(self._outstream, self._outcapture)
+            capture.reader().add(self._errstream, self._errcapture)
+        else:
+            self._process = subprocess.Popen(self._argv, **kwargs)
+        if sched:
+            self._apply_scheduling()
+            
+    async def start_async(self):
+        """Same as start(True), for a daemon running on an asyncio loop: the
+        child is spawned through the loop, and its output is read by tasks of
+        the loop instead of the shared reader thread. Processes started this
+        way are stopped with stop_async."""
+        kwargs, sched = self._prepare_spawn()
+        child = await asyncio.create_subprocess_exec(*self._argv,
+                                                     stdout=asyncio.subprocess.PIPE,
+                                                     stderr=asyncio.subprocess.PIPE,
+                                                     **kwargs)
+        self._process = _AsyncChild(child)
+        self._readers = (asyncio.ensure_future(capture.pump(child.stdout, self._outcapture)),
+                         asyncio.ensure_future(capture.pump(child.stderr, self._errcapture)))
+        if sched:
+            self._apply_scheduling()
+            
+    def _prepare_spawn(self):
+        """Resets the state of the last run and builds the arguments shared
+        by every way of spawning the child.
+
+        Raises:
+            OSError: If the process is already running
+
+        Returns:
+            tuple: (keyword arguments for Popen, True if the scheduling
+            settings must be applied once it is running)
+        """
+        
         if self.active:
             raise OSError("Process is already running")
         self._start = datetime.datetime.now()
-        if pipe:
-            self._outstream = tempfile.TemporaryFile()
-            self._errstream = tempfile.TemporaryFile()
-            self._process = subprocess.Popen(self._command.split(),
-                                             stdout=self._outstream,
-                                             stderr=self._errstream)
-        else:
-            self._process = subprocess.Popen(self._command.split())
-        os.chdir(previous)
+        self._handle = None
+        self._tree = None
+        self._stopping = None
+        self.reset_probes()
+        kwargs = {
+            "cwd": self._dir,
+            # Only copied when needed, which is what lets subprocess use its
+            # fastest way of spawning (vfork on Linux)
+            "env": {**os.environ, **self.env} if self.env else None,
+            # Its own process group, so that stopping it also stops whatever
+            # it spawned
+            "start_new_session": sys.platform != "win32"
+        }
+        sched = (self.cpus, self.nice, self.ionice) != (None, None, None)
+        if sched and sys.platform.startswith("linux"):
+            # Applied in the child, so that nothing it spawns (even right
+            # away) misses them. This makes subprocess fork rather than vfork,
+            # but only for processes that have scheduling settings.
+            kwargs["preexec_fn"] = scheduling.preexec(self.cpus, self.nice, self.ionice)
+            sched = self.ionice is not None and not scheduling.ionice_in_child()
+        return kwargs, sched
+    
+    def _apply_scheduling(self):
+        # Elsewhere they can only be applied once it is running
+        try:
+            scheduling.apply([self.handle], self.cpus, self.nice, self.ionice)
+        except (psutil.Error, NotImplementedError) as e:
+            logging.warning(f"Couldn't apply the scheduling settings of '{self.name}': {e}")
+            
+    def set_scheduling(self, cpus=None, nice=None, ionice=None):
+        """Changes scheduling settings (None leaving a setting alone), which
+        also applies them to the running process and all its descendants.
+
+        Raises:
+            psutil.AccessDenied: If raising the priority isn't allowed
+            NotImplementedError: If the platform can't change a setting
+        """
+        
+        if self.active:
+            handles = [self.handle] + self.handle.children(recursive=True)
+            scheduling.apply(handles, cpus, nice, ionice)
+        if cpus is not None:
+            self.cpus = cpus
+        if nice is not None:
+            self.nice = nice
+        if ionice is not None:
+            self.ionice = ionice
             
     @property
     def stdout(self):
+        """The last max_buff_size bytes of stdout, as they were written"""
         return self._outbuff
     
     @property
     def stderr(self):
+        """The last max_buff_size bytes of stderr, as they were written"""
         return self._errbuff
             
     def process_stdout(self):
-        new = self.get_stdout().replace(b"\x00", b"")
-        self._outbuff += new
-        start = max(0, len(self._outbuff)-self.max_buff_size)
-        self._outbuff = self._outbuff[start:]
+        """Moves new output into the stdout buffer and the log, and returns it"""
+        new = self.get_stdout()
+        # Only the tail of the new output can end up in the buffer
+        self._outbuff = (self._outbuff + new[-self.max_buff_size:])[-self.max_buff_size:]
+        records = self.logs.feed("stdout", new)
+        if records and self.log_sink is not None:
+            self.log_sink(records)
+        return new
             
     def process_stderr(self):
-        new = self.get_stderr().replace(b"\x00", b"")
-        self._errbuff += new
-        start = max(0, len(self._errbuff)-self.max_buff_size)
-        self._errbuff = self._errbuff[start:]
+        """Moves new output into the stderr buffer and the log, and returns it"""
+        new = self.get_stderr()
+        # Only the tail of the new output can end up in the buffer
+        self._errbuff = (self._errbuff + new[-self.max_buff_size:])[-self.max_buff_size:]
+        records = self.logs.feed("stderr", new)
+        if records and self.log_sink is not None:
+            self.log_sink(records)
+        return new
         
     def get_stdout(self):
-        self._outstream.flush()
-        self._outstream.seek(0)
-        r = self._outstream.read()
-        self._outstream.truncate(0)
-        return r
+        return self._outcapture.drain()
     
     def get_stderr(self):
-        self._errstream.flush()
-        self._errstream.seek(0)
-        r = self._errstream.read()
-        self._errstream.truncate(0)
-        return r
-        
-    def kill(self):
-        self._start = Time(0)
-        self._process.kill()
-        self._outstream.close()
-        self._errstream.close()
+        return self._errcapture.drain()
+    
+    @property
+    def output_full(self):
+        """True if the output captured since the last drain reached the size
+        of the buffers, so it should be drained before anything is lost"""
+        return self._outcapture.full or self._errcapture.full
+    
+    @property
+    def output_stats(self):
+        """Bytes captured and dropped (by the output policy) on each stream
+        since the process was added"""
+        return {
+            stream: {"bytes": buffer.total, "dropped": buffer.dropped}
+            for stream, buffer in (("stdout", self._outcapture), ("stderr", self._errcapture))
+        }
         
-    def update_cpu(self):
+    def send_signal(self, sig):
+        """Sends a signal to the process' whole group"""
+        if self._process is None:
+            return
+        if sys.platform == "win32":
+            if sig == SIGKILL:
+                self._process.kill()
+            else:
+                self._process.terminate()
+            return
         try:
-            self._cpu_usage = psutil.Process(self.pid).cpu_percent(0.5) / psutil.cpu_count()
-        except psutil.NoSuchProcess:
+            os.killpg(self._process.pid, sig)
+        except ProcessLookupError:
             pass
         
+    def terminate(self):
+        """Asks the process to stop, by sending it its stop signal. Does
+        nothing if that was already done since it started."""
+        if self._stopping is None and self.active:
+            self._stopping = time.monotonic()
+            self.send_signal(self.stop_signal)
+            
+    def kill(self, grace=None):
+        """Stops the process: sends its stop signal, waits for it to exit,
+        then kills whatever is left of its group.
+
+        Args:
+            grace (float, optional): Seconds it has to exit before being 
+            killed, counted from when it was first asked to stop. Defaults
+            to self.grace.
+        """
+        
+        if self._process is None:
+            return
+        if isinstance(self._process, _AsyncChild):
+            raise RuntimeError("Processes started with start_async are stopped with stop_async")
+        if grace is None:
+            grace = self.grace
+        if grace > 0:
+            self.terminate()
+            try:
+                self._process.wait(max(0, self._stopping + grace - time.monotonic()) 
+                                   if self._stopping is not None else 0)
+            except subprocess.TimeoutExpired:
+                pass
+        # Also gets rid of children that outlived it
+        self.send_signal(SIGKILL)
+        self._process.wait()
+        self._forget_run()
+        if self._outstream is not None:
+            # What it wrote before exiting is still read, unless something
+            # that escaped its group keeps the pipes open
+            capture.reader().finish((self._outstream, self._errstream))
+            self._outstream = self._errstream = None
+            
+    async def stop_async(self, grace=None):
+        """Same as kill, for processes started with start_async: the grace
+        period is waited for on the loop instead of blocking it."""
+        if self._process is None:
+            return
+        child = self._process.process
+        if grace is None:
+            grace = self.grace
+        if grace > 0:
+            self.terminate()
+            if self._stopping is not None:
+                try:
+                    await asyncio.wait_for(child.wait(), max(0, self._stopping + grace - time.monotonic()))
+                except asyncio.TimeoutError:
+                    pass
+        self.send_signal(SIGKILL)
+        await child.wait()
+        self._forget_run()
+        # What it wrote before exiting is still read, unless something that
+        # escaped its group keeps the pipes open
+        readers, self._readers = self._readers, ()
+        if readers:
+            _, pending = await asyncio.wait(readers, timeout=1)
+            for task in pending:
+                task.cancel()
+            
+    def _forget_run(self):
+        self._start = None
+        self._handle = None
+        self._tree = None
+        self._stopping = None
+        self.reset_probes()
+        
+    @property
+    def handle(self):
+        """Cached psutil.Process for the running child. It is invalidated
+        whenever the process is started or killed, so a recycled PID is never
+        mistaken for our child."""
+        if self._handle is None or self._handle.pid != self.pid:
+            self._handle = psutil.Process(self.pid)
+        return self._handle
+        
+    @property
+    def process_tree(self):
+        """Cached ProcessTree rooted at the running child"""
+        if self._tree is None:
+            self._tree = ProcessTree(self.handle)
+        return self._tree
+    
+    def pids(self):
+        """Returns the PIDs that count towards this process' usage: only the
+        child itself, or the child and all its descendants if self.tree is set"""
+        if not self.active:
+            return []
+        if self.tree:
+            return self.process_tree.pids()
+        return [self.pid]
+        
+    @property
+    def probes(self):
+        """Returns the health probes of the process"""
+        return [probe for probe in (self.liveness, self.readiness) if probe is not None]
+    
+    def reset_probes(self):
+        for probe in self.probes:
+            probe.reset()
+    
+    @property
+    def health(self):
+        """Returns the status of the liveness and readiness probes (None for
+        missing probes)"""
+        liveness = self.liveness.status if self.liveness is not None else None
+        readiness = self.readiness.status if self.readiness is not None else None
+        return liveness, readiness
+    
+    @property
+    def ready(self):
+        """True if the process is running and its readiness probe (if any)
+        is passing"""
+        if not self.active:
+            return False
+        return self.readiness is None or self.readiness.status == health.PASSING
+        
     @property
     def command(self):
         return self._command
+    
+    @property
+    def argv(self):
+        return list(self._argv)
+    
+    @property
+    def cwd(self):
+        return self._dir
         
     @property
     def active(self):
@@ -100,12 +464,27 @@ class Process:
             return False
         return self._process.poll() is None
     
+    @property
+    def exit_code(self):
+        """Exit code of the last run (None if it never ran or is running)"""
+        if self._process is None:
+            return None
+        return self._process.poll()
+    
     @property 
     def pid(self):
         if self.active:
             return self._process.pid
         return -1
     
+    @property
+    def start_time(self):
+        """UNIX timestamp of when the process was started (None if it isn't
+        running)"""
+        if self.active:
+            return self._start.timestamp()
+        return None
+    
     @property
     def uptime(self):
         if self.active:
@@ -113,24 +492,59 @@ class Process:
         else:
             return Time(0)
     
-    def get_mem_usage(self):
+    @property
+    def detailed_memory(self):
+        """True if the memory metric can only be read from smaps_rollup"""
+        return self.mem_metric in procfs.DETAILED_METRICS
+    
+    def memory_info(self):
+        """Returns the memory usage of the process as a procfs.MemoryInfo"""
+        if self.tree:
+            return self.process_tree.memory_info(self.detailed_memory)
+        if procfs.AVAILABLE:
+            info = procfs.read_memory([self.pid], self.detailed_memory)
+            if self.pid in info:
+                return info[self.pid]
+        return memory_info(self.handle, self.detailed_memory)
+    
+    def get_mem_usage(self, info=None):
+        """Returns the memory usage of the process, according to its memory
+        metric (rss, vms, uss, pss or swap).
+
+        Args:
+            info (procfs.MemoryInfo, optional): Previously read memory info, 
+            usually obtained for many processes at once through 
+            procfs.read_memory. Defaults to None.
+
+        Returns:
+            Size: Memory usage
+        """
+        
+        return Size(self.mem_bytes(info))
+    
+    def mem_bytes(self, info=None):
+        """Same as get_mem_usage, but as a plain number of bytes"""
         if self.active:
-            return Size(psutil.Process(self.pid).memory_info().vms)
+            if info is None:
+                info = self.memory_info()
+            return getattr(info, self.mem_metric or "rss")
         else:
-            return Size(0)
+            return 0
     
-    def get_mem_perc(self):
+    def get_mem_perc(self, info=None):
         if self.active:
-            return psutil.Process(self.pid).memory_percent("vms")
+            return self.mem_bytes(info) / total_memory() * 100
         else:
             return 0
     
     def get_cpu_perc(self):
+        """Returns the CPU usage since the last call (0 on the first one)"""
         if self.active:
-            if self._thread is None or not self._thread.is_alive():
-                self._thread = threading.Thread(target=self.update_cpu)
-                self._thread.setDaemon(True)
-                self._thread.start()
-            return self._cpu_usage
+            if self.tree:
+                return self.process_tree.cpu_percent()
+            try:
+                return self.handle.cpu_percent(None) / cpu_count()
+            except psutil.NoSuchProcess:
+                return 0
         else:
             return 0
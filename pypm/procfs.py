@@ -0,0 +1,116 @@
+import collections
+import os
+import sys
+
+AVAILABLE = sys.platform.startswith("linux") and os.path.isdir("/proc")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if AVAILABLE else 4096
+# smaps_rollup needs Linux 4.14; older kernels only have the per-mapping smaps
+SMAPS_ROLLUP = AVAILABLE and os.path.exists("/proc/self/smaps_rollup")
+
+MemoryInfo = collections.namedtuple("MemoryInfo", ["rss", "vms", "uss", "pss", "swap"])
+# Metrics that can only be read from smaps_rollup
+DETAILED_METRICS = ("uss", "pss", "swap")
+
+
+def _read(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return os.read(fd, 4096)
+    finally:
+        os.close(fd)
+
+def read_statm(pid):
+    """Reads the resident and virtual size of a process from /proc/<pid>/statm
+
+    Args:
+        pid (int): Process ID
+
+    Returns:
+        tuple: (rss, vms) in bytes
+    """
+
+    fields = _read(f"/proc/{pid}/statm").split()
+    return int(fields[1]) * PAGE_SIZE, int(fields[0]) * PAGE_SIZE
+
+def read_smaps_rollup(pid):
+    """Reads the unique, proportional and swapped sizes of a process from
+    /proc/<pid>/smaps_rollup (or by adding up every mapping in
+    /proc/<pid>/smaps on kernels without it). This is considerably more
+    expensive than read_statm, since the kernel has to walk the page tables.
+
+    Args:
+        pid (int): Process ID
+
+    Returns:
+        tuple: (uss, pss, swap) in bytes
+    """
+
+    uss = pss = swap = 0
+    path = f"/proc/{pid}/smaps_rollup" if SMAPS_ROLLUP else f"/proc/{pid}/smaps"
+    with open(path, "rb") as f:
+        for line in f:
+            if line.startswith(b"Private_"):
+                if not line.startswith(b"Private_Hugetlb"):
+                    uss += int(line.split()[1])
+            elif line.startswith(b"Pss:"):
+                pss += int(line.split()[1])
+            elif line.startswith(b"Swap:"):
+                swap += int(line.split()[1])
+    return uss * 1024, pss * 1024, swap * 1024
+
+def read_memory(pids, detailed=False):
+    """Reads the memory usage of several processes in a single sweep.
+
+    Args:
+        pids (iterable): Process IDs
+        detailed (bool, optional): True if uss, pss and swap should also be
+        read (from smaps_rollup). Defaults to False.
+
+    Returns:
+        dict: MemoryInfo for every PID that could be read
+    """
+
+    result = {}
+    for pid in pids:
+        try:
+            rss, vms = read_statm(pid)
+            if detailed:
+                uss, pss, swap = read_smaps_rollup(pid)
+            else:
+                uss = pss = swap = 0
+        except (FileNotFoundError, ProcessLookupError, PermissionError):
+            continue
+        result[pid] = MemoryInfo(rss, vms, uss, pss, swap)
+    return result
+
+SchedInfo = collections.namedtuple("SchedInfo", ["voluntary", "involuntary", "migrations"])
+
+def read_sched(pid):
+    """Reads the context switches and CPU migrations of every thread of a
+    process from /proc/<pid>/task/<tid>/sched (which needs a kernel built
+    with CONFIG_SCHED_DEBUG)
+
+    Args:
+        pid (int): Process ID
+
+    Returns:
+        SchedInfo: Totals since the process started, or None if the kernel
+        doesn't have the sched files
+    """
+
+    totals = {b"nr_voluntary_switches": 0, b"nr_involuntary_switches": 0, b"se.nr_migrations": 0}
+    for tid in os.listdir(f"/proc/{pid}/task"):
+        try:
+            with open(f"/proc/{pid}/task/{tid}/sched", "rb") as f:
+                for line in f:
+                    key, _, value = line.partition(b":")
+                    key = key.strip()
+                    if key in totals:
+                        totals[key] += int(value)
+        except FileNotFoundError:
+            if os.path.isdir(f"/proc/{pid}/task/{tid}"):
+                # The thread is still there, so the kernel lacks the file
+                return None
+            # The thread exited
+            continue
+    return SchedInfo(*totals.values())
@@ -3,11 +3,17 @@ import sys
 from .manager import ProcessManager
 
 
-def main(port=8080, log_dir=None, log_freq=30):
+def main(port=8080, log_dir=None, log_freq=30, mem_metric="rss", max_jobs=4, use_async=False):
     if log_dir == "None":
         log_dir = None
-    pm = ProcessManager(port=port, log_dir=log_dir, log_frequency=log_freq)
+    manager = ProcessManager
+    if use_async:
+        from .asyncmanager import AsyncProcessManager as manager
+    pm = manager(port=port, log_dir=log_dir, log_frequency=log_freq, mem_metric=mem_metric,
+                 max_jobs=max_jobs)
     pm.start()
     
 if __name__ == "__main__":
-    main(int(sys.argv[1]), sys.argv[2], float(sys.argv[3]))
\ No newline at end of file
+    main(int(sys.argv[1]), sys.argv[2], float(sys.argv[3]), sys.argv[4], 
+         int(sys.argv[5]) if len(sys.argv) > 5 else 4,
+         len(sys.argv) > 6 and sys.argv[6] == "True")
\ No newline at end of file
@@ -0,0 +1,147 @@
+import ctypes
+import os
+import platform
+import sys
+
+import psutil
+
+IONICE_CLASSES = ("none", "realtime", "best-effort", "idle")
+_IONICE_ALIASES = {"rt": "realtime", "be": "best-effort"}
+# Number of the ioprio_set system call (which neither libc nor os wrap) on
+# each architecture
+_IOPRIO_SET = {"x86_64": 251, "i386": 289, "i686": 289, "aarch64": 30, "armv7l": 314,
+               "ppc64le": 273, "s390x": 282, "riscv64": 30}
+_IOPRIO_CLASS_SHIFT = 13
+_IOPRIO_WHO_PROCESS = 1
+
+
+def parse_cpus(text):
+    """Parses a CPU list like '0-3,6' ('all' meaning every CPU).
+
+    Raises:
+        ValueError: If the list is invalid or names CPUs that don't exist
+
+    Returns:
+        list: CPU numbers
+    """
+
+    count = psutil.cpu_count()
+    if text == "all":
+        return list(range(count))
+    cpus = set()
+    try:
+        for part in text.split(","):
+            first, _, last = part.partition("-")
+            cpus.update(range(int(first), int(last or first) + 1))
+    except ValueError:
+        raise ValueError(f"Invalid CPU list '{text}'") from None
+    if not cpus or min(cpus) < 0 or max(cpus) >= count:
+        raise ValueError(f"Invalid CPU list '{text}' (there are {count} CPUs)")
+    return sorted(cpus)
+
+def parse_nice(text):
+    """Parses a niceness between -20 (highest priority) and 19 (lowest)"""
+    try:
+        nice = int(text)
+    except ValueError:
+        nice = None
+    if nice is None or not -20 <= nice <= 19:
+        raise ValueError(f"Invalid niceness '{text}' (between -20 and 19)")
+    return nice
+
+def parse_ionice(text):
+    """Parses an I/O priority, a class optionally followed by a level from 0
+    (highest) to 7: 'idle', 'best-effort:4', 'realtime:0' or 'none'.
+
+    Raises:
+        ValueError: If the priority is invalid
+
+    Returns:
+        str: The priority, with the full class name
+    """
+
+    name, _, level = text.lower().partition(":")
+    name = _IONICE_ALIASES.get(name, name)
+    if name not in IONICE_CLASSES:
+        raise ValueError(f"Invalid I/O class '{name}' ({', '.join(IONICE_CLASSES)})")
+    if level:
+        if name in ("none", "idle") or not level.isdigit() or int(level) > 7:
+            raise ValueError(f"Invalid I/O priority '{text}'")
+        return f"{name}:{level}"
+    return name
+
+def apply(handles, cpus=None, nice=None, ionice=None):
+    """Applies scheduling settings to running processes. Settings that are
+    None are left alone.
+
+    Args:
+        handles (list): psutil.Process of each process
+        cpus (list, optional): Allowed CPUs. Defaults to None.
+        nice (int, optional): Niceness. Defaults to None.
+        ionice (str, optional): I/O priority (see parse_ionice). Defaults to
+        None.
+
+    Raises:
+        psutil.AccessDenied: If raising the priority isn't allowed
+        NotImplementedError: If the platform can't change a setting
+    """
+
+    if cpus is not None and not hasattr(psutil.Process, "cpu_affinity"):
+        raise NotImplementedError("CPU affinity isn't supported on this platform")
+    if ionice is not None and not sys.platform.startswith("linux"):
+        raise NotImplementedError("I/O priorities are only supported on Linux")
+    for handle in handles:
+        try:
+            if cpus is not None:
+                handle.cpu_affinity(cpus)
+            if nice is not None:
+                handle.nice(nice)
+            if ionice is not None:
+                name, _, level = ionice.partition(":")
+                ioclass = IONICE_CLASSES.index(name)
+                if level:
+                    handle.ionice(ioclass, int(level))
+                else:
+                    handle.ionice(ioclass)
+        except (psutil.NoSuchProcess, psutil.ZombieProcess):
+            # Exited in the meantime
+            continue
+
+_syscall = False
+
+def _libc_syscall():
+    global _syscall
+    if _syscall is False:
+        _syscall = None
+        if sys.platform.startswith("linux") and platform.machine() in _IOPRIO_SET:
+            try:
+                _syscall = ctypes.CDLL(None, use_errno=True).syscall
+            except (OSError, AttributeError):
+                pass
+    return _syscall
+
+def ionice_in_child():
+    """Returns True if preexec can set I/O priorities, which it does through
+    the ioprio_set system call where its number is known"""
+    return _libc_syscall() is not None
+
+def preexec(cpus=None, nice=None, ionice=None):
+    """Returns a function applying scheduling settings to the calling
+    process, to be run in the child between fork and exec (as preexec_fn),
+    so that it and everything it spawns start with them. Since the daemon
+    has other threads, it only makes system calls: an I/O priority is left
+    out if ionice_in_child is False, and must then be applied once the
+    child is running."""
+    value = None
+    if ionice is not None and ionice_in_child():
+        name, _, level = ionice.partition(":")
+        value = IONICE_CLASSES.index(name) << _IOPRIO_CLASS_SHIFT | int(level or 0)
+        syscall, number = _libc_syscall(), _IOPRIO_SET[platform.machine()]
+    def apply_to_self():
+        if cpus is not None:
+            os.sched_setaffinity(0, cpus)
+        if nice is not None:
+            os.setpriority(os.PRIO_PROCESS, 0, nice)
+        if value is not None and syscall(number, _IOPRIO_WHO_PROCESS, 0, value) != 0:
+            raise OSError(ctypes.get_errno(), "Couldn't set the I/O priority")
+    return apply_to_self
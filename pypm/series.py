@@ -0,0 +1,260 @@
+import logging
+import math
+import os
+import struct
+import time
+
+MAGIC = b"PYPM"
+VERSION = 1
+# Magic, version and the name of the metric the file holds
+HEADER = struct.Struct("<4sB11s")
+# Timestamp and value
+RECORD = struct.Struct("<dd")
+
+_checked = {}
+
+
+def read_header(file):
+    """Reads the header of a series file.
+
+    Args:
+        file (file): File opened in binary mode, positioned at the start
+
+    Returns:
+        str: Name of the metric, or None for legacy (headerless) files
+    """
+
+    data = file.read(HEADER.size)
+    if len(data) < HEADER.size:
+        return None
+    magic, version, metric = HEADER.unpack(data)
+    if magic != MAGIC or version != VERSION:
+        return None
+    return metric.rstrip(b"\x00").decode()
+
+def _prepare(path, metric):
+    """Makes sure the file at path is a series file for the given metric. A
+    file holding something else is moved out of the way first."""
+    if _checked.get(path) == metric:
+        return
+    if os.path.isfile(path) and os.path.getsize(path) > 0:
+        with open(path, "rb") as file:
+            current = read_header(file)
+        if current != metric:
+            # Never over an earlier file moved aside (e.g. rss -> vms -> rss)
+            aside, n = f"{path}.{current or 'old'}", 1
+            while os.path.exists(aside):
+                aside, n = f"{path}.{current or 'old'}.{n}", n + 1
+            os.replace(path, aside)
+            logging.info(f"Moved '{path}' to '{aside}', since it holds {current or 'legacy'} samples rather than {metric}")
+    if not os.path.isfile(path) or os.path.getsize(path) == 0:
+        with open(path, "wb") as file:
+            file.write(HEADER.pack(MAGIC, VERSION, metric.encode()))
+    _checked[path] = metric
+
+def append(path, metric, value, timestamp=None):
+    """Appends a sample to a series file, creating it if needed.
+
+    Args:
+        path (str): Path of the series file
+        metric (str): Name of the metric (rss, vms, cpu, ...)
+        value (float): Sampled value
+        timestamp (float, optional): UNIX timestamp of the sample. Defaults
+        to the current time.
+    """
+
+    _prepare(path, metric)
+    if timestamp is None:
+        timestamp = time.time()
+    with open(path, "ab") as file:
+        file.write(RECORD.pack(timestamp, value))
+
+def read(path):
+    """Reads a whole series file.
+
+    Args:
+        path (str): Path of the series file
+
+    Returns:
+        tuple: (metric, timestamps, values). For legacy files, which only
+        hold native doubles, metric and timestamps are None.
+    """
+
+    with open(path, "rb") as file:
+        metric = read_header(file)
+        if metric is None:
+            file.seek(0)
+            content = file.read()
+            return None, None, list(struct.unpack(f"{len(content)//8}d", content))
+        content = file.read()
+    content = content[:len(content) - len(content) % RECORD.size]
+    records = list(RECORD.iter_unpack(content))
+    return metric, [r[0] for r in records], [r[1] for r in records]
+
+def tail(path, n):
+    """Reads the last n values of a series file, without reading the rest.
+
+    Args:
+        path (str): Path of the series file
+        n (int): Maximum number of values
+
+    Returns:
+        list: Values, oldest first
+    """
+
+    with open(path, "rb") as file:
+        metric = read_header(file)
+        size = os.path.getsize(path)
+        if metric is None:
+            start = max(0, size - n*8)
+            file.seek(start - start % 8)
+            content = file.read()
+            content = content[:len(content) - len(content) % 8]
+            return list(struct.unpack(f"{len(content)//8}d", content))
+        records = (size - HEADER.size) // RECORD.size
+        file.seek(HEADER.size + max(0, records-n) * RECORD.size)
+        content = file.read(min(n, records) * RECORD.size)
+    return [r[1] for r in RECORD.iter_unpack(content)]
+
+def _find(file, count, timestamp):
+    """Binary searches the index of the first record at or after timestamp
+    (records are appended in time order)"""
+    lo, hi = 0, count
+    while lo < hi:
+        mid = (lo + hi) // 2
+        file.seek(HEADER.size + mid * RECORD.size)
+        if RECORD.unpack(file.read(RECORD.size))[0] < timestamp:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+def read_range(path, since=None, until=None, chunk=4096):
+    """Yields the samples of a series file between two times, reading chunk
+    records at a time, so memory doesn't depend on the size of the file.
+    The first one is found with a binary search rather than a scan.
+
+    Args:
+        path (str): Path of the series file
+        since (float, optional): UNIX timestamp of the first sample. Defaults
+        to None (the start of the file).
+        until (float, optional): UNIX timestamp of the last sample. Defaults
+        to None (the end of the file).
+        chunk (int, optional): Records read at once. Defaults to 4096.
+
+    Raises:
+        ValueError: If the file is a legacy one, without timestamps
+
+    Yields:
+        tuple: (timestamp, value)
+    """
+
+    with open(path, "rb") as file:
+        if read_header(file) is None:
+            raise ValueError("Legacy series files have no timestamps")
+        count = (os.path.getsize(path) - HEADER.size) // RECORD.size
+        first = _find(file, count, since) if since is not None else 0
+        file.seek(HEADER.size + first * RECORD.size)
+        remaining = count - first
+        while remaining > 0:
+            n = min(chunk, remaining)
+            remaining -= n
+            for timestamp, value in RECORD.iter_unpack(file.read(n * RECORD.size)):
+                if until is not None and timestamp > until:
+                    return
+                yield timestamp, value
+
+def aggregate(values, name):
+    """Aggregates a list of values: avg, min, max, sum, count, last or a
+    percentile (p50, p95, p99, ...)"""
+    if name == "avg":
+        return sum(values) / len(values)
+    if name in ("min", "max", "sum", "count"):
+        return {"min": min, "max": max, "sum": sum, "count": len}[name](values)
+    if name == "last":
+        return values[-1]
+    # Nearest rank
+    ordered = sorted(values)
+    rank = math.ceil(float(name[1:]) / 100 * len(ordered))
+    return ordered[min(len(ordered), max(1, rank)) - 1]
+
+def check_aggregate(name):
+    """Raises ValueError if name isn't an aggregate known to aggregate"""
+    if name in ("avg", "min", "max", "sum", "count", "last"):
+        return
+    try:
+        if name.startswith("p") and 0 <= float(name[1:]) <= 100:
+            return
+    except ValueError:
+        pass
+    raise ValueError(f"Invalid aggregate '{name}'")
+
+def downsample(samples, step, aggregates=("avg",)):
+    """Aggregates time ordered samples into buckets of step seconds (aligned
+    to multiples of step), holding a single bucket at a time.
+
+    Args:
+        samples (iterable): (timestamp, value) pairs, in time order
+        step (float): Bucket width in seconds
+        aggregates (tuple, optional): See aggregate. Defaults to ("avg",).
+
+    Yields:
+        tuple: (start of the bucket, list with each aggregate), for buckets
+        that have samples
+    """
+
+    bucket, values = None, []
+    for timestamp, value in samples:
+        start = timestamp // step * step
+        if start != bucket:
+            if values:
+                yield bucket, [aggregate(values, a) for a in aggregates]
+            bucket, values = start, []
+        values.append(value)
+    if values:
+        yield bucket, [aggregate(values, a) for a in aggregates]
+
+def read_legacy(path, chunk=4096):
+    """Yields the values of a legacy series file, which holds native doubles
+    (in the byte order of the machine that wrote it) and no timestamps,
+    reading chunk values at a time"""
+    with open(path, "rb") as file:
+        while True:
+            content = file.read(chunk * 8)
+            content = content[:len(content) - len(content) % 8]
+            if not content:
+                return
+            yield from struct.unpack(f"={len(content)//8}d", content)
+
+def write(path, metric, samples, chunk=4096):
+    """Writes samples to a new series file, replacing any file at path.
+
+    Args:
+        path (str): Path of the series file
+        metric (str): Name of the metric
+        samples (iterable): (timestamp, value) pairs, in time order
+        chunk (int, optional): Records written at once. Defaults to 4096.
+
+    Raises:
+        ValueError: If the samples aren't in time order
+
+    Returns:
+        int: Number of samples written
+    """
+
+    count, last, buffer = 0, None, []
+    _checked.pop(path, None)
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, metric.encode()))
+        for timestamp, value in samples:
+            if last is not None and timestamp < last:
+                raise ValueError(f"Samples aren't in time order (at {timestamp})")
+            last = timestamp
+            buffer.append(RECORD.pack(timestamp, value))
+            if len(buffer) >= chunk:
+                file.write(b"".join(buffer))
+                count += len(buffer)
+                buffer = []
+        file.write(b"".join(buffer))
+        count += len(buffer)
+    return count
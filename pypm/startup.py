@@ -0,0 +1,170 @@
+import asyncio
+import concurrent.futures
+import time
+
+
+def dependency_graph(processes):
+    """Maps each process to the processes it depends on.
+
+    Args:
+        processes (list): Processes to start. Dependencies that aren't in this
+        list are assumed to be satisfied already.
+
+    Raises:
+        ValueError: If there is a dependency cycle
+
+    Returns:
+        dict: {name: [names of the dependencies]}
+    """
+
+    graph = {process.name: [] for process in processes}
+    for process in processes:
+        graph[process.name] = [dep for dep in process.depends_on if dep in graph]
+    visiting, done = set(), set()
+    def visit(name, path):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError("Dependency cycle: " + " -> ".join(path + [name]))
+        visiting.add(name)
+        for dep in graph[name]:
+            visit(dep, path + [name])
+        visiting.discard(name)
+        done.add(name)
+    for name in graph:
+        visit(name, [])
+    return graph
+
+def start_all(processes, start, timeout=60, workers=16, poll=0.05):
+    """Starts several processes, each as soon as all of its dependencies are
+    ready. Independent processes are started in parallel, and the calling
+    thread waits for all of them to become ready at once, so the whole
+    startup takes as long as the slowest chain of dependencies however many
+    processes are slow to become ready.
+
+    Args:
+        processes (list): Processes to start
+        start (callable): Called with a process to start it
+        timeout (float, optional): Seconds a process has to become ready
+        before its dependents are given up on. Defaults to 60.
+        workers (int, optional): Maximum number of processes being spawned
+        at once (waiting for them to be ready takes no worker). Defaults to
+        16.
+        poll (float, optional): Seconds between readiness checks. Defaults
+        to 0.05.
+
+    Raises:
+        ValueError: If there is a dependency cycle
+
+    Returns:
+        tuple: (list of processes that started, list of those that didn't)
+    """
+
+    graph = dependency_graph(processes)
+    by_name = {process.name: process for process in processes}
+    dependents = {name: [] for name in graph}
+    missing = {}
+    for name, deps in graph.items():
+        missing[name] = len(deps)
+        for dep in deps:
+            dependents[dep].append(name)
+
+    started, failed = [], []
+    skipped = set()
+    due = [by_name[name] for name, count in missing.items() if count == 0]
+    spawning = {}
+    # {process: deadline to become ready}
+    waiting = {}
+
+    def skip(name):
+        # A dependency failed, so neither this nor its dependents can start
+        if name in skipped:
+            return
+        skipped.add(name)
+        failed.append(by_name[name])
+        for dependent in dependents[name]:
+            skip(dependent)
+
+    def finish(process, ok):
+        (started if process.active else failed).append(process)
+        for dependent in dependents[process.name]:
+            missing[dependent] -= 1
+            if not ok:
+                skip(dependent)
+            elif missing[dependent] == 0 and dependent not in skipped:
+                due.append(by_name[dependent])
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        while due or spawning or waiting:
+            for process in due:
+                spawning[executor.submit(start, process)] = process
+            due.clear()
+            if spawning:
+                done, _ = concurrent.futures.wait(spawning, timeout=poll,
+                                                  return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    process = spawning.pop(future)
+                    if future.exception() is None:
+                        waiting[process.name] = time.monotonic() + timeout
+                    else:
+                        finish(process, False)
+            now = time.monotonic()
+            for name, deadline in list(waiting.items()):
+                process = by_name[name]
+                if process.ready:
+                    del waiting[name]
+                    finish(process, True)
+                elif not process.active or now >= deadline:
+                    del waiting[name]
+                    finish(process, False)
+            if waiting and not due and not spawning:
+                time.sleep(poll)
+    return started, failed
+
+async def wait_ready_async(process, timeout, poll=0.05):
+    """Waits until a process is ready, sleeping on the running loop. Returns
+    False if it stopped running or didn't become ready in time."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.ready:
+            return True
+        if not process.active:
+            return False
+        await asyncio.sleep(poll)
+    return False
+
+async def start_all_async(processes, start, timeout=60):
+    """Same as start_all, on the running asyncio loop: start is a coroutine
+    function, and each process waits for its dependencies in a task rather
+    than a thread, so there is no limit on how many are started at once.
+
+    Raises:
+        ValueError: If there is a dependency cycle
+
+    Returns:
+        tuple: (list of processes that started, list of those that didn't)
+    """
+
+    graph = dependency_graph(processes)
+    by_name = {process.name: process for process in processes}
+    attempted = set()
+    tasks = {}
+
+    async def run(process):
+        for dep in graph[process.name]:
+            if not await tasks[dep]:
+                return False
+        attempted.add(process.name)
+        try:
+            await start(process)
+            return await wait_ready_async(process, timeout)
+        except Exception:
+            return False
+
+    # Every task exists before any of them runs, so dependencies can be
+    # awaited by name
+    for name in graph:
+        tasks[name] = asyncio.ensure_future(run(by_name[name]))
+    await asyncio.gather(*tasks.values())
+    started = [by_name[name] for name in graph if name in attempted and by_name[name].active]
+    return started, [process for process in processes if process not in started]
@@ -0,0 +1,121 @@
+import bisect
+import collections
+import contextlib
+import os
+import sys
+import threading
+import time
+
+# Upper bounds (in seconds) of the histogram buckets, from 10us to ~42s
+BUCKETS = tuple(1e-5 * 2**i for i in range(23))
+
+
+class Histogram:
+    def __init__(self):
+        """Distribution of durations, kept as counts in exponential buckets so
+        that recording is O(log buckets) and the memory used is fixed"""
+        self.counts = [0] * (len(BUCKETS)+1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        """Estimates a percentile as the upper bound of its bucket (or the
+        maximum, if that's lower)"""
+        target = p * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                return min(BUCKETS[i], self.max) if i < len(BUCKETS) else self.max
+        return 0
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else 0,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+            "max": self.max
+        }
+
+
+class Stats:
+    def __init__(self):
+        """Counters and timing histograms of the daemon's own work"""
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._timers = collections.defaultdict(Histogram)
+        self._counters = collections.defaultdict(int)
+
+    def observe(self, name, seconds):
+        with self._lock:
+            self._timers[name].observe(seconds)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self._counters[name] += n
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        """Times the body of a with statement"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self):
+        """Returns every counter and a summary of every timer"""
+        with self._lock:
+            return {
+                "uptime": time.time() - self.started,
+                "timers": {name: h.summary() for name, h in sorted(self._timers.items())},
+                "counters": dict(sorted(self._counters.items()))
+            }
+
+
+def sample_stacks(seconds, interval=0.005):
+    """Samples the stacks of every thread of this process.
+
+    Args:
+        seconds (float): How long to sample for
+        interval (float, optional): Seconds between samples. Defaults to
+        0.005.
+
+    Returns:
+        collections.Counter: Number of samples of each stack, as a tuple of
+        'file:function:line' frames, outermost first
+    """
+
+    me = threading.get_ident()
+    stacks = collections.Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            stacks[tuple(reversed(stack))] += 1
+        time.sleep(interval)
+    return stacks
+
+def write_stacks(stacks, path):
+    """Writes sampled stacks in the collapsed format read by flame graph
+    tools ('frame;frame;frame count' per line)"""
+    with open(path, "w") as file:
+        for stack, count in stacks.most_common():
+            file.write(f"{';'.join(stack)} {count}\n")
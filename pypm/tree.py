@@ -0,0 +1,152 @@
+import os
+import time
+
+import psutil
+
+from . import procfs
+
+_children_map = {}
+_children_map_time = 0
+
+
+def has_children_files():
+    """Returns True if the kernel exposes /proc/<pid>/task/<tid>/children"""
+    return procfs.AVAILABLE and os.path.exists(f"/proc/self/task/{os.getpid()}/children")
+
+def read_children(pid):
+    """Reads the direct children of a process from its task children files"""
+    children = []
+    for tid in os.listdir(f"/proc/{pid}/task"):
+        with open(f"/proc/{pid}/task/{tid}/children", "rb") as f:
+            children.extend(map(int, f.read().split()))
+    return children
+
+def children_map(max_age=1):
+    """Maps every PID on the system to the list of its direct children.
+    Building it means looking at every process, so the result is shared
+    between all the trees refreshed within max_age seconds of each other.
+
+    Args:
+        max_age (float, optional): How old (in seconds) a previously built
+        map can be. Defaults to 1.
+
+    Returns:
+        dict: {ppid: [pid, ...]}
+    """
+
+    global _children_map, _children_map_time
+    if time.monotonic() - _children_map_time <= max_age:
+        return _children_map
+    result = {}
+    if procfs.AVAILABLE:
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat", "rb") as f:
+                    stat = f.read()
+            except (FileNotFoundError, ProcessLookupError):
+                continue
+            ppid = int(stat[stat.rfind(b")")+2:].split(maxsplit=2)[1])
+            result.setdefault(ppid, []).append(int(entry))
+    else:
+        for proc in psutil.process_iter(["ppid"]):
+            result.setdefault(proc.info["ppid"], []).append(proc.pid)
+    _children_map = result
+    _children_map_time = time.monotonic()
+    return result
+
+
+class ProcessTree:
+    def __init__(self, handle, refresh=5):
+        """Keeps track of a process and all of its descendants. The set of
+        descendants is only rediscovered every `refresh` seconds, and the
+        psutil handles of processes that were already known are reused so
+        their CPU counters carry over between queries.
+
+        Args:
+            handle (psutil.Process): Root of the tree
+            refresh (float, optional): Seconds between rediscoveries.
+            Defaults to 5.
+        """
+
+        self.refresh = refresh
+        self._root = handle
+        self._handles = {}
+        self._last_scan = None
+
+    def _scan(self):
+        if has_children_files():
+            def children(pid):
+                try:
+                    return read_children(pid)
+                except (FileNotFoundError, ProcessLookupError):
+                    return []
+        else:
+            cmap = children_map()
+            children = lambda pid: cmap.get(pid, [])
+        handles = {}
+        queue = children(self._root.pid)
+        while queue:
+            pid = queue.pop()
+            if pid in handles:
+                continue
+            handle = self._handles.get(pid)
+            if handle is None:
+                try:
+                    handle = psutil.Process(pid)
+                    handle.cpu_percent(None)
+                except psutil.NoSuchProcess:
+                    continue
+            handles[pid] = handle
+            queue.extend(children(pid))
+        self._handles = handles
+        self._last_scan = time.monotonic()
+
+    def descendants(self):
+        """Returns the psutil handles of every descendant of the root"""
+        if self._last_scan is None or time.monotonic() - self._last_scan > self.refresh:
+            self._scan()
+        return list(self._handles.values())
+
+    def pids(self):
+        """Returns the PIDs of the root and all its descendants"""
+        return [self._root.pid] + [h.pid for h in self.descendants()]
+
+    def memory_info(self, detailed=False):
+        """Returns the memory usage of the whole tree as a procfs.MemoryInfo"""
+        if procfs.AVAILABLE:
+            return sum_memory(procfs.read_memory(self.pids(), detailed).values())
+        infos = []
+        for handle in [self._root] + self.descendants():
+            try:
+                infos.append(memory_info(handle, detailed))
+            except psutil.NoSuchProcess:
+                continue
+        return sum_memory(infos)
+
+    def cpu_percent(self):
+        """Returns the CPU usage of the whole tree since the last call. The
+        first call after a process joins the tree doesn't count it."""
+        total = 0
+        for handle in [self._root] + self.descendants():
+            try:
+                total += handle.cpu_percent(None)
+            except psutil.NoSuchProcess:
+                self._handles.pop(handle.pid, None)
+        return total / psutil.cpu_count()
+
+
+def memory_info(handle, detailed=False):
+    """Reads the memory of a process through psutil, for when /proc isn't
+    available. Returns a procfs.MemoryInfo."""
+    if detailed:
+        mem = handle.memory_full_info()
+        return procfs.MemoryInfo(mem.rss, mem.vms, getattr(mem, "uss", 0), 
+                                 getattr(mem, "pss", 0), getattr(mem, "swap", 0))
+    mem = handle.memory_info()
+    return procfs.MemoryInfo(mem.rss, mem.vms, 0, 0, 0)
+
+def sum_memory(infos):
+    """Adds up a list of procfs.MemoryInfo"""
+    return procfs.MemoryInfo(*map(sum, zip(procfs.MemoryInfo(0, 0, 0, 0, 0), *infos)))
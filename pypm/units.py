@@ -2,6 +2,8 @@ from math import log2
 
 
 class Size:
+    __slots__ = ("_bytes",)
+    
     def __init__(self, value):
         """"Represents the size of an object
 
@@ -43,6 +45,8 @@ class Size:
     
     
 class Time:
+    __slots__ = ("_value",)
+    
     def __init__(self, value):
         """Represents a measure of time
 
@@ -1,14 +1,12 @@
-import struct
 from math import log2
 
 import matplotlib.pyplot as plt
 
+from . import series
+
 
 def get_data(file):
-    with open(file, "rb") as f:
-        content = f.read()
-        data = struct.unpack(f"{len(content)//8}d", content)
-    return data
+    return series.read(file)[2]
 
 def plot_mem_data(data, title="Memory Usage", xlabel="Time", ylabel="Usage"):
     units = ["B", "KB", "MB", "GB"]
@@ -33,7 +31,7 @@ def save_plot(data, file):
 
 if __name__ == "__main__":
     file = input()
-    d = get_data(file)
-    plot_mem_data(d)
+    metric, _, d = series.read(file)
+    plot_mem_data(d, title=f"Memory Usage ({metric or 'vms'})")
     plt.show()
     save_plot(d, "plot.png")
@@ -0,0 +1,326 @@
+import ctypes
+import ctypes.util
+import errno
+import fnmatch
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+# Written files are reported once they are closed, not on every write
+MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT = struct.Struct("iIII")
+
+DEFAULT_IGNORE = (".git", "__pycache__", "*.pyc", "*.swp", "*~")
+
+
+def ignored(path, root, patterns):
+    """Tells whether a path is matched by any of the glob patterns, which are
+    compared with the absolute path, the path relative to the root and each
+    of its components"""
+    relpath = os.path.relpath(path, root)
+    parts = relpath.split(os.sep)
+    for pattern in patterns:
+        if fnmatch.fnmatch(path, pattern) or fnmatch.fnmatch(relpath, pattern):
+            return True
+        if any(fnmatch.fnmatch(part, pattern) for part in parts):
+            return True
+    return False
+
+
+class _Watch:
+    __slots__ = ("roots", "ignore", "callback", "polled", "snapshot")
+
+    def __init__(self, roots, ignore, callback):
+        self.roots = roots
+        self.ignore = ignore
+        self.callback = callback
+        # Set if it couldn't be watched through inotify
+        self.polled = False
+        self.snapshot = None
+
+    def root_of(self, path):
+        """Returns the root containing the path (None if it isn't watched or
+        is ignored)"""
+        for root in self.roots:
+            if path == root or path.startswith(root.rstrip(os.sep) + os.sep):
+                return None if ignored(path, root, self.ignore) else root
+        return None
+
+    def directories(self):
+        """Yields every directory that must be watched"""
+        for root in self.roots:
+            if not os.path.isdir(root):
+                yield os.path.dirname(root)
+                continue
+            for dirpath, dirnames, _ in os.walk(root):
+                dirnames[:] = [d for d in dirnames if not ignored(os.path.join(dirpath, d), root, self.ignore)]
+                yield dirpath
+
+    def scan(self):
+        """Returns the modification time and size of every watched file"""
+        files = {}
+        for root in self.roots:
+            if not os.path.isdir(root):
+                paths = [root]
+            else:
+                paths = []
+                for dirpath, dirnames, filenames in os.walk(root):
+                    dirnames[:] = [d for d in dirnames if not ignored(os.path.join(dirpath, d), root, self.ignore)]
+                    paths.extend(os.path.join(dirpath, f) for f in filenames)
+            for path in paths:
+                if path != root and ignored(path, root, self.ignore):
+                    continue
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files[path] = (st.st_mtime_ns, st.st_size)
+        return files
+
+
+class FileWatcher:
+    def __init__(self, debounce=0.5, poll_interval=2, max_paths=100):
+        """Watches files and directories (recursively) for several owners
+        from a single thread. On Linux changes are reported by inotify, so
+        large trees cost one watch per directory and nothing while idle.
+        Elsewhere, or when inotify runs out of watches, trees are scanned
+        every poll_interval seconds instead. Bursts of changes (like a
+        checkout) are debounced into a single callback.
+
+        Args:
+            debounce (float, optional): Seconds without changes before the
+            callback is called. Defaults to 0.5.
+            poll_interval (float, optional): Seconds between scans of trees
+            that aren't watched through inotify. Defaults to 2.
+            max_paths (int, optional): Maximum number of changed paths passed
+            to a callback. Defaults to 100.
+        """
+
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.max_paths = max_paths
+        self._watches = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._ops = []
+        self._thread = None
+        self._stop = False
+        self._wake_r = self._wake_w = None
+        self._libc = None
+        self._fd = None
+        self._dirs = {}
+        self._wds = {}
+        self._last_poll = 0
+
+    def _init_inotify(self):
+        if not sys.platform.startswith("linux"):
+            return
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        except (OSError, AttributeError):
+            return
+        if fd < 0:
+            logging.warning(f"Couldn't use inotify ({os.strerror(ctypes.get_errno())}), polling instead")
+            return
+        self._libc, self._fd = libc, fd
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        self._init_inotify()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _submit(self, *op):
+        with self._lock:
+            self._ensure_started()
+            self._ops.append(op)
+        os.write(self._wake_w, b"\x00")
+
+    def add(self, key, paths, callback, ignore=DEFAULT_IGNORE):
+        """Starts watching paths.
+
+        Args:
+            key (str): Owner of the watch (e.g. a process name), replacing
+            any previous watch of the same owner
+            paths (list): Files or directories (watched recursively)
+            callback (callable): Called with the list of changed paths, from
+            the watcher's thread
+            ignore (iterable, optional): Glob patterns of paths to ignore.
+            Defaults to DEFAULT_IGNORE.
+        """
+
+        roots = [os.path.abspath(path) for path in paths]
+        self._submit("add", key, _Watch(roots, tuple(ignore), callback))
+
+    def remove(self, key):
+        if self._thread is None:
+            return
+        self._submit("remove", key, None)
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop = True
+        os.write(self._wake_w, b"\x00")
+        self._thread.join()
+        for fd in (self._wake_r, self._wake_w, self._fd):
+            if fd is not None:
+                os.close(fd)
+        self._thread = None
+
+    def _apply(self):
+        with self._lock:
+            ops, self._ops = self._ops, []
+        for op, key, watch in ops:
+            self._watches.pop(key, None)
+            self._pending.pop(key, None)
+            if op == "add":
+                self._watches[key] = watch
+                if self._fd is None or not self._watch_dirs(watch.directories()):
+                    watch.polled = True
+                    watch.snapshot = watch.scan()
+        if self._fd is not None:
+            self._unwatch_unused()
+
+    def _watch_dirs(self, dirs):
+        """Adds an inotify watch to each directory.
+
+        Returns:
+            bool: False if the system ran out of watches
+        """
+
+        for path in dirs:
+            if path in self._wds:
+                continue
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err == errno.ENOSPC:
+                    logging.warning("Out of inotify watches (see fs.inotify.max_user_watches), polling instead")
+                    return False
+                # Deleted or unreadable in the meantime
+                continue
+            self._dirs[wd] = path
+            self._wds[path] = wd
+        return True
+
+    def _unwatch_unused(self):
+        used = set()
+        for watch in self._watches.values():
+            if not watch.polled:
+                for root in watch.roots:
+                    used.add(root if os.path.isdir(root) else os.path.dirname(root))
+        for path, wd in list(self._wds.items()):
+            if not any(path == u or path.startswith(u.rstrip(os.sep) + os.sep) for u in used):
+                self._libc.inotify_rm_watch(self._fd, wd)
+                del self._wds[path]
+                self._dirs.pop(wd, None)
+
+    def _changed(self, key, paths, now):
+        deadline, changed = self._pending.get(key, (0, set()))
+        for path in paths:
+            if len(changed) >= self.max_paths:
+                break
+            changed.add(path)
+        # Every change pushes the deadline back, so a burst fires once
+        self._pending[key] = (now + self.debounce, changed)
+
+    def _read_events(self, now):
+        try:
+            data = os.read(self._fd, 2**16)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, offset)
+            name = data[offset+EVENT.size:offset+EVENT.size+length].rstrip(b"\x00")
+            offset += EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, so anything could have changed
+                for key, watch in self._watches.items():
+                    if not watch.polled:
+                        self._changed(key, watch.roots, now)
+                continue
+            if mask & IN_IGNORED:
+                path = self._dirs.pop(wd, None)
+                if path is not None:
+                    self._wds.pop(path, None)
+                continue
+            directory = self._dirs.get(wd)
+            if directory is None:
+                continue
+            path = os.path.join(directory, os.fsdecode(name)) if name else directory
+            for key, watch in self._watches.items():
+                if watch.polled:
+                    continue
+                root = watch.root_of(path)
+                if root is None:
+                    continue
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and os.path.isdir(root):
+                    self._watch_dirs(_Watch([path], watch.ignore, None).directories())
+                self._changed(key, [path], now)
+
+    def _poll(self, now):
+        for key, watch in self._watches.items():
+            if not watch.polled:
+                continue
+            snapshot = watch.scan()
+            old = watch.snapshot
+            changed = [p for p in snapshot.keys() | old.keys() if snapshot.get(p) != old.get(p)]
+            watch.snapshot = snapshot
+            if changed:
+                self._changed(key, changed, now)
+
+    def _run(self):
+        fds = [self._wake_r] + ([self._fd] if self._fd is not None else [])
+        while not self._stop:
+            now = time.monotonic()
+            timeouts = [deadline - now for deadline, _ in self._pending.values()]
+            if any(watch.polled for watch in self._watches.values()):
+                timeouts.append(self._last_poll + self.poll_interval - now)
+            timeout = max(0, min(timeouts)) if timeouts else None
+            ready, _, _ = select.select(fds, [], [], timeout)
+            now = time.monotonic()
+            if self._wake_r in ready:
+                try:
+                    while os.read(self._wake_r, 4096):
+                        pass
+                except BlockingIOError:
+                    pass
+                self._apply()
+            if self._fd is not None and self._fd in ready:
+                self._read_events(now)
+            if now - self._last_poll >= self.poll_interval:
+                self._last_poll = now
+                self._poll(now)
+            for key, (deadline, changed) in list(self._pending.items()):
+                if deadline <= now:
+                    del self._pending[key]
+                    watch = self._watches.get(key)
+                    if watch is None:
+                        continue
+                    try:
+                        watch.callback(sorted(changed))
+                    except Exception:
+                        logging.exception(f"Watch callback of '{key}' failed")
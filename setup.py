@@ -13,6 +13,7 @@ setuptools.setup(
     author_email="francisco.rodrigues0908@gmail.com",
     description="A simple, python-based process manager",
     install_requires=requirements,
+    extras_require={"parquet": ["pyarrow>=8.0.0"]},
     long_description=long_description,
     long_description_content_type="text/markdown",
     url="https://github.com/ArmindoFlores/pypm",
@@ -0,0 +1,143 @@
+import pytest
+
+from pypm.alerts import (ALL, FIRING, RESOLVED, AlertEngine, Condition, RateWindow, Rule, parse_action,
+                         parse_duration)
+
+
+def test_parse_duration():
+    assert parse_duration("30s") == 30
+    assert parse_duration("1.5m") == 90
+    assert parse_duration("2h") == 7200
+    assert parse_duration("1d") == 86400
+    with pytest.raises(ValueError):
+        parse_duration("10")
+
+
+def test_parse_action():
+    assert parse_action("log") == ("log", None)
+    assert parse_action("restart") == ("restart", None)
+    assert parse_action("webhook:https://example.com/hook") == ("webhook", "https://example.com/hook")
+    assert parse_action("exec:./notify.sh --now") == ("exec", "./notify.sh --now")
+    for action in ("webhook:example.com", "exec:", "log:x", "page"):
+        with pytest.raises(ValueError):
+            parse_action(action)
+
+
+def test_conditions():
+    cond = Condition("mem > 2GB")
+    assert (cond.metric, cond.rate, cond.threshold, cond.duration) == ("mem", False, 2 * 2**30, 0)
+    assert cond.compare(3 * 2**30, cond.threshold)
+    cond = Condition("cpu >= 90% for 5m")
+    assert (cond.metric, cond.threshold, cond.duration) == ("cpu", 90, 300)
+    cond = Condition("rate(mem, 10m) > 1MB/s")
+    assert (cond.metric, cond.rate, cond.window, cond.threshold) == ("mem", True, 600, 2**20)
+    assert Condition("RATE(cpu) < 1").window == 60
+
+
+@pytest.mark.parametrize("spec", ["disk > 1", "mem > 1parsec", "cpu >", "cpu = 5", "rate(mem, 10) > 1"])
+def test_invalid_conditions(spec):
+    with pytest.raises(ValueError):
+        Condition(spec)
+
+
+def test_rate_window_needs_half_a_window():
+    window = RateWindow(80, buckets=8)
+    assert window.add(0, 0) is None
+    assert window.add(39, 78) is None
+    assert window.add(40, 80) == 2
+
+
+def test_rate_window_slides():
+    window = RateWindow(80, buckets=8)
+    for t in range(0, 201, 5):
+        rate = window.add(t, 3.0 * t)
+    assert rate == pytest.approx(3)
+    # Flat from then on: once the window has moved past the growth, the rate
+    # is back to 0
+    for t in range(205, 301, 5):
+        rate = window.add(t, 600.0)
+    assert rate == 0
+
+
+def test_rate_window_is_constant_space():
+    window = RateWindow(60, buckets=4)
+    for t in range(10000):
+        window.add(t, t)
+    assert len(window._times) == 4
+
+
+def test_rule_fires_after_duration_and_resolves():
+    rule = Rule("hot", "web", "cpu > 50 for 10s")
+    assert rule.evaluate("web", 0, 60, 0) is None
+    assert rule.evaluate("web", 10, 60, 0) == FIRING
+    assert rule.evaluate("web", 11, 70, 0) is None
+    assert rule.to_dict()["firing"] == ["web"]
+    assert rule.evaluate("web", 12, 10, 0) == RESOLVED
+    assert rule.to_dict()["firing"] == []
+
+
+def test_rule_duration_restarts_when_condition_stops_holding():
+    rule = Rule("hot", "web", "cpu > 50 for 10s")
+    rule.evaluate("web", 0, 60, 0)
+    rule.evaluate("web", 5, 10, 0)
+    assert rule.evaluate("web", 12, 60, 0) is None
+    assert rule.evaluate("web", 22, 60, 0) == FIRING
+
+
+def test_rate_rule():
+    rule = Rule("leak", "web", "rate(mem, 40s) > 1kb")
+    changes = [rule.evaluate("web", t, 0, t * 2048) for t in range(0, 41, 5)]
+    # Measured once the samples span half the window
+    assert changes.index(FIRING) == 4
+    assert rule.to_dict()["values"]["web"] == 2048
+
+
+def test_engine_evaluates_rules_of_the_process_and_wildcards():
+    engine = AlertEngine()
+    mem = Rule("mem", "web", "mem > 100")
+    everyone = Rule("cpu", ALL, "cpu > 50")
+    assert engine.add(mem)
+    assert engine.add(everyone)
+    assert not engine.add(Rule("mem", "db", "mem > 1"))
+    assert engine.watches("db")
+    engine.observe("web", 0, 90, 200)
+    engine.observe("db", 0, 10, 200)
+    changes = engine.evaluate()
+    assert sorted((r.name, p, s, v) for r, p, s, v in changes) == [("cpu", "web", FIRING, 90),
+                                                                   ("mem", "web", FIRING, 200)]
+    assert engine.backlog == 0
+
+
+def test_engine_only_keeps_the_latest_sample():
+    engine = AlertEngine()
+    engine.add(Rule("mem", "web", "mem > 100"))
+    engine.observe("web", 0, 0, 200)
+    engine.observe("web", 1, 0, 50)
+    engine.observe("other", 1, 0, 500)
+    assert engine.backlog == 1
+    assert engine.evaluate() == []
+
+
+def test_engine_budget_leaves_a_backlog():
+    engine = AlertEngine()
+    engine.add(Rule("cpu", ALL, "cpu > 50"))
+    for name in ("a", "b", "c"):
+        engine.observe(name, 0, 90, 0)
+    # At least one process per call, however small the budget
+    assert len(engine.evaluate(budget=0)) == 1
+    assert engine.backlog == 2
+    assert len(engine.evaluate()) == 2
+
+
+def test_engine_reset_and_remove():
+    engine = AlertEngine()
+    rule = Rule("cpu", "web", "cpu > 50")
+    engine.add(rule)
+    engine.observe("web", 0, 90, 0)
+    engine.evaluate()
+    assert engine.reset("web") == [(rule, "web", RESOLVED, None)]
+    assert engine.reset("web") == []
+    assert engine.remove("cpu") is rule
+    assert engine.remove("cpu") is None
+    assert len(engine) == 0
+    assert not engine.watches("web")
@@ -0,0 +1,96 @@
+import os
+import sys
+import time
+
+import pytest
+
+from pypm.capture import BLOCK, DROP_OLDEST, SAMPLE, OutputBuffer, OutputReader
+
+
+def test_invalid_policy():
+    with pytest.raises(ValueError):
+        OutputBuffer(policy="nope")
+
+
+def test_drain_returns_and_forgets():
+    buffer = OutputBuffer(capacity=100)
+    buffer.write(b"abc")
+    buffer.write(b"def")
+    assert buffer.size == 6
+    assert buffer.drain() == b"abcdef"
+    assert buffer.drain() == b""
+    assert buffer.total == 6
+
+
+def test_drop_oldest_keeps_the_newest_output():
+    buffer = OutputBuffer(capacity=8, policy=DROP_OLDEST)
+    for chunk in (b"aaaa", b"bbbb", b"cccc"):
+        assert buffer.write(chunk)
+    assert buffer.size == 8
+    assert buffer.dropped == 4
+    assert buffer.drain() == b"bbbbcccc"
+
+
+def test_drop_oldest_trims_part_of_a_chunk():
+    buffer = OutputBuffer(capacity=6, policy=DROP_OLDEST)
+    buffer.write(b"aaaa")
+    buffer.write(b"bbbb")
+    assert buffer.dropped == 2
+    assert buffer.drain() == b"aabbbb"
+
+
+def test_sample_keeps_one_chunk_out_of_rate_once_full():
+    buffer = OutputBuffer(capacity=4, policy=SAMPLE, sample_rate=3)
+    buffer.write(b"0000")
+    for i in range(1, 7):
+        assert buffer.write(str(i).encode() * 4)
+    # Chunks 3 and 6 are kept, each making room by dropping older output
+    assert buffer.drain() == b"6666"
+    assert buffer.total == 28
+    assert buffer.dropped == 24
+
+
+def test_block_pauses_until_drained():
+    resumed = []
+    buffer = OutputBuffer(capacity=8, policy=BLOCK)
+    buffer.on_drain = lambda: resumed.append(True)
+    assert buffer.write(b"aaaa")
+    assert not buffer.write(b"bbbbbb")
+    assert buffer.full
+    # Nothing is dropped: the reader stops instead
+    assert buffer.dropped == 0
+    assert buffer.drain() == b"aaaabbbbbb"
+    assert resumed == [True]
+    buffer.drain()
+    assert resumed == [True]
+
+
+def read_pipe(data, buffer, close_writer=True):
+    reader = OutputReader(chunk_size=1024)
+    r, w = os.pipe()
+    file = os.fdopen(r, "rb", buffering=0)
+    reader.add(file, buffer)
+    os.write(w, data)
+    if close_writer:
+        os.close(w)
+    return reader, file, w
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="Pipes are read by a thread each")
+def test_reader_finish_reads_up_to_eof():
+    buffer = OutputBuffer()
+    data = b"x" * 50000 + b"\nlast words\n"
+    reader, file, _ = read_pipe(data, buffer)
+    reader.finish([file])
+    assert file.closed
+    assert buffer.drain() == data
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="Pipes are read by a thread each")
+def test_reader_finish_gives_up_on_pipes_kept_open():
+    buffer = OutputBuffer()
+    reader, file, w = read_pipe(b"partial", buffer, close_writer=False)
+    begin = time.monotonic()
+    reader.finish([file], timeout=0.2)
+    assert time.monotonic() - begin < 1
+    os.close(w)
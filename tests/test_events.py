@@ -0,0 +1,80 @@
+import json
+import socket
+
+from pypm.events import EventBus
+
+
+def read(sock):
+    data = b""
+    while True:
+        try:
+            data += sock.recv(65536)
+        except BlockingIOError:
+            return data
+
+
+def read_events(sock):
+    return [json.loads(line) for line in read(sock).splitlines()]
+
+
+def subscribed(bus, names=()):
+    server, client = socket.socketpair()
+    client.setblocking(False)
+    bus.subscribe(server, names)
+    return server, client
+
+
+def test_new_subscribers_get_the_last_values():
+    bus = EventBus()
+    bus.update("state", "web", pid=1)
+    bus.update("state", "web", pid=2)
+    _, client = subscribed(bus)
+    assert read_events(client) == [{"type": "state", "name": "web", "pid": 2}]
+    # Unchanged values aren't resent
+    bus.update("state", "web", pid=2)
+    assert read_events(client) == []
+
+
+def test_logs_only_go_to_subscribers_of_the_process():
+    bus = EventBus()
+    _, web = subscribed(bus, ["web"])
+    _, other = subscribed(bus)
+    bus.publish({"type": "log", "name": "web", "data": "hi"})
+    assert len(read_events(web)) == 1
+    assert read_events(other) == []
+
+
+def test_slow_subscribers_are_buffered_then_dropped():
+    bus = EventBus(buffer_limit=2**18)
+    server, client = subscribed(bus)
+    event = {"type": "metrics", "name": "web", "data": "x" * 1000}
+    # Never blocks: what the socket doesn't take waits in the buffer, until
+    # there is more than the limit
+    for i in range(10000):
+        bus.publish(event)
+        if not bus.active:
+            break
+        buffered = len(bus._subscribers[0].buffer)
+    assert not bus.active
+    assert 0 < buffered <= 2**18
+    assert server.fileno() == -1
+
+
+def test_buffered_events_are_sent_on_later_publishes():
+    bus = EventBus()
+    _, client = subscribed(bus)
+    event = {"type": "metrics", "name": "web", "data": "x" * 1000}
+    published = 0
+    while not bus._subscribers[0].buffer:
+        bus.publish(event)
+        published += 1
+    received = b""
+    while True:
+        data = read(client)
+        received += data
+        if not data and not bus._subscribers[0].buffer:
+            break
+        # Logs of a process it doesn't follow still flush its buffer
+        bus.publish({"type": "log", "name": "db", "data": ""})
+    assert [json.loads(line) for line in received.splitlines()] == [event] * published
+    assert bus.active
@@ -0,0 +1,83 @@
+import io
+
+import pytest
+
+from pypm import export, series
+
+
+@pytest.fixture
+def path(tmp_path):
+    series._checked.clear()
+    path = str(tmp_path / "worker_log_cpu")
+    series.write(path, "cpu", ((float(t), t * 1.5) for t in range(100)))
+    return path
+
+
+def test_guess_format():
+    assert export.guess_format("out.CSV") == "csv"
+    assert export.guess_format("out.pq") == "parquet"
+    assert export.guess_format("out.txt") is None
+
+
+def test_csv_round_trip(path, tmp_path):
+    out = str(tmp_path / "cpu.csv")
+    assert export.export(path, out, chunk=7) == 100
+    dest = str(tmp_path / "imported")
+    assert export.import_file(out, dest, chunk=7) == ("cpu", 100)
+    assert series.read(dest) == series.read(path)
+    assert list(series.read_range(dest, 10, 12)) == [(10.0, 15.0), (11.0, 16.5), (12.0, 18.0)]
+
+
+def test_export_time_range(path):
+    out = io.StringIO()
+    assert export.export(path, out, since=10, until=12.5) == 3
+    assert out.getvalue().splitlines() == ["timestamp,cpu", "10.0,15.0", "11.0,16.5", "12.0,18.0"]
+
+
+def test_legacy_files_have_no_time_range(tmp_path):
+    path = str(tmp_path / "legacy")
+    with open(path, "wb") as file:
+        file.write(b"\x00" * 16)
+    out = io.StringIO()
+    assert export.export(path, out) == 2
+    assert out.getvalue().splitlines() == ["timestamp,value", ",0.0", ",0.0"]
+    with pytest.raises(ValueError):
+        export.export(path, io.StringIO(), since=1)
+
+
+def test_invalid_format(path):
+    with pytest.raises(ValueError):
+        export.export(path, io.StringIO(), fmt="xlsx")
+    with pytest.raises(ValueError):
+        export.import_file(path, path + ".copy")
+
+
+def test_failed_import_keeps_the_old_file(path, tmp_path):
+    bad = tmp_path / "bad.csv"
+    bad.write_text("timestamp,cpu\n1,1\n3,3\n2,2\n")
+    with pytest.raises(ValueError):
+        export.import_file(str(bad), path)
+    # The samples out of order were written aside, and thrown away
+    assert not (tmp_path / "worker_log_cpu.partial").exists()
+    assert len(series.read(path)[2]) == 100
+
+
+def test_import_rejects_other_files(tmp_path):
+    other = tmp_path / "other.csv"
+    other.write_text("a,b,c\n1,2,3\n")
+    with pytest.raises(ValueError):
+        export.import_file(str(other), str(tmp_path / "dest"))
+    untimed = tmp_path / "untimed.csv"
+    untimed.write_text("timestamp,cpu\n,1\n")
+    with pytest.raises(ValueError):
+        export.import_file(str(untimed), str(tmp_path / "dest"))
+    assert not (tmp_path / "dest").exists()
+
+
+def test_parquet_round_trip(path, tmp_path):
+    pytest.importorskip("pyarrow")
+    out = str(tmp_path / "cpu.parquet")
+    assert export.export(path, out, "parquet", chunk=16) == 100
+    dest = str(tmp_path / "imported")
+    assert export.import_file(out, dest, chunk=16) == ("cpu", 100)
+    assert series.read(dest) == series.read(path)
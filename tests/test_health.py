@@ -0,0 +1,99 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from pypm.health import (FAILING, PASSING, UNKNOWN, ExecProbe, HTTPProbe, Probe, ProbeScheduler, TCPProbe,
+                         parse_probe)
+
+
+class FakeProbe(Probe):
+    def __init__(self, results, **kwargs):
+        """Returns (or raises, or hangs on None) the given results in turn"""
+        super().__init__(**kwargs)
+        self.results = list(results)
+
+    async def check(self):
+        result = self.results.pop(0)
+        if result is None:
+            await asyncio.sleep(10)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def run_checks(probe, n):
+    async def checks():
+        return [await probe.run() for _ in range(n)]
+    return asyncio.run(checks())
+
+
+def test_parse_probe():
+    probe = parse_probe("tcp:8080", period=5)
+    assert isinstance(probe, TCPProbe)
+    assert (probe.host, probe.port, probe.period) == ("localhost", 8080, 5)
+    probe = parse_probe("tcp:db.local:5432")
+    assert (probe.host, probe.port) == ("db.local", 5432)
+    probe = parse_probe("http://localhost:8000/health?full=1")
+    assert isinstance(probe, HTTPProbe)
+    assert (probe.host, probe.port, probe.path) == ("localhost", 8000, "/health?full=1")
+    assert parse_probe("http://example.com").port == 80
+    probe = parse_probe("exec:pg_isready -q")
+    assert isinstance(probe, ExecProbe)
+    assert repr(probe) == "exec:pg_isready -q"
+
+
+@pytest.mark.parametrize("spec", ["tcp:", "tcp:host:port", "https://example.com", "exec:  ", "ping:host", ""])
+def test_invalid_probes(spec):
+    with pytest.raises(ValueError):
+        parse_probe(spec)
+
+
+def test_fails_after_threshold_consecutive_failures():
+    probe = FakeProbe([False, False, False, True], threshold=3)
+    assert probe.status == UNKNOWN
+    assert run_checks(probe, 4) == [UNKNOWN, UNKNOWN, FAILING, PASSING]
+    assert probe.failures == 0
+
+
+def test_a_success_restarts_the_count():
+    probe = FakeProbe([False, False, True, False, False, False], threshold=3)
+    assert run_checks(probe, 6) == [UNKNOWN, UNKNOWN, PASSING, PASSING, PASSING, FAILING]
+
+
+def test_errors_and_timeouts_are_failures():
+    probe = FakeProbe([OSError("refused"), None, ValueError("bad status")], threshold=3, timeout=0.01)
+    assert run_checks(probe, 3)[-1] == FAILING
+    probe.reset()
+    assert (probe.failures, probe.status) == (0, UNKNOWN)
+
+
+class FakeProcess:
+    name = "web"
+    active = True
+
+
+def test_scheduler_runs_probes_until_removed():
+    scheduler = ProbeScheduler(jitter=0)
+    probe = FakeProbe([False] * 1000, period=0.01, threshold=2)
+    failing = threading.Event()
+    statuses = []
+    def callback(process, probe):
+        statuses.append(probe.status)
+        if probe.status == FAILING:
+            failing.set()
+    process = FakeProcess()
+    # Added before it starts, like the probes of processes loaded at startup
+    scheduler.add(process, probe, callback)
+    scheduler.start()
+    try:
+        assert failing.wait(5)
+        scheduler.remove(process)
+        checks = len(statuses)
+        time.sleep(0.1)
+        # At most the check running when it was removed
+        assert len(statuses) <= checks + 1
+    finally:
+        scheduler.stop()
+    assert statuses[:2] == [UNKNOWN, FAILING]
@@ -0,0 +1,147 @@
+import datetime
+
+import pytest
+
+from pypm.jobs import QUEUE, CronExpression, Job, JobScheduler
+
+
+class FakeProcess:
+    def __init__(self, name, job):
+        self.name = name
+        self.job = job
+        self.active = False
+        self.exit_code = None
+
+
+def make_scheduler(max_concurrent=4):
+    started = []
+    def start(process):
+        process.active = True
+        started.append(process.name)
+    finished = []
+    scheduler = JobScheduler(start, lambda *args: finished.append(args), max_concurrent)
+    return scheduler, started, finished
+
+
+def test_cron_fields():
+    cron = CronExpression("*/15 9-17 * jan,jul mon-fri")
+    assert cron.minutes == {0, 15, 30, 45}
+    assert cron.hours == set(range(9, 18))
+    assert cron.months == {1, 7}
+    assert cron.weekdays == {1, 2, 3, 4, 5}
+
+
+def test_cron_macros_and_sunday():
+    assert CronExpression("@hourly").minutes == {0}
+    assert CronExpression("0 0 * * 7").weekdays == {0}
+
+
+@pytest.mark.parametrize("spec", ["* * *", "60 * * * *", "* * * * 8", "*/0 * * * *", "0 0 30 2 *", "a * * * *"])
+def test_cron_invalid(spec):
+    with pytest.raises(ValueError):
+        CronExpression(spec)
+
+
+def test_cron_next_after():
+    cron = CronExpression("30 2 * * *")
+    after = datetime.datetime(2024, 1, 31, 3, 0, 10)
+    assert cron.next_after(after) == datetime.datetime(2024, 2, 1, 2, 30)
+    # Strictly after, even when the given time matches
+    assert cron.next_after(datetime.datetime(2024, 2, 1, 2, 30)) == datetime.datetime(2024, 2, 2, 2, 30)
+
+
+def test_cron_restricted_day_fields_match_either():
+    # The 13th of the month, or any friday
+    cron = CronExpression("0 0 13 * fri")
+    assert cron.next_after(datetime.datetime(2024, 9, 1)) == datetime.datetime(2024, 9, 6)
+    assert cron.next_after(datetime.datetime(2024, 9, 10)) == datetime.datetime(2024, 9, 13)
+
+
+def test_tick_starts_due_jobs_in_order():
+    scheduler, started, _ = make_scheduler()
+    a, b = FakeProcess("a", Job()), FakeProcess("b", Job())
+    scheduler.add(a)
+    scheduler.add(b)
+    scheduler.trigger(b)
+    scheduler.trigger(a)
+    assert scheduler.tick(0) == [b, a]
+    assert started == ["b", "a"]
+    assert scheduler.running == 2
+
+
+def test_tick_respects_max_concurrent():
+    scheduler, started, _ = make_scheduler(max_concurrent=1)
+    a, b = FakeProcess("a", Job()), FakeProcess("b", Job())
+    for process in (a, b):
+        scheduler.add(process)
+        scheduler.trigger(process)
+    scheduler.tick(0)
+    assert started == ["a"]
+    a.active = False
+    scheduler.tick(1)
+    assert started == ["a", "b"]
+
+
+def test_tick_records_finished_runs():
+    scheduler, _, finished = make_scheduler()
+    a = FakeProcess("a", Job())
+    scheduler.add(a)
+    scheduler.trigger(a)
+    scheduler.tick(10)
+    a.active = False
+    a.exit_code = 3
+    scheduler.tick(12)
+    assert finished == [(a, 10, 2, 3)]
+    assert list(a.job.history) == [(10, 2, 3)]
+    assert a.job.to_dict()["last_exit"] == 3
+
+
+def test_overlap_skip():
+    scheduler, started, _ = make_scheduler()
+    a = FakeProcess("a", Job())
+    scheduler.add(a)
+    assert scheduler.trigger(a)
+    scheduler.tick(0)
+    assert not scheduler.trigger(a)
+    assert a.job.skipped == 1
+    assert started == ["a"]
+
+
+def test_queued_run_doesnt_block_other_jobs():
+    scheduler, started, _ = make_scheduler()
+    a, b = FakeProcess("a", Job(overlap=QUEUE)), FakeProcess("b", Job())
+    scheduler.add(a)
+    scheduler.add(b)
+    scheduler.trigger(a)
+    scheduler.tick(0)
+    # a is queued behind its own run, b behind a
+    assert scheduler.trigger(a)
+    assert scheduler.trigger(b)
+    scheduler.tick(1)
+    assert started == ["a", "b"]
+    assert a.job.queued
+    a.active = False
+    scheduler.tick(2)
+    assert started == ["a", "b", "a"]
+    assert not a.job.queued
+
+
+def test_removed_job_isnt_started():
+    scheduler, started, _ = make_scheduler()
+    a = FakeProcess("a", Job())
+    scheduler.add(a)
+    scheduler.trigger(a)
+    scheduler.remove(a)
+    scheduler.tick(0)
+    assert started == []
+
+
+def test_cron_job_is_scheduled():
+    scheduler, started, _ = make_scheduler()
+    a = FakeProcess("a", Job(CronExpression("* * * * *")))
+    scheduler.add(a)
+    assert a.job.next_run is not None
+    scheduler.tick(a.job.next_run - 1)
+    assert started == []
+    scheduler.tick(a.job.next_run)
+    assert started == ["a"]
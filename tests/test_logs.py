@@ -0,0 +1,115 @@
+import pytest
+
+from pypm.logs import (CRITICAL, ERROR, INFO, WARNING, LogFile, LogIndex, merge, parse_level, parse_line, parse_since,
+                       record_filter)
+
+
+def test_parse_level():
+    assert parse_level("2024-01-01 WARN disk almost full") == WARNING
+    assert parse_level("Traceback: fatal error") == CRITICAL
+    assert parse_level("informative, but not a level") is None
+
+
+def test_parse_json_line():
+    level, fields = parse_line('{"severity": "Error", "msg": "boom"}')
+    assert level == ERROR
+    assert fields == {"severity": "Error", "msg": "boom"}
+    assert parse_line("{not json") == (None, None)
+
+
+def test_parse_since():
+    assert parse_since("10m", now=1000) == 400
+    assert parse_since("1700000000.5") == 1700000000.5
+    with pytest.raises(ValueError):
+        parse_since("yesterday")
+
+
+def test_feed_holds_back_partial_lines():
+    index = LogIndex()
+    assert index.feed("stdout", b"partial", 1) == []
+    records = index.feed("stdout", b" line\r\n\nnext\n", 2)
+    assert [r.text for r in records] == ["partial line", "next"]
+    assert len(index) == 2
+
+
+def test_streams_are_split_separately():
+    index = LogIndex()
+    index.feed("stdout", b"out ", 1)
+    index.feed("stderr", b"err\n", 1)
+    index.feed("stdout", b"done\n", 1)
+    assert [(r.stream, r.text) for r in index.query()] == [("stderr", "err"), ("stdout", "out done")]
+
+
+def test_long_lines_are_cut():
+    index = LogIndex(max_line=10)
+    index.feed("stdout", b"x" * 25 + b"\n", 1)
+    assert index.query()[0].text == "x" * 10
+
+
+def test_query_filters():
+    index = LogIndex()
+    index.feed("stdout", b"INFO started\nplain line\n", 10)
+    index.feed("stderr", b"ERROR failed to connect\nWARNING retrying\n", 20)
+    assert [r.text for r in index.query(level=WARNING)] == ["ERROR failed to connect", "WARNING retrying"]
+    assert [r.text for r in index.query(level=INFO, since=15)] == ["ERROR failed to connect", "WARNING retrying"]
+    assert [r.text for r in index.query(grep="^pl")] == ["plain line"]
+    assert [r.text for r in index.query(stream="stdout", limit=1)] == ["plain line"]
+    assert index.query(limit=0) == []
+    with pytest.raises(ValueError):
+        index.query(level="loud")
+
+
+def test_only_recent_records_are_kept():
+    index = LogIndex(max_records=10)
+    for i in range(35):
+        index.feed("stdout", f"ERROR {i}\n".encode(), i)
+    assert len(index) < 20
+    records = index.query(level=ERROR)
+    assert records[-1].text == "ERROR 34"
+    assert [r.text for r in index.query(limit=3)] == ["ERROR 32", "ERROR 33", "ERROR 34"]
+    assert index.query(since=30)[0].text == "ERROR 30"
+
+
+def test_log_file_rotates(tmp_path):
+    path = str(tmp_path / "web.log")
+    log = LogFile(path, max_bytes=200, backups=2)
+    index = LogIndex()
+    for i in range(12):
+        log.write(index.feed("stdout", f"line {i}\n".encode(), i))
+    assert len(log.paths()) == 3
+    texts = [r["text"] for r in log.read()]
+    # The oldest lines were rotated away, and the rest are in order
+    assert texts == [f"line {i}" for i in range(12 - len(texts), 12)]
+    assert 0 < len(texts) < 12
+
+
+def test_log_file_resumes_its_size(tmp_path):
+    path = str(tmp_path / "web.log")
+    LogFile(path, max_bytes=100).write(LogIndex().feed("stdout", b"x" * 80 + b"\n", 1))
+    log = LogFile(path, max_bytes=100)
+    log.write(LogIndex().feed("stdout", b"y\n", 2))
+    assert len(log.paths()) == 2
+
+
+def test_merge_in_time_order():
+    sources = {
+        "a": iter([{"time": 1, "stream": "stdout", "level": None, "text": "a1"},
+                   {"time": 4, "stream": "stdout", "level": ERROR, "text": "a4"}]),
+        "b": iter([{"time": 2, "stream": "stderr", "level": ERROR, "text": "b2"},
+                   {"time": 3, "stream": "stdout", "level": INFO, "text": "b3"}]),
+    }
+    merged = list(merge(sources))
+    assert [(r["name"], r["text"]) for r in merged] == [("a", "a1"), ("b", "b2"), ("b", "b3"), ("a", "a4")]
+
+
+def test_merge_filters_and_limits():
+    def source(name, times):
+        return ({"time": t, "stream": "stdout", "level": ERROR if t % 2 else INFO, "text": f"{name}{t}"}
+                for t in times)
+    sources = {"a": source("a", range(0, 10, 2)), "b": source("b", range(1, 10, 2))}
+    merged = merge(sources, record_filter(level=ERROR), limit=2)
+    assert [r["text"] for r in merged] == ["b7", "b9"]
+    sources = {"a": source("a", range(0, 10, 2)), "b": source("b", range(1, 10, 2))}
+    assert [r["text"] for r in merge(sources, record_filter(grep="a[68]", since=7))] == ["a8"]
+    with pytest.raises(ValueError):
+        record_filter(level="loud")
@@ -0,0 +1,55 @@
+import pytest
+
+from pypm.metrics import MetricsTable
+
+
+def test_set_and_get():
+    table = MetricsTable()
+    table.row("web")
+    table.set("web", 10, 12.5, 2048)
+    assert table.get("web") == (10, 12.5, 2048)
+    assert "web" in table
+    assert table.get("db") == (0, 0, 0)
+
+
+def test_rows_are_reused_after_remove():
+    table = MetricsTable()
+    rows = [table.row(name) for name in ("a", "b", "c")]
+    assert rows == [0, 1, 2]
+    assert table.row("b") == 1
+    table.set("b", 5, 1, 1)
+    table.remove("b")
+    assert "b" not in table
+    # The free row is reused, and starts out empty
+    assert table.row("d") == 1
+    assert table.get("d") == (0, 0, 0)
+    assert len(table.time) == 3
+    table.remove("b")
+    assert table.row("e") == 3
+
+
+def test_samples_of_removed_processes_are_dropped():
+    table = MetricsTable()
+    table.row("web")
+    table.remove("web")
+    table.set("web", 5, 1, 1)
+    assert "web" not in table
+    assert table.get("web") == (0, 0, 0)
+
+
+def test_age():
+    table = MetricsTable()
+    table.row("web")
+    table.set("web", 100, 0, 0)
+    assert table.age("web", 103.5) == pytest.approx(3.5)
+    # Never sampled, so it is always stale
+    table.row("db")
+    assert table.age("db", 103.5) == 103.5
+
+
+def test_nbytes():
+    table = MetricsTable()
+    assert table.nbytes == 0
+    for name in ("a", "b"):
+        table.row(name)
+    assert table.nbytes == 2 * 3 * table.time.itemsize
@@ -0,0 +1,27 @@
+import os
+
+import pytest
+
+from pypm import procfs
+
+pytestmark = pytest.mark.skipif(not procfs.SMAPS_ROLLUP, reason="Needs /proc/<pid>/smaps_rollup")
+
+
+def test_smaps_matches_smaps_rollup(monkeypatch):
+    # Allocated up front, so the usage barely changes between the reads
+    data = bytearray(8 * 2**20)
+    rollup = procfs.read_smaps_rollup(os.getpid())
+    monkeypatch.setattr(procfs, "SMAPS_ROLLUP", False)
+    smaps = procfs.read_smaps_rollup(os.getpid())
+    assert rollup[0] >= len(data)
+    assert smaps == pytest.approx(rollup, rel=0.05)
+
+
+def test_read_memory_skips_processes_that_exited():
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0)
+    os.waitpid(pid, 0)
+    info = procfs.read_memory([os.getpid(), pid], detailed=True)
+    assert list(info) == [os.getpid()]
+    assert info[os.getpid()].pss > 0
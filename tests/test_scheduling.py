@@ -0,0 +1,64 @@
+import os
+import subprocess
+import sys
+
+import psutil
+import pytest
+
+from pypm import scheduling
+
+
+@pytest.fixture
+def cpus(monkeypatch):
+    monkeypatch.setattr(psutil, "cpu_count", lambda: 8)
+
+
+def test_parse_cpus(cpus):
+    assert scheduling.parse_cpus("0-3,6") == [0, 1, 2, 3, 6]
+    assert scheduling.parse_cpus("5,1,1-2") == [1, 2, 5]
+    assert scheduling.parse_cpus("7") == [7]
+    assert scheduling.parse_cpus("all") == list(range(8))
+
+
+@pytest.mark.parametrize("text", ["", "a", "1,,2", "-1", "3-1", "0-8", "8"])
+def test_invalid_cpus(cpus, text):
+    with pytest.raises(ValueError):
+        scheduling.parse_cpus(text)
+
+
+def test_parse_nice():
+    assert scheduling.parse_nice("-20") == -20
+    assert scheduling.parse_nice("19") == 19
+    for text in ("-21", "20", "high", ""):
+        with pytest.raises(ValueError):
+            scheduling.parse_nice(text)
+
+
+def test_parse_ionice():
+    assert scheduling.parse_ionice("idle") == "idle"
+    assert scheduling.parse_ionice("BE:4") == "best-effort:4"
+    assert scheduling.parse_ionice("rt:0") == "realtime:0"
+    assert scheduling.parse_ionice("none") == "none"
+
+
+@pytest.mark.parametrize("text", ["low", "best-effort:8", "realtime:x", "idle:3", "none:0", "be:-1"])
+def test_invalid_ionice(text):
+    with pytest.raises(ValueError):
+        scheduling.parse_ionice(text)
+
+
+class NoPsutil:
+    def __getattr__(self, name):
+        raise AssertionError(f"psutil.{name} used by preexec")
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="Needs sched_setaffinity")
+def test_preexec_only_makes_system_calls(monkeypatch):
+    cpu = sorted(os.sched_getaffinity(0))[0]
+    ionice = "idle" if scheduling.ionice_in_child() else None
+    monkeypatch.setattr(scheduling, "psutil", NoPsutil())
+    preexec = scheduling.preexec(cpus=[cpu], nice=5, ionice=ionice)
+    assert "psutil" not in preexec.__code__.co_names
+    script = "import os; print(sorted(os.sched_getaffinity(0)), os.getpriority(os.PRIO_PROCESS, 0))"
+    output = subprocess.check_output([sys.executable, "-c", script], preexec_fn=preexec)
+    assert output.decode().split() == [f"[{cpu}]", "5"]
@@ -0,0 +1,110 @@
+import struct
+
+import pytest
+
+from pypm import series
+
+
+@pytest.fixture
+def path(tmp_path):
+    series._checked.clear()
+    return str(tmp_path / "worker_log_mem")
+
+
+def test_append_and_read(path):
+    series.append(path, "rss", 1.5, 100.0)
+    series.append(path, "rss", 2.5, 101.0)
+    assert series.read(path) == ("rss", [100.0, 101.0], [1.5, 2.5])
+    with open(path, "rb") as file:
+        assert series.read_header(file) == "rss"
+
+
+def test_read_ignores_a_partial_record(path):
+    series.append(path, "cpu", 1.0, 1.0)
+    with open(path, "ab") as file:
+        file.write(b"\x00" * 5)
+    assert series.read(path) == ("cpu", [1.0], [1.0])
+
+
+def test_legacy_files(path):
+    values = [1.0, 2.0, 3.0]
+    with open(path, "wb") as file:
+        file.write(struct.pack("=3d", *values))
+    assert series.read(path) == (None, None, values)
+    assert series.tail(path, 2) == [2.0, 3.0]
+    assert list(series.read_legacy(path, chunk=2)) == values
+    with pytest.raises(ValueError):
+        list(series.read_range(path))
+
+
+def test_tail(path):
+    for i in range(10):
+        series.append(path, "cpu", float(i), float(i))
+    assert series.tail(path, 3) == [7.0, 8.0, 9.0]
+    assert series.tail(path, 100) == [float(i) for i in range(10)]
+
+
+def test_other_metric_is_moved_aside(path):
+    series.append(path, "rss", 1.0, 1.0)
+    series.append(path, "vms", 2.0, 2.0)
+    series.append(path, "rss", 3.0, 3.0)
+    series.append(path, "vms", 4.0, 4.0)
+    assert series.read(path + ".rss") == ("rss", [1.0], [1.0])
+    assert series.read(path + ".vms") == ("vms", [2.0], [2.0])
+    # Earlier files moved aside are kept
+    assert series.read(path + ".rss.1") == ("rss", [3.0], [3.0])
+    assert series.read(path) == ("vms", [4.0], [4.0])
+
+
+def test_legacy_file_is_moved_aside(path):
+    with open(path, "wb") as file:
+        file.write(struct.pack("=d", 1.0))
+    series.append(path, "cpu", 2.0, 2.0)
+    assert series.read(path + ".old") == (None, None, [1.0])
+    assert series.read(path) == ("cpu", [2.0], [2.0])
+
+
+def test_read_range(path):
+    series.write(path, "cpu", ((float(t), float(t) * 2) for t in range(100)), chunk=7)
+    samples = list(series.read_range(path, 10, 14.5, chunk=3))
+    assert samples == [(10.0, 20.0), (11.0, 22.0), (12.0, 24.0), (13.0, 26.0), (14.0, 28.0)]
+    assert len(list(series.read_range(path))) == 100
+    assert list(series.read_range(path, since=1000)) == []
+
+
+def test_write_round_trip(path):
+    samples = [(1.0, 0.5), (2.0, -1.0), (2.0, 3.25)]
+    assert series.write(path, "rss", samples, chunk=2) == 3
+    metric, timestamps, values = series.read(path)
+    assert metric == "rss"
+    assert list(zip(timestamps, values)) == samples
+
+
+def test_write_rejects_unordered_samples(path):
+    with pytest.raises(ValueError):
+        series.write(path, "rss", [(2.0, 1.0), (1.0, 1.0)])
+
+
+def test_aggregates():
+    values = [4.0, 1.0, 3.0, 2.0]
+    assert series.aggregate(values, "avg") == 2.5
+    assert series.aggregate(values, "min") == 1.0
+    assert series.aggregate(values, "max") == 4.0
+    assert series.aggregate(values, "sum") == 10.0
+    assert series.aggregate(values, "count") == 4
+    assert series.aggregate(values, "last") == 2.0
+    assert series.aggregate(values, "p50") == 2.0
+    assert series.aggregate(values, "p100") == 4.0
+    assert series.aggregate(values, "p0") == 1.0
+
+
+@pytest.mark.parametrize("name", ["median", "p101", "px", ""])
+def test_invalid_aggregate(name):
+    with pytest.raises(ValueError):
+        series.check_aggregate(name)
+
+
+def test_downsample():
+    samples = [(0.0, 1.0), (5.0, 3.0), (10.0, 5.0), (35.0, 7.0)]
+    buckets = list(series.downsample(samples, 10, ("avg", "count")))
+    assert buckets == [(0.0, [2.0, 2]), (10.0, [5.0, 1]), (30.0, [7.0, 1])]
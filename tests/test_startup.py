@@ -0,0 +1,99 @@
+import asyncio
+import time
+
+import pytest
+
+from pypm.startup import dependency_graph, start_all, start_all_async
+
+
+class FakeProcess:
+    def __init__(self, name, depends_on=(), ready_after=0, fails=False):
+        self.name = name
+        self.depends_on = list(depends_on)
+        self.ready_after = ready_after
+        self.fails = fails
+        self.active = False
+        self.started_at = None
+
+    @property
+    def ready(self):
+        return self.active and time.monotonic() - self.started_at >= self.ready_after
+
+
+class Starter:
+    def __init__(self):
+        self.order = []
+
+    def __call__(self, process):
+        self.order.append(process.name)
+        if process.fails:
+            raise OSError("Couldn't start")
+        process.active = True
+        process.started_at = time.monotonic()
+
+    async def start_async(self, process):
+        self(process)
+
+
+def names(processes):
+    return sorted(p.name for p in processes)
+
+
+def test_dependency_graph_ignores_missing_dependencies():
+    graph = dependency_graph([FakeProcess("a", ["b", "other"]), FakeProcess("b")])
+    assert graph == {"a": ["b"], "b": []}
+
+
+def test_dependency_cycle():
+    processes = [FakeProcess("a", ["b"]), FakeProcess("b", ["c"]), FakeProcess("c", ["a"])]
+    with pytest.raises(ValueError, match="cycle"):
+        dependency_graph(processes)
+    with pytest.raises(ValueError):
+        start_all(processes, Starter())
+
+
+def test_start_in_dependency_order():
+    processes = [FakeProcess("web", ["api"]), FakeProcess("api", ["db"]), FakeProcess("db")]
+    starter = Starter()
+    started, failed = start_all(processes, starter)
+    assert starter.order == ["db", "api", "web"]
+    assert names(started) == ["api", "db", "web"]
+    assert failed == []
+
+
+def test_failure_skips_dependents():
+    processes = [FakeProcess("db", fails=True), FakeProcess("api", ["db"]), FakeProcess("web", ["api"]),
+                 FakeProcess("cache")]
+    starter = Starter()
+    started, failed = start_all(processes, starter)
+    assert sorted(starter.order) == ["cache", "db"]
+    assert names(started) == ["cache"]
+    assert names(failed) == ["api", "db", "web"]
+
+
+def test_not_ready_in_time_skips_dependents():
+    processes = [FakeProcess("db", ready_after=10), FakeProcess("api", ["db"])]
+    started, failed = start_all(processes, Starter(), timeout=0.2)
+    # Running, but its dependents were given up on
+    assert names(started) == ["db"]
+    assert names(failed) == ["api"]
+
+
+def test_slow_processes_are_waited_on_together():
+    processes = [FakeProcess(f"p{i}", ready_after=0.3) for i in range(40)]
+    processes.append(FakeProcess("last", [p.name for p in processes]))
+    begin = time.monotonic()
+    started, _ = start_all(processes, Starter(), workers=4)
+    assert len(started) == 41
+    # One wait for readiness, not one per batch of workers
+    assert time.monotonic() - begin < 1.5
+
+
+def test_start_all_async():
+    processes = [FakeProcess("web", ["api"]), FakeProcess("api", ["db"]), FakeProcess("db", fails=True),
+                 FakeProcess("cache")]
+    starter = Starter()
+    started, failed = asyncio.run(start_all_async(processes, starter.start_async))
+    assert sorted(starter.order) == ["cache", "db"]
+    assert names(started) == ["cache"]
+    assert names(failed) == ["api", "db", "web"]
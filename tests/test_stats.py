@@ -0,0 +1,65 @@
+import pytest
+
+from pypm.manager import command_timer
+from pypm.stats import BUCKETS, Histogram, Stats
+
+
+def test_empty_histogram():
+    histogram = Histogram()
+    assert histogram.percentile(0.5) == 0
+    assert histogram.summary() == {"count": 0, "total": 0, "mean": 0, "p50": 0, "p95": 0, "p99": 0, "max": 0}
+
+
+def test_percentile_is_the_upper_bound_of_its_bucket():
+    histogram = Histogram()
+    for _ in range(9):
+        histogram.observe(1.5e-5)
+    histogram.observe(1)
+    # 1.5e-5 falls in the bucket up to 2e-5
+    assert histogram.percentile(0.5) == BUCKETS[1]
+    assert histogram.percentile(0.9) == BUCKETS[1]
+    assert histogram.percentile(0.95) == 1
+
+
+def test_values_on_a_bucket_edge_count_in_that_bucket():
+    histogram = Histogram()
+    histogram.observe(BUCKETS[3])
+    histogram.observe(BUCKETS[5])
+    assert histogram.counts[3] == histogram.counts[5] == 1
+    assert histogram.percentile(0.5) == BUCKETS[3]
+
+
+def test_percentile_is_capped_at_the_max():
+    histogram = Histogram()
+    histogram.observe(0.003)
+    assert histogram.percentile(0.99) == 0.003
+    # Beyond the last bucket, only the max is known
+    histogram.observe(100)
+    assert histogram.counts[-1] == 1
+    assert histogram.percentile(1) == 100
+
+
+def test_summary():
+    histogram = Histogram()
+    for value in (0.001, 0.003):
+        histogram.observe(value)
+    summary = histogram.summary()
+    assert summary["count"] == 2
+    assert summary["mean"] == pytest.approx(0.002)
+    assert summary["max"] == 0.003
+
+
+def test_stats_snapshot():
+    stats = Stats()
+    stats.count("restarts")
+    stats.count("restarts", 2)
+    with stats.timer("tick"):
+        pass
+    snapshot = stats.snapshot()
+    assert snapshot["counters"] == {"restarts": 3}
+    assert snapshot["timers"]["tick"]["count"] == 1
+
+
+def test_only_known_commands_are_timed():
+    assert command_timer("procstatus") == "command.procstatus"
+    assert command_timer("anything else") == "command.unknown"